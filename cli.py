@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""Command-line front end for km-plot; never imports GTK.
+
+    python3 cli.py --device /dev/ttyUSB0 [--speed 20 ...] drawing.svg [more.svg ...]
+    python3 cli.py --device 0403:6001 first.svg second.svg third.svg
+    python3 cli.py --device /dev/ttyUSB0 --device /dev/ttyUSB1 *.svg
+    python3 cli.py --device /dev/ttyUSB0 stress-test.hpgl
+    python3 cli.py --estimate drawing.svg
+    python3 cli.py --list-jobs
+    python3 cli.py --resume JOB_ID
+    python3 cli.py --recut [JOB_ID] [--device /dev/ttyUSB1]
+
+Documents are spooled in order and each goes to the first of the given
+plotters (a VID:PID means every port with it) that is free, so several plotters
+cut at once, one sender thread per port. Every option PlotEngine understands
+(see plot.PLOTTER_DEFAULTS) is accepted as ``--name value``. Progress and
+results are printed to stdout as one JSON object per line, each with an "event"
+key: start, progress, done, queued, estimate, job or error; job events carry the
+job id and the port. Files ending in .hpgl, .hpg or .plt are taken as
+pre-generated HPGL and sent as they are, straight from the file (see
+PlotEngine.perform_cut_file). Ctrl-C cancels the running jobs cleanly; a second Ctrl-C
+aborts at once.
+
+Jobs go through the spool (see spool.py): when another km-plot process is
+already sending, documents are queued behind its jobs ("queued" event) and
+that process sends them. --resume queues an interrupted job again from its
+last checkpoint and --run-spool sends whatever is queued. --recut queues a
+finished job (by default the last one sent) again as it is, for the given
+devices or the port it went to. Generated HPGL is cached (see jobcache.py), so
+documents plotted before with the same options start sending at once.
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+
+import importprofile
+
+# Per-module import timing on stderr (KM_PLOT_PROFILE_IMPORTS=1); installed before anything heavy loads.
+importprofile.install_from_env()
+
+from pathlib import Path
+
+# Make bundled deps (e.g., pyserial) importable before loading inkex.
+BASE_DIR = Path(__file__).resolve().parent
+DEPS_DIR = BASE_DIR / "deps"
+if DEPS_DIR.exists():
+    sys.path.insert(0, str(DEPS_DIR))
+
+# Enable stderr logging when set True (or via KM_PLOT_DEBUG=1 environment variable).
+DEBUG = os.environ.get("KM_PLOT_DEBUG", "").lower() in {"1", "true", "yes"}
+
+# Exit statuses; argparse already uses 2 for usage errors.
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_NO_DEVICE = 3
+EXIT_CANCELLED = 130
+# Minimum seconds between progress lines for one job.
+PROGRESS_INTERVAL = 0.5
+VIDPID = re.compile(r"^[0-9a-fA-F]{4}:[0-9a-fA-F]{4}$")
+# Documents with these suffixes are finished HPGL, sent without conversion.
+HPGL_SUFFIXES = (".hpgl", ".hpg", ".plt")
+
+import inkex
+import dispatch
+import spool
+from plot import PLOTTER_DEFAULTS, PlotEngine, list_usb_ports
+
+
+class HeadlessPlot:
+    """Stands in for the Inkscape extension: PlotEngine needs svg, options and debug()."""
+
+    def __init__(self, options):
+        self.options = options
+        self.svg = None
+        self.current_vidpid = None
+
+    def load(self, path):
+        self.svg = inkex.load_svg(path).getroot()
+
+    def debug(self, message):
+        if DEBUG:
+            print(f"[KMPlot] {message}", file=sys.stderr, flush=True)
+
+
+def resolve_devices(spec):
+    """Map one --device to [(path, vid:pid or None)]; a VID:PID gives every matching port."""
+    if not VIDPID.match(spec):
+        try:
+            ports = dict(list_usb_ports())
+        except RuntimeError:
+            ports = {}
+        return [(spec, ports.get(spec))]
+    wanted = spec.lower()
+    return [(device, vidpid) for device, vidpid in list_usb_ports() if vidpid == wanted]
+
+
+def option_type(default):
+    if isinstance(default, bool):
+        return inkex.Boolean
+    if isinstance(default, float):
+        return float
+    if isinstance(default, int):
+        return int
+    return str
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Plot SVG files with km-plot, without the GUI.",
+    )
+    parser.add_argument("svg", nargs="*", help="SVG documents (or .hpgl/.plt files), handled in order")
+    parser.add_argument(
+        "--device",
+        action="append",
+        help="serial port path, or a VID:PID for every matching port; repeat for more plotters. "
+        "Documents go to whichever of them is free next",
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="generate each job without opening a port and print its size and time estimate",
+    )
+    parser.add_argument("--list-jobs", action="store_true", help="print the spooled jobs and exit")
+    parser.add_argument("--resume", metavar="JOB_ID", help="queue an interrupted spooled job again and send the queue")
+    parser.add_argument("--run-spool", action="store_true", help="send the queued jobs, then exit")
+    parser.add_argument(
+        "--recut",
+        nargs="?",
+        const="last",
+        metavar="JOB_ID",
+        help="cut a finished job again (default: the last one sent), on --device or the port it went to",
+    )
+    parser.add_argument(
+        "--keep-going",
+        action="store_true",
+        help="continue with the next document after a failed one",
+    )
+    for key, value in PLOTTER_DEFAULTS.items():
+        parser.add_argument(f"--{key}", type=option_type(value), default=value, metavar=type(value).__name__.upper())
+    return parser
+
+
+def emit(event, **fields):
+    print(json.dumps(dict({"event": event}, **fields)), flush=True)
+
+
+def job_fields(job):
+    manifest = job.manifest
+    return {
+        "id": job.id,
+        "name": manifest.get("name"),
+        "state": job.state,
+        "device": manifest.get("device"),
+        "bytes": job.size(),
+        "checkpoint": manifest.get("checkpoint"),
+        "error": manifest.get("error"),
+        "source": manifest.get("source"),
+    }
+
+
+def read_hpgl(path):
+    """A pre-generated HPGL file as text pieces, read a block at a time."""
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(spool.READ_BLOCK), b""):
+            yield block.decode("latin-1")
+
+
+class JobReporter:
+    """Dispatcher callbacks printing "start", throttled "progress" and "done"/"error" lines per job."""
+
+    def __init__(self):
+        self.last = {}
+        self.lock = threading.Lock()
+        self.failed = 0
+        self.cancelled = 0
+
+    def progress(self, port, job, sent, total, rate):
+        now = time.monotonic()
+        if total and sent < total and now - self.last.get(job.id, 0.0) < PROGRESS_INTERVAL:
+            return
+        self.last[job.id] = now
+        with self.lock:
+            emit(
+                "progress", file=job.manifest.get("name"), job=job.id, device=port,
+                sent=sent, total=total, rate=round(rate, 1),
+            )
+
+    def on_job(self, event, port, job):
+        fields = {"file": job.manifest.get("name"), "job": job.id, "device": port}
+        with self.lock:
+            if event == "start":
+                emit("start", **fields)
+            elif job.state == "done":
+                emit("done", **fields, **(job.manifest.get("result") or {}))
+            elif job.state == "cancelled":
+                self.cancelled += 1
+                emit("error", **fields, error=job.manifest.get("error"), cancelled=True)
+            elif job.state != "queued":
+                self.failed += 1
+                emit("error", **fields, error=job.manifest.get("error"))
+
+
+def finish_jobs(queue, job_ids, senders, cancel, reporter):
+    """Report jobs left queued because their plotters failed, or cancel them."""
+    for job_id in job_ids:
+        job = queue.get(job_id)
+        if job is None or job.state != "queued":
+            continue
+        if cancel.is_set():
+            job.update(state="cancelled", error="Cancelled before sending")
+            reporter.cancelled += 1
+            emit("error", file=job.manifest.get("name"), job=job.id, error=job.manifest["error"], cancelled=True)
+            continue
+        errors = [str(senders[port].error) for port in job.targets if port in senders and senders[port].error]
+        if errors:
+            reporter.failed += 1
+            emit("error", file=job.manifest.get("name"), job=job.id, error="Not sent: " + "; ".join(errors))
+
+
+def exit_status(reporter, cancel):
+    if cancel.is_set() or reporter.cancelled:
+        return EXIT_CANCELLED
+    return EXIT_FAILED if reporter.failed else EXIT_OK
+
+
+def run_spool(queue, cancel, resume=None):
+    """Send the queued jobs (after re-queueing ``resume``) if no other process is sending them."""
+    if resume is not None:
+        running = queue.acquire()
+        job = queue.get(resume)
+        queue.release()
+        if job is None or job.state == "done" or (job.state == "sending" and not running):
+            emit("error", job=resume, error=f"Job is {job.state}" if job else "No such job in the spool")
+            return EXIT_FAILED
+        # With the lock free, a job left "sending" belongs to a process that died mid-job.
+        queue.requeue(job)
+    reporter = JobReporter()
+    senders = dispatch.send_queue(
+        queue, HeadlessPlot(None).debug, reporter.progress, cancel, on_job=reporter.on_job
+    )
+    queue.prune()
+    if senders is None:
+        emit("queued", job=resume, error="Another km-plot process is sending the queue")
+        return EXIT_OK
+    return exit_status(reporter, cancel)
+
+
+def recut_job(queue, job_id, ports, cancel):
+    """Queue a finished job again for ``ports`` (default: the port it went to) and send the queue."""
+    vidpids = {vidpid for _device, vidpid in ports} if ports else None
+    job = queue.last_done(vidpids) if job_id == "last" else queue.get(job_id)
+    if job is None or job.state != "done":
+        emit("error", job=job_id, error=f"Job is {job.state}" if job else "No finished job in the spool")
+        return EXIT_FAILED
+    unsupported = sorted(vidpid for vidpid in vidpids or () if not job.portable_to(vidpid))
+    if unsupported:
+        emit(
+            "error", job=job.id,
+            error=f"Job uses {job.manifest.get('encoding')} output, which {', '.join(unsupported)} is not set up for",
+        )
+        return EXIT_FAILED
+    targets = [device for device, _vidpid in ports]
+    try:
+        jobs = [queue.recut(job, [port]) for port in targets] if targets else [queue.recut(job)]
+    except OSError as exc:
+        emit("error", job=job.id, error=f"Cannot copy the job: {exc}")
+        return EXIT_FAILED
+    for new in jobs:
+        emit("queued", file=new.manifest.get("name"), job=new.id, recut=job.id, device=new.manifest.get("device"))
+    return run_spool(queue, cancel)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    spool_only = args.list_jobs or args.resume or args.run_spool
+    recut = args.recut is not None
+    if not spool_only and not recut and not args.svg:
+        parser.error("give SVG documents, or one of --list-jobs, --resume, --recut or --run-spool")
+    if not spool_only and not recut and not args.estimate and not args.device:
+        parser.error("--device is required unless --estimate is given")
+    queue = spool.Spool()
+    if args.list_jobs:
+        for job in queue.jobs():
+            emit("job", **job_fields(job))
+        return EXIT_OK
+    ext = HeadlessPlot(args)
+    engine = PlotEngine(ext)
+
+    ports = []
+    if args.device and not args.estimate and not spool_only:
+        for spec in args.device:
+            try:
+                found = resolve_devices(spec)
+            except RuntimeError as exc:
+                emit("error", device=spec, error=str(exc))
+                return EXIT_NO_DEVICE
+            if not found:
+                emit("error", device=spec, error="No serial port with that VID:PID")
+                return EXIT_NO_DEVICE
+            ports.extend(port for port in found if port not in ports)
+        models = {vidpid for _device, vidpid in ports}
+        # Output encodings come from plotters.py, so only use them when every target agrees.
+        ext.current_vidpid = models.pop() if len(models) == 1 else None
+
+    cancel = threading.Event()
+
+    def on_interrupt(_signum, _frame):
+        if cancel.is_set():
+            raise KeyboardInterrupt
+        cancel.set()
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    if spool_only:
+        return run_spool(queue, cancel, args.resume)
+    if recut:
+        return recut_job(queue, args.recut, ports, cancel)
+
+    reporter = JobReporter()
+    dispatcher = None
+    if not args.estimate and queue.acquire():
+        # Plotters start on the first document while the next ones are generated.
+        dispatcher = dispatch.Dispatcher(queue, ext.debug, reporter.progress, cancel, on_job=reporter.on_job)
+        dispatcher.start(ports)
+    targets = [device for device, _vidpid in ports]
+    submitted = []
+    try:
+        for path in args.svg:
+            if cancel.is_set():
+                break
+            prepared = Path(path).suffix.lower() in HPGL_SUFFIXES
+            try:
+                if prepared:
+                    if args.estimate:
+                        emit("estimate", file=path, **engine.estimate_job(read_hpgl(path)))
+                        continue
+                    job = engine.create_job(targets, name=path, source=path)
+                else:
+                    ext.load(path)
+                    if args.estimate:
+                        emit("estimate", file=path, **engine.dry_run())
+                        continue
+                    pieces = engine.iter_hpgl()
+                    job = engine.create_job(targets, name=path)
+            except Exception as exc:  # pylint: disable=broad-except
+                emit("error", file=path, error=str(exc))
+                reporter.failed += 1
+                if not args.keep_going:
+                    break
+                continue
+            submitted.append(job.id)
+            if dispatcher is not None:
+                # A free plotter starts on the job while the rest of it is written.
+                dispatcher.notify()
+            try:
+                if not prepared:
+                    spool.write_jobs([job], pieces)
+            except Exception as exc:  # pylint: disable=broad-except
+                if dispatcher is None:
+                    emit("error", file=path, job=job.id, error=str(exc))
+                    reporter.failed += 1
+                # Otherwise the sender that takes the job reports it failed.
+                if not args.keep_going:
+                    break
+                continue
+            if dispatcher is None:
+                emit("queued", file=path, job=job.id)
+    finally:
+        senders = {}
+        if dispatcher is not None:
+            dispatcher.close()
+            senders = dispatcher.join()
+            queue.release()
+    finish_jobs(queue, submitted, senders, cancel, reporter)
+    if dispatcher is not None and not cancel.is_set():
+        failed = {port for port, sender in senders.items() if not sender.finished_cleanly}
+        if set(queue.wanted_ports()) - failed:
+            # Queued by another process while the lock was held; send those too.
+            dispatch.send_queue(queue, ext.debug, reporter.progress, cancel, on_job=reporter.on_job)
+    queue.prune()
+    return exit_status(reporter, cancel)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
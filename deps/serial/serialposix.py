@@ -610,58 +610,70 @@ class Serial(SerialBase, PlatformSpecific):
             os.write(self.pipe_abort_write_w, b"x")
 
     def write(self, data):
-        """Output the given byte string over the serial port."""
+        """\
+        Output the given byte string, or any object supporting the buffer
+        protocol (bytearray, memoryview, mmap, ...), over the serial port.
+        Partial writes advance an offset into a memoryview, so the remainder
+        is never copied.
+        """
         if not self.is_open:
             raise PortNotOpenError()
-        d = to_bytes(data)
-        tx_len = length = len(d)
-        timeout = Timeout(self._write_timeout)
-        while tx_len > 0:
-            try:
-                n = os.write(self.fd, d)
-                if timeout.is_non_blocking:
-                    # Zero timeout indicates non-blocking - simply return the
-                    # number of bytes of data actually written
-                    return n
-                elif not timeout.is_infinite:
-                    # when timeout is set, use select to wait for being ready
-                    # with the time left as timeout
-                    if timeout.expired():
-                        raise SerialTimeoutException('Write timeout')
-                    abort, ready, _ = select.select([self.pipe_abort_write_r], [self.fd], [], timeout.time_left())
-                    if abort:
-                        os.read(self.pipe_abort_write_r, 1000)
-                        break
-                    if not ready:
-                        raise SerialTimeoutException('Write timeout')
-                else:
-                    assert timeout.time_left() is None
-                    # wait for write operation
-                    abort, ready, _ = select.select([self.pipe_abort_write_r], [self.fd], [], None)
-                    if abort:
-                        os.read(self.pipe_abort_write_r, 1)
-                        break
-                    if not ready:
-                        raise SerialException('write failed (select)')
-                d = d[n:]
-                tx_len -= n
-            except SerialException:
-                raise
-            except OSError as e:
-                # this is for Python 3.x where select.error is a subclass of
-                # OSError ignore BlockingIOErrors and EINTR. other errors are shown
-                # https://www.python.org/dev/peps/pep-0475.
-                if e.errno not in (errno.EAGAIN, errno.EALREADY, errno.EWOULDBLOCK, errno.EINPROGRESS, errno.EINTR):
-                    raise SerialException('write failed: {}'.format(e))
-            except select.error as e:
-                # this is for Python 2.x
-                # ignore BlockingIOErrors and EINTR. all errors are shown
-                # see also http://www.python.org/dev/peps/pep-3151/#select
-                if e[0] not in (errno.EAGAIN, errno.EALREADY, errno.EWOULDBLOCK, errno.EINPROGRESS, errno.EINTR):
-                    raise SerialException('write failed: {}'.format(e))
-            if not timeout.is_non_blocking and timeout.expired():
-                raise SerialTimeoutException('Write timeout')
-        return length - len(d)
+        try:
+            d = memoryview(data).cast('B')
+        except TypeError:
+            d = memoryview(to_bytes(data))
+        # Released on the way out, even on an error, so a traceback holding this
+        # frame does not keep the caller's buffer (e.g. an mmap) exported.
+        with d:
+            tx_len = length = len(d)
+            offset = 0
+            timeout = Timeout(self._write_timeout)
+            while tx_len > 0:
+                try:
+                    n = os.write(self.fd, d[offset:])
+                    if timeout.is_non_blocking:
+                        # Zero timeout indicates non-blocking - simply return the
+                        # number of bytes of data actually written
+                        return n
+                    elif not timeout.is_infinite:
+                        # when timeout is set, use select to wait for being ready
+                        # with the time left as timeout
+                        if timeout.expired():
+                            raise SerialTimeoutException('Write timeout')
+                        abort, ready, _ = select.select([self.pipe_abort_write_r], [self.fd], [], timeout.time_left())
+                        if abort:
+                            os.read(self.pipe_abort_write_r, 1000)
+                            break
+                        if not ready:
+                            raise SerialTimeoutException('Write timeout')
+                    else:
+                        assert timeout.time_left() is None
+                        # wait for write operation
+                        abort, ready, _ = select.select([self.pipe_abort_write_r], [self.fd], [], None)
+                        if abort:
+                            os.read(self.pipe_abort_write_r, 1)
+                            break
+                        if not ready:
+                            raise SerialException('write failed (select)')
+                    offset += n
+                    tx_len -= n
+                except SerialException:
+                    raise
+                except OSError as e:
+                    # this is for Python 3.x where select.error is a subclass of
+                    # OSError ignore BlockingIOErrors and EINTR. other errors are shown
+                    # https://www.python.org/dev/peps/pep-0475.
+                    if e.errno not in (errno.EAGAIN, errno.EALREADY, errno.EWOULDBLOCK, errno.EINPROGRESS, errno.EINTR):
+                        raise SerialException('write failed: {}'.format(e))
+                except select.error as e:
+                    # this is for Python 2.x
+                    # ignore BlockingIOErrors and EINTR. all errors are shown
+                    # see also http://www.python.org/dev/peps/pep-3151/#select
+                    if e[0] not in (errno.EAGAIN, errno.EALREADY, errno.EWOULDBLOCK, errno.EINPROGRESS, errno.EINTR):
+                        raise SerialException('write failed: {}'.format(e))
+                if not timeout.is_non_blocking and timeout.expired():
+                    raise SerialTimeoutException('Write timeout')
+        return offset
 
     def flush(self):
         """\
@@ -88,7 +88,7 @@ class SysFS(list_ports_common.ListPortInfo):
             return None
 
 
-def comports(include_links=False):
+def device_nodes(include_links=False):
     devices = glob.glob('/dev/ttyS*')           # built-in serial ports
     devices.extend(glob.glob('/dev/ttyUSB*'))   # usb-serial with own driver
     devices.extend(glob.glob('/dev/ttyXRUSB*')) # xr-usb-serial port exar (DELL Edge 3001)
@@ -98,10 +98,75 @@ def comports(include_links=False):
     devices.extend(glob.glob('/dev/ttyAP*'))    # Advantech multi-port serial controllers
     if include_links:
         devices.extend(list_ports_common.list_links(devices))
+    return devices
+
+
+def comports(include_links=False):
     return [info
-            for info in [SysFS(d) for d in devices]
+            for info in [SysFS(d) for d in device_nodes(include_links)]
             if info.subsystem != "platform"]    # hide non-present internal serial ports
 
+
+class ComportsCache(object):
+    """\
+    Incremental version of comports(). Entries are keyed by the identity of
+    the device node (path, inode, sysfs device link) and a SysFS object is
+    only built for nodes that appeared or changed since the last refresh.
+    Hidden "platform" ports are cached too so they are not re-read.
+    """
+
+    def __init__(self, include_links=False):
+        self.include_links = include_links
+        self._entries = {}  # device -> (identity, SysFS or None)
+
+    @staticmethod
+    def identity(device):
+        try:
+            inode = os.stat(device).st_ino
+        except OSError:
+            return None
+        try:
+            sysfs_device = os.readlink('/sys/class/tty/{}/device'.format(os.path.basename(device)))
+        except OSError:
+            sysfs_device = None
+        return (device, inode, sysfs_device)
+
+    def refresh(self):
+        """\
+        Re-scan the device nodes. Returns (added, removed, unchanged) lists
+        of port info objects; a changed node is reported as removed + added.
+        """
+        added = []
+        removed = []
+        unchanged = []
+        entries = {}
+        for device in device_nodes(self.include_links):
+            key = self.identity(device)
+            if key is None:
+                continue
+            cached = self._entries.get(device)
+            if cached is not None and cached[0] == key:
+                entries[device] = cached
+                if cached[1] is not None:
+                    unchanged.append(cached[1])
+                continue
+            info = SysFS(device)
+            if info.subsystem == "platform":
+                info = None
+            entries[device] = (key, info)
+            if cached is not None and cached[1] is not None:
+                removed.append(cached[1])
+            if info is not None:
+                added.append(info)
+        for device, (_key, info) in self._entries.items():
+            if device not in entries and info is not None:
+                removed.append(info)
+        self._entries = entries
+        return added, removed, unchanged
+
+    def ports(self):
+        return [info for _key, info in self._entries.values() if info is not None]
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 # test
 if __name__ == '__main__':
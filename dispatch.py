@@ -0,0 +1,183 @@
+"""Drive several plotters at once from the spool, one sender thread per port.
+
+Each Sender claims the oldest queued job it may send (a job for its port, or a
+pooled job listing it among its "targets") and streams it with a SpoolRunner,
+so plotters of the same model share a queue and an idle one takes the next
+job. Errors and cancellation are per port: a plotter that fails stops its own
+sender and the rest carry on.
+"""
+import threading
+
+from plot import PlotCancelled
+from spool import JobFailed, SpoolRunner
+
+# Seconds an idle sender waits for new jobs before checking the spool again.
+IDLE_POLL = 0.5
+
+
+class AnyEvent:
+    """Set when any of the given threading.Events is: one port's cancel or everyone's."""
+
+    def __init__(self, *events):
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+
+class Sender(threading.Thread):
+
+    def __init__(self, dispatcher, port, vidpid, done=None):
+        super().__init__(name=f"kmplot-send-{port}", daemon=True)
+        self.dispatcher = dispatcher
+        self.port = port
+        self.vidpid = vidpid
+        self.cancel = threading.Event()
+        self.done = done if done is not None else []
+        self.error = None
+        self.cancelled = False
+
+    @property
+    def finished_cleanly(self):
+        return not self.is_alive() and self.error is None and not self.cancelled
+
+    def run(self):
+        dispatcher = self.dispatcher
+        runner = SpoolRunner(
+            dispatcher.spool,
+            dispatcher.debug,
+            self.report,
+            AnyEvent(self.cancel, dispatcher.cancel_all),
+            dispatcher.pause,
+            reserved=dispatcher.senders,
+        )
+        while not runner.stopping():
+            job = dispatcher.spool.claim(self.port)
+            if job is None:
+                if dispatcher.closed.is_set():
+                    break
+                with dispatcher.wakeup:
+                    dispatcher.wakeup.wait(IDLE_POLL)
+                continue
+            dispatcher.notice("start", self.port, job)
+            try:
+                self.port = runner.send(job)
+            except PlotCancelled:
+                self.cancelled = True
+                break
+            except JobFailed as exc:
+                # The job was bad, not the plotter: carry on with the next one.
+                dispatcher.debug(f"{self.port}: job {job.id} failed: {exc}")
+            except Exception as exc:  # pylint: disable=broad-except
+                dispatcher.debug(f"{self.port}: job {job.id} failed: {exc}")
+                self.error = exc
+                break
+            finally:
+                dispatcher.notice("end", self.port, job)
+            if job.state == "done":
+                self.done.append(job)
+
+    def report(self, job, sent, total, rate):
+        if self.dispatcher.progress is not None:
+            self.dispatcher.progress(self.port, job, sent, total, rate)
+
+
+class Dispatcher:
+    """Sender threads over a Spool whose runner lock this process holds.
+
+    ``progress(port, job, sent, total, rate)`` and ``on_job(event, port, job)``,
+    with event "start" or "end" (see job.state for how it ended), are called from
+    the sender threads. Setting ``cancel`` cancels every port; cancel(port) just
+    one. start() adds
+    senders for ports; close() lets them exit once nothing is left for them;
+    join() waits and returns {port: Sender}.
+    """
+
+    def __init__(self, spool, debug, progress=None, cancel=None, pause=None, on_job=None):
+        self.spool = spool
+        self.debug = debug
+        self.progress = progress
+        self.on_job = on_job
+        self.cancel_all = cancel
+        self.pause = pause
+        self.senders = {}
+        self.closed = threading.Event()
+        self.wakeup = threading.Condition()
+
+    def start(self, ports):
+        """Start a sender for each (port, vid:pid) that does not have one yet."""
+        for port, vidpid in ports:
+            previous = self.senders.get(port)
+            if previous is not None and not previous.finished_cleanly:
+                continue
+            sender = Sender(self, port, vidpid, previous.done if previous else None)
+            self.senders[port] = sender
+            sender.start()
+
+    def notice(self, event, port, job):
+        if self.on_job is not None:
+            self.on_job(event, port, job)
+
+    def notify(self):
+        """Wake idle senders after a job was submitted."""
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def close(self):
+        self.closed.set()
+        self.notify()
+
+    def cancel(self, port=None):
+        for sender_port, sender in self.senders.items():
+            if port is None or sender_port == port:
+                sender.cancel.set()
+        self.notify()
+
+    def join(self):
+        while True:
+            for sender in list(self.senders.values()):
+                sender.join()
+            if self.stopping():
+                return dict(self.senders)
+            # Jobs other processes queued meanwhile, for ports that are free again.
+            idle = {
+                port: vidpid for port, vidpid in self.spool.wanted_ports().items()
+                if port not in self.senders or self.senders[port].finished_cleanly
+            }
+            if not idle:
+                return dict(self.senders)
+            self.start(idle.items())
+
+    def stopping(self):
+        return any(event is not None and event.is_set() for event in (self.cancel_all, self.pause))
+
+    def run(self, ports=None):
+        """Send everything queued (over ``ports``, default all it needs) and wait."""
+        self.start((ports or self.spool.wanted_ports()).items())
+        self.close()
+        return self.join()
+
+
+def send_queue(spool, debug, progress=None, cancel=None, pause=None, on_job=None):
+    """Send the queue if no other process is; returns {port: Sender}, or None if one is.
+
+    Jobs queued by other processes just before the lock is released are picked
+    up by taking it again, so none is left waiting for a runner that has gone.
+    """
+    results = None
+    while spool.acquire():
+        dispatcher = Dispatcher(spool, debug, progress, cancel, pause, on_job)
+        try:
+            senders = dispatcher.run()
+        finally:
+            spool.release()
+        for port, sender in senders.items():
+            if results and port in results and sender.done is not results[port].done:
+                sender.done[:0] = results[port].done
+        results = dict(results or {}, **senders)
+        if dispatcher.stopping():
+            break
+        failed = {port for port, sender in results.items() if not sender.finished_cleanly}
+        if not set(spool.wanted_ports()) - failed:
+            break
+    return results
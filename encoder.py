@@ -0,0 +1,796 @@
+"""km-plot's own SVG to HPGL encoder.
+
+Shapes are collected with their composed transforms, every Bezier segment in the
+document is flattened in one vectorized NumPy pass, and the resulting subpaths get
+overcut and drag-knife (tool offset) compensation before being written as HPGL in
+the same ";PU;SP1;PU..;PD.." form PlotEngine.convert_hpgl expects, a piece at a
+time (see iter_hpgl).
+
+Large documents are collected and flattened in a process pool, one batch of
+sibling elements per task (see partition and flatten_parallel); the batches are
+joined back in document order before anything global happens, so the output is
+the same byte for byte as a serial run.
+"""
+import bisect
+import math
+import os
+import re
+from types import SimpleNamespace
+
+import numpy as np
+import inkex
+from inkex import Transform
+
+# Layer labels such as "pen 2", "speed 20" or "force 80" override the options for their contents.
+FIND_PEN = re.compile(r"\s*pen\s*(\d+)\s*", re.IGNORECASE)
+FIND_SPEED = re.compile(r"\s*speed\s*(\d+)\s*", re.IGNORECASE)
+FIND_FORCE = re.compile(r"\s*force\s*(\d+)\s*", re.IGNORECASE)
+# Upper bound on the number of line segments a single curve is split into.
+MAX_CURVE_STEPS = 1000
+# Resolution the "flat" option is expressed in (HPGL's 40 units/mm).
+REFERENCE_DPI = 1016.0
+# Adaptive flattening re-splits pieces that are still too coarse at most this often.
+MAX_REFINE_PASSES = 4
+# Deviation, in device units, below which a point between two neighbours is dropped.
+# Applied in two passes, so a dropped point never moves the cut by more than half a unit.
+COLLINEAR_TOLERANCE = 0.25
+# Points formatted into each piece of text iter_hpgl() hands on.
+FORMAT_BATCH = 4096
+# Documents with fewer drawable shapes than this are flattened in this process.
+PARALLEL_MIN_ELEMENTS = 2000
+# Batches of shapes handed out per worker process, to even out unequal layers.
+BATCHES_PER_WORKER = 4
+# Path data split the way inkex splits it: a command letter and the numbers after it.
+PATH_COMMAND = re.compile(r"([MLHVCSQTAZmlhvcsqtaz])([^MLHVCSQTAZmlhvcsqtaz]*)")
+PATH_NUMBER = re.compile(r"[+-]?(?:(?:[0-9]*\.[0-9]+|[0-9]+\.)(?:[eE][+-]?[0-9]+)?|[0-9]+[eE][+-]?[0-9]+)|[+-]?[0-9]+")
+# Numbers each path command takes, and the command extra numbers repeat as.
+PATH_ARGS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2, "A": 7, "Z": 0}
+PATH_REPEAT = {"M": "L", "m": "l", "Z": "M", "z": "M"}
+# Shapes that never produce cut paths of their own.
+SKIPPED_TYPES = (
+    inkex.TextElement,
+    inkex.FlowRoot,
+    inkex.Image,
+    inkex.ClipPath,
+    inkex.Marker,
+    inkex.Mask,
+    inkex.Symbol,
+)
+
+
+def chord_deviation(segs):
+    """Upper bound on how far a cubic strays from the chord between its ends.
+
+    Across the chord, the curve is 3t(1-t)^2 d1 + 3t^2(1-t) d2 away from it, where
+    d1, d2 are the control points' signed distances; that is at most
+    min(3/4 max(|d1|, |d2|), 4/9 (|d1| + |d2|)). Control points beyond either
+    end of the chord count with their full distance to that end.
+    """
+    p0 = segs[:, 0]
+    chord = segs[:, 3] - p0
+    length = np.hypot(chord[:, 0], chord[:, 1])
+    safe = np.where(length > 0, length, 1.0)
+    across = []
+    overshoot = np.zeros(len(segs))
+    for k in (1, 2):
+        rel = segs[:, k] - p0
+        across.append(np.abs(rel[:, 0] * chord[:, 1] - rel[:, 1] * chord[:, 0]) / safe)
+        t = (rel[:, 0] * chord[:, 0] + rel[:, 1] * chord[:, 1]) / (safe * safe)
+        beyond = (t < 0) | (t > 1) | (length == 0)
+        t = np.clip(t, 0.0, 1.0)
+        away = np.hypot(rel[:, 0] - t * chord[:, 0], rel[:, 1] - t * chord[:, 1])
+        np.maximum(overshoot, np.where(beyond, away, 0.0), out=overshoot)
+    d1, d2 = across
+    bound = np.minimum(0.75 * np.maximum(d1, d2), 4.0 / 9.0 * (d1 + d2))
+    return np.maximum(bound, overshoot)
+
+
+def hidden(node):
+    """True for display:none; the style is only parsed when it mentions display at all."""
+    style = node.attrib.get("style")
+    return bool(style) and "display" in style and inkex.Style(style).get("display") == "none"
+
+
+def own_transform(node):
+    """The node's transform, parsed from the attribute without inkex caching it on the element."""
+    text = node.attrib.get("transform")
+    return Transform(text) if text else None
+
+
+def path_commands(text):
+    """(letter, numbers) for each command in path data, split up as inkex's parser does."""
+    for letter, numbers in PATH_COMMAND.findall(text):
+        args = [float(value) for value in PATH_NUMBER.findall(numbers)]
+        index = 0
+        while index < len(args) or letter in "Zz":
+            count = PATH_ARGS[letter.upper()]
+            if len(args) - index < count:
+                # inkex drops everything from an incomplete command on.
+                return
+            yield letter, args[index:index + count]
+            index += count
+            letter = PATH_REPEAT.get(letter, letter)
+
+
+def parse_superpath(text):
+    """Path data as the [handle in, node, handle out] subpaths inkex's to_superpath() gives.
+
+    Follows inkex's arithmetic step for step, so the points are the same to the
+    bit, without building a command object per segment. Returns None for arcs
+    and paths that do not start with a move, which are left to inkex.
+    """
+    subpaths = []
+    prev = prev_prev = 0j
+    for letter, values in path_commands(text):
+        command = letter.upper()
+        relative = letter != command
+        if command == "A":
+            return None
+        if command == "Z":
+            if not subpaths:
+                return None
+            first = subpaths[-1][0]
+            subpaths[-1].append(list(first))
+            prev = first[0]
+            continue
+        points = [x + y * 1j for x, y in zip(values[::2], values[1::2])]
+        if relative:
+            points = [point + prev for point in points]
+        if command == "M":
+            subpaths.append([[points[0], points[0], points[0]]])
+            prev = prev_prev = points[0]
+            continue
+        if not subpaths:
+            return None
+        if command == "H":
+            end = (values[0] + prev.real if relative else values[0]) + prev.imag * 1j
+            curve = (prev, end, end)
+        elif command == "V":
+            end = prev.real + (prev.imag + values[0] if relative else values[0]) * 1j
+            curve = (prev, end, end)
+        elif command == "L":
+            curve = (prev, points[0], points[0])
+        elif command == "C":
+            curve = tuple(points)
+        elif command == "S":
+            curve = (2 * prev - prev_prev, points[0], points[1])
+        else:
+            control = points[0] if command == "Q" else 2 * prev - prev_prev
+            end = points[-1]
+            curve = (1.0 / 3 * prev + 2.0 / 3 * control, 2.0 / 3 * control + 1.0 / 3 * end, end)
+        # inkex keeps the quadratic control point only for upper-case Q and T.
+        if letter == "Q":
+            prev_prev = points[0]
+        elif letter == "T":
+            prev_prev = 2 * curve[2] - prev_prev
+        else:
+            prev_prev = curve[1]
+        prev = curve[2]
+        subpaths[-1][-1][2] = curve[0]
+        subpaths[-1].append([curve[1], curve[2], curve[2]])
+    return [[[(handle.real, handle.imag) for handle in node] for node in subpath] for subpath in subpaths]
+
+
+def sub_cubic(segs, t0, t1):
+    """Control points of each cubic restricted to its parameter range [t0, t1]."""
+    p0, c1, c2, p3 = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+    ends = []
+    for t in (t0, t1):
+        t = t[:, None]
+        mt = 1.0 - t
+        point = mt ** 3 * p0 + 3 * mt ** 2 * t * c1 + 3 * mt * t ** 2 * c2 + t ** 3 * p3
+        tangent = 3 * (mt ** 2 * (c1 - p0) + 2 * mt * t * (c2 - c1) + t ** 2 * (p3 - c2))
+        ends.append((point, tangent))
+    (start, start_tangent), (end, end_tangent) = ends
+    span = (t1 - t0)[:, None] / 3.0
+    return np.stack((start, start + span * start_tangent, end - span * end_tangent, end), axis=1)
+
+
+def parallel_workers():
+    """Worker processes for flattening: KM_PLOT_WORKERS if set (0 or 1 turns it off), else the CPU count."""
+    configured = os.environ.get("KM_PLOT_WORKERS")
+    try:
+        return int(configured) if configured else (os.cpu_count() or 1)
+    except ValueError:
+        return 1
+
+
+_worker = None
+
+
+def _start_worker(svg_bytes, options):
+    """Process pool initializer: each worker parses its own copy of the document once."""
+    global _worker
+    messages = []
+    ext = SimpleNamespace(
+        svg=inkex.load_svg(svg_bytes).getroot(), options=SimpleNamespace(**options), debug=messages.append
+    )
+    _worker = (HpglEncoder(ext), messages)
+
+
+def _flatten_batch(spans):
+    """Flatten the elements in ``spans`` (see partition) in a worker; debug messages come back with them."""
+    encoder, messages = _worker
+    del messages[:]
+    states, points, path_lengths = encoder.flatten_segments(
+        encoder.collect_spans(spans), encoder.device_transform()
+    )
+    return states, points, path_lengths, list(messages)
+
+
+class HpglEncoder:
+
+    def __init__(self, extension, order=None):
+        self.ext = extension
+        self.options = extension.options
+        self.svg = extension.svg
+        self.order = order
+        res_x = float(self.options.resolutionX)
+        res_y = float(self.options.resolutionY)
+        user_units_per_inch = self.svg.unittouu("1.0in")
+        self.scale_x = res_x / user_units_per_inch
+        self.scale_y = res_y / user_units_per_inch
+        units_per_mm = (res_x + res_y) / 2.0 / 25.4
+        self.overcut = max(float(self.options.overcut), 0.0) * units_per_mm
+        self.tool_offset = max(float(self.options.toolOffset), 0.0) * units_per_mm
+        self.adaptive = bool(getattr(self.options, "adaptiveFlatten", True))
+        if self.adaptive:
+            # Same physical accuracy at any resolution, but never finer than the
+            # rounding to whole device units already is.
+            self.flat = max(float(self.options.flat) * (res_x + res_y) / 2.0 / REFERENCE_DPI, 0.5)
+        else:
+            self.flat = max(float(self.options.flat), 0.01)
+        self.center = bool(self.options.center)
+        # Transform and state inside each group collect_spans() has entered, by child-index path.
+        self.span_parents = {}
+
+    def get_hpgl(self):
+        return "".join(self.iter_hpgl())
+
+    def iter_hpgl(self):
+        """Return an iterator over the job's HPGL text, in pieces of about FORMAT_BATCH points.
+
+        Flattening, ordering and tool offset run before this returns: centering
+        and path order need the whole drawing, which is held as compact numpy
+        arrays. The text, several times larger, is formatted one piece at a time
+        as the iterator is consumed.
+        """
+        matrix = self.device_transform()
+        flattened = self.flatten_parallel()
+        if flattened is None:
+            flattened = self.flatten_segments(self.collect_top_level(), matrix)
+        states, paths = self.device_paths(*flattened, matrix)
+        if not paths:
+            raise ValueError("No paths found")
+
+        origin = (0.0, 0.0)
+        stream = []
+        pen_down = []
+        state_index = []
+        state_table = sorted(set(states), key=states.index)
+        if self.tool_offset > 0.0 and self.options.precut:
+            if self.center:
+                origin = (min(p[0] for pts in paths for p in pts), min(p[1] for pts in paths for p in pts))
+            stream += [origin, (origin[0], origin[1] + self.tool_offset * 8)]
+            pen_down += [False, True]
+            state_index += [0, 0]
+
+        position = origin
+        run_start = 0
+        for idx in range(1, len(paths) + 1):
+            if idx < len(paths) and states[idx] == states[run_start]:
+                continue
+            run = paths[run_start:idx]
+            if self.order is not None:
+                run = self.order(run, position)
+            table_index = state_table.index(states[run_start])
+            for points in run:
+                if self.overcut > 0.0 and len(points) > 2 and points[0] == points[-1]:
+                    points = points + self.overcut_points(points)
+                stream += points
+                pen_down.append(False)
+                pen_down += [True] * (len(points) - 1)
+                state_index += [table_index] * len(points)
+            position = run[-1][-1]
+            run_start = idx
+
+        points = np.asarray(stream, dtype=float)
+        pen_down = np.asarray(pen_down, dtype=bool)
+        state_index = np.asarray(state_index, dtype=np.int64)
+        if self.tool_offset > 0.0:
+            points, pen_down, source = self.compensate(points, pen_down)
+            state_index = state_index[source]
+        return self.format_stream(points, pen_down, state_index, state_table)
+
+    def device_transform(self):
+        """SVG user units -> plotter units: scale, flip Y (unless mirrored), rotate."""
+        mirror_x = -1.0 if self.options.mirrorX else 1.0
+        mirror_y = 1.0 if self.options.mirrorY else -1.0
+        rotate = Transform(rotate=float(self.options.orientation))
+        return rotate @ Transform(scale=(mirror_x * self.scale_x, mirror_y * self.scale_y))
+
+    def base_state(self):
+        return int(self.options.pen), int(self.options.speed), int(self.options.force)
+
+    def collect_top_level(self):
+        """Shapes under the root, in document order."""
+        shapes = []
+        self.collect_children(self.svg, Transform(), self.base_state(), shapes)
+        return shapes
+
+    def collect_spans(self, spans):
+        """Shapes under each (path, start, stop) span from partition(), in order."""
+        shapes = []
+        for path, start, stop in spans:
+            parent, transform, state = self.span_parent(path)
+            for child in parent[start:stop]:
+                self.collect_node(child, transform, state, shapes)
+        return shapes
+
+    def span_parent(self, path):
+        """The group at ``path`` with the transform and state collect_node() would give its children."""
+        if path not in self.span_parents:
+            if not path:
+                self.span_parents[path] = (self.svg, Transform(), self.base_state())
+            else:
+                parent, transform, state = self.span_parent(path[:-1])
+                group = parent[path[-1]]
+                matrix = own_transform(group)
+                if matrix is not None:
+                    transform = transform @ matrix
+                self.span_parents[path] = (group, transform, self.layer_state(group, state))
+        return self.span_parents[path]
+
+    def drawable_count(self, node):
+        """Shapes under ``node`` that can produce a path; defs, metadata, text and hidden groups count 0."""
+        if not isinstance(node, inkex.ShapeElement) or isinstance(node, SKIPPED_TYPES):
+            return 0
+        if not isinstance(node, (inkex.Group, inkex.Anchor)):
+            return 1
+        if hidden(node):
+            return 0
+        return sum(self.drawable_count(child) for child in node)
+
+    def partition(self, batches):
+        """Split the drawing into up to ``batches`` runs of about equal numbers of shapes.
+
+        Each run is a list of (path, start, stop) spans: children [start:stop]
+        of the group reached from the root through the child indices in
+        ``path``. A group holding more than one run's share is split into its
+        children, so a document that is one big layer still spreads over the
+        workers. Elements that draw nothing are left out.
+        """
+        pending = [((), index, self.drawable_count(child)) for index, child in enumerate(self.svg)]
+        total = sum(count for _path, _index, count in pending)
+        if total < PARALLEL_MIN_ELEMENTS:
+            return []
+        share = total / batches
+        leaves = []
+        pending.reverse()
+        while pending:
+            path, index, count = pending.pop()
+            if not count:
+                continue
+            node = self.svg
+            for step in path + (index,):
+                node = node[step]
+            if count > share and isinstance(node, (inkex.Group, inkex.Anchor)):
+                inner = path + (index,)
+                pending += reversed([(inner, child, self.drawable_count(node[child])) for child in range(len(node))])
+            else:
+                leaves.append((path, index, count))
+
+        runs = [[]]
+        filled = 0
+        for leaf_index, (path, index, count) in enumerate(leaves):
+            spans = runs[-1]
+            if spans and spans[-1][0] == path and spans[-1][2] == index:
+                spans[-1] = (path, spans[-1][1], index + 1)
+            else:
+                spans.append((path, index, index + 1))
+            filled += count
+            if filled * batches >= total * len(runs) and leaf_index < len(leaves) - 1:
+                runs.append([])
+        return runs
+
+    def flatten_parallel(self):
+        """flatten_segments() over the whole document from a process pool, or None to do it here."""
+        workers = parallel_workers()
+        if workers < 2:
+            return None
+        runs = self.partition(workers * BATCHES_PER_WORKER)
+        if len(runs) < 2:
+            return None
+        try:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Workers start clean rather than as forks of a process holding GTK and open ports.
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            options = {
+                key: value for key, value in vars(self.options).items()
+                if isinstance(value, (str, int, float, bool)) or value is None
+            }
+            with ProcessPoolExecutor(
+                min(workers, len(runs)),
+                mp_context=multiprocessing.get_context(method),
+                initializer=_start_worker,
+                initargs=(self.svg.tostring(), options),
+            ) as pool:
+                results = list(pool.map(_flatten_batch, runs))
+        except Exception as exc:  # pylint: disable=broad-except
+            self.ext.debug(f"Parallel flattening unavailable, flattening here: {exc!r}")
+            return None
+        states = []
+        for batch_states, _points, _lengths, messages in results:
+            for message in messages:
+                self.ext.debug(message)
+            states += batch_states
+        points = np.concatenate([result[1] for result in results])
+        path_lengths = np.concatenate([result[2] for result in results])
+        self.ext.debug(f"Flattened {len(runs)} batches of shapes in {min(workers, len(runs))} processes")
+        return states, points, path_lengths
+
+    def layer_state(self, group, state):
+        if group.get("inkscape:groupmode") != "layer":
+            return state
+        label = group.label or ""
+        pen, speed, force = state
+        match = FIND_PEN.search(label)
+        if match:
+            pen = int(match.group(1))
+        match = FIND_SPEED.search(label)
+        if match:
+            speed = int(match.group(1))
+        match = FIND_FORCE.search(label)
+        if match:
+            force = int(match.group(1))
+        return pen, speed, force
+
+    def collect_children(self, parent, transform, state, shapes):
+        for child in parent:
+            self.collect_node(child, transform, state, shapes)
+
+    def collect_node(self, node, transform, state, shapes):
+        if not isinstance(node, inkex.ShapeElement) or isinstance(node, SKIPPED_TYPES):
+            return
+        if hidden(node):
+            return
+        node_transform = own_transform(node)
+        node_transform = transform if node_transform is None else transform @ node_transform
+        if isinstance(node, inkex.Use):
+            target = node.href
+            if target is None:
+                return
+            shift = Transform(translate=(self.user_length(node.get("x")), self.user_length(node.get("y"))))
+            if isinstance(target, inkex.Symbol):
+                self.collect_children(target, node_transform @ shift, state, shapes)
+            else:
+                self.collect_node(target, node_transform @ shift, state, shapes)
+            return
+        if isinstance(node, (inkex.Group, inkex.Anchor)):
+            self.collect_children(node, node_transform, self.layer_state(node, state), shapes)
+            return
+        if isinstance(node, inkex.PathElement):
+            superpath = parse_superpath(node.attrib.get("d") or "")
+            if superpath is not None:
+                shapes.append((state, node_transform, superpath))
+                return
+        try:
+            path = node.path
+        except Exception as exc:  # pylint: disable=broad-except
+            self.ext.debug(f"Skipping {node.TAG} without path data: {exc}")
+            return
+        shapes.append((state, node_transform, path.to_superpath()))
+
+    def user_length(self, value):
+        if not value:
+            return 0.0
+        try:
+            return float(value)
+        except ValueError:
+            return self.svg.unittouu(value)
+
+    def flatten(self, shapes, matrix):
+        """Flatten all superpaths at once; returns (states, paths) with integer points."""
+        return self.device_paths(*self.flatten_segments(shapes, matrix), matrix)
+
+    def flatten_segments(self, shapes, matrix):
+        """Flatten all superpaths at once, before alignment and rounding.
+
+        Returns (states, points, path_lengths): a state per subpath of two or
+        more nodes and its run of float points. Each segment is flattened on its
+        own, so flattening parts of a document and joining them in order gives
+        the same points as flattening it whole.
+        """
+        rows = []
+        seg_counts = []
+        states = []
+        seg_matrices = []
+        for state, transform, superpath in shapes:
+            composed = matrix @ transform
+            coefficients = (composed.a, composed.b, composed.c, composed.d, composed.e, composed.f)
+            for subpath in superpath:
+                if len(subpath) < 2:
+                    continue
+                for here, there in zip(subpath, subpath[1:]):
+                    rows.append((here[1][0], here[1][1], here[2][0], here[2][1],
+                                 there[0][0], there[0][1], there[1][0], there[1][1]))
+                seg_counts.append(len(subpath) - 1)
+                seg_matrices.append(coefficients)
+                states.append(state)
+        if not rows:
+            return [], np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+
+        # Each shape keeps its own transform; apply them all in one pass per segment.
+        segs = np.asarray(rows, dtype=float).reshape(-1, 4, 2)
+        coefficients = np.repeat(np.asarray(seg_matrices, dtype=float), seg_counts, axis=0)[:, None, :]
+        x = segs[..., 0]
+        y = segs[..., 1]
+        segs = np.stack((
+            coefficients[..., 0] * x + coefficients[..., 2] * y + coefficients[..., 4],
+            coefficients[..., 1] * x + coefficients[..., 3] * y + coefficients[..., 5],
+        ), axis=-1)
+        if self.adaptive:
+            points, path_lengths = self.subdivide_adaptive(segs, np.asarray(seg_counts))
+        else:
+            points, path_lengths = self.subdivide(segs, np.asarray(seg_counts))
+        return states, points, path_lengths
+
+    def device_paths(self, states, points, path_lengths, matrix):
+        """Align, round and simplify flattened points; returns (states, paths) with integer points."""
+        if not states:
+            return [], []
+        points = points + self.alignment_shift(points, matrix)
+        points = np.rint(points).astype(np.int64)
+        if not self.center:
+            np.maximum(points, 0, out=points)
+
+        # Drop points that round onto their predecessor within the same subpath.
+        starts = np.zeros(len(points), dtype=bool)
+        starts[np.cumsum(path_lengths) - path_lengths] = True
+        keep = starts.copy()
+        keep[1:] |= np.any(points[1:] != points[:-1], axis=1)
+        points = points[keep]
+        starts = starts[keep]
+        if self.adaptive:
+            for _pass in range(2):
+                keep = self.collinear_keep(points, starts)
+                points = points[keep]
+                starts = starts[keep]
+        kept_per_path = np.diff(np.append(np.flatnonzero(starts), len(points)))
+        flat_points = [tuple(p) for p in points.tolist()]
+
+        out_states = []
+        paths = []
+        offset = 0
+        for state, count in zip(states, kept_per_path.tolist()):
+            if count > 1:
+                out_states.append(state)
+                paths.append(flat_points[offset:offset + count])
+            offset += count
+        return out_states, paths
+
+    def subdivide(self, segs, seg_counts):
+        """Evaluate cubic segments at a per-segment step count from Wang's formula."""
+        p0, c1, c2, p3 = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+        bend = np.maximum(
+            np.hypot(*(p0 - 2 * c1 + c2).T), np.hypot(*(c1 - 2 * c2 + p3).T)
+        )
+        steps = np.clip(np.ceil(np.sqrt(0.75 * bend / self.flat)), 1, MAX_CURVE_STEPS).astype(np.int64)
+        # Lines come through as cubics with handles on the chord; keep them as one step.
+        chord = p3 - p0
+        chord_length = np.hypot(*chord.T)
+        cross_1 = (c1 - p0)[:, 0] * chord[:, 1] - (c1 - p0)[:, 1] * chord[:, 0]
+        cross_2 = (c2 - p0)[:, 0] * chord[:, 1] - (c2 - p0)[:, 1] * chord[:, 0]
+        off_chord = np.maximum(np.abs(cross_1), np.abs(cross_2)) / np.where(chord_length > 0, chord_length, 1.0)
+        straight = (chord_length > 0) & (off_chord <= self.flat * 0.5)
+        straight |= (chord_length == 0) & (bend == 0)
+        steps[straight] = 1
+
+        first = np.zeros(len(segs), dtype=np.int64)
+        first[np.cumsum(seg_counts) - seg_counts] = 1
+        emitted = steps + first
+        seg_index = np.repeat(np.arange(len(segs)), emitted)
+        local = np.arange(emitted.sum()) - np.repeat(np.cumsum(emitted) - emitted, emitted)
+        t = ((local + 1 - first[seg_index]) / steps[seg_index])[:, None]
+        mt = 1.0 - t
+        points = (
+            mt ** 3 * p0[seg_index]
+            + 3 * mt ** 2 * t * c1[seg_index]
+            + 3 * mt * t ** 2 * c2[seg_index]
+            + t ** 3 * p3[seg_index]
+        )
+        segment_ends = np.cumsum(seg_counts)
+        path_lengths = np.add.reduceat(emitted, segment_ends - seg_counts)
+        return points, path_lengths
+
+    def subdivide_adaptive(self, segs, seg_counts):
+        """Split cubic segments until every piece is within ``flat`` of its chord.
+
+        Each pass cuts the pieces that are still too coarse into as many equal
+        parameter steps as their deviation calls for (it shrinks with the square of
+        the step), so flat stretches of a curve stay long while tight bends get
+        refined again. Finished pieces are sorted back into curve order at the end.
+        """
+        count = len(segs)
+        seg_ids = np.arange(count)
+        t0 = np.zeros(count)
+        t1 = np.ones(count)
+        done_ids = []
+        done_t = []
+        done_points = []
+        for refine in range(MAX_REFINE_PASSES + 1):
+            pieces = sub_cubic(segs[seg_ids], t0, t1)
+            deviation = chord_deviation(pieces)
+            finished = deviation <= self.flat
+            if refine == MAX_REFINE_PASSES:
+                finished[:] = True
+            done_ids.append(seg_ids[finished])
+            done_t.append(t1[finished])
+            done_points.append(pieces[finished, 3])
+            split = ~finished
+            if not split.any():
+                break
+            steps = np.clip(np.ceil(np.sqrt(deviation[split] / self.flat)), 2, MAX_CURVE_STEPS).astype(np.int64)
+            source = np.repeat(np.flatnonzero(split), steps)
+            local = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+            last = local == np.repeat(steps - 1, steps)
+            width = (t1[source] - t0[source]) / np.repeat(steps, steps)
+            seg_ids = seg_ids[source]
+            t0, t1 = t0[source] + local * width, np.where(last, t1[source], t0[source] + (local + 1) * width)
+
+        seg_ids = np.concatenate(done_ids)
+        order = np.lexsort((np.concatenate(done_t), seg_ids))
+        ends = np.concatenate(done_points)[order]
+        pieces_per_seg = np.bincount(seg_ids, minlength=count)
+        first_segs = np.cumsum(seg_counts) - seg_counts
+        pieces_per_path = np.add.reduceat(pieces_per_seg, first_segs)
+        points = np.insert(ends, np.cumsum(pieces_per_path) - pieces_per_path, segs[first_segs, 0], axis=0)
+        return points, pieces_per_path + 1
+
+    def collinear_keep(self, points, starts):
+        """Mask of points to keep after dropping those on the line through their neighbours.
+
+        Only every other point of a run of droppable points goes in one pass, so each
+        is measured against neighbours that stay.
+        """
+        count = len(points)
+        if count < 3:
+            return np.ones(count, dtype=bool)
+        ends = np.zeros(count, dtype=bool)
+        ends[:-1] = starts[1:]
+        ends[-1] = True
+        middle = np.zeros(count, dtype=bool)
+        middle[1:-1] = ~(starts[1:-1] | ends[1:-1])
+        # Distance of each point from the segment joining its neighbours.
+        before = points[:-2].astype(float)
+        chord = points[2:] - before
+        rel = points[1:-1] - before
+        length_sq = np.einsum("ij,ij->i", chord, chord).astype(float)
+        t = np.clip(np.einsum("ij,ij->i", rel, chord) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        away = rel - t[:, None] * chord
+        candidate = np.zeros(count, dtype=bool)
+        candidate[1:-1] = np.hypot(away[:, 0], away[:, 1]) <= COLLINEAR_TOLERANCE
+        candidate &= middle
+        run_start = candidate.copy()
+        run_start[1:] &= ~candidate[:-1]
+        index = np.arange(count)
+        run_origin = np.maximum.accumulate(np.where(run_start, index, 0))
+        drop = candidate & ((index - run_origin) % 2 == 0)
+        return ~drop
+
+    def alignment_shift(self, points, matrix):
+        """Offset that moves the drawing (autoAlign) or the page to the plotter origin."""
+        if self.options.autoAlign:
+            low = points.min(axis=0)
+            high = points.max(axis=0)
+        else:
+            x, y, width, height = self.svg.get_viewbox()
+            corners = np.array([[x, y], [x + width, y], [x, y + height], [x + width, y + height]])
+            linear = np.array([[matrix.a, matrix.c], [matrix.b, matrix.d]])
+            corners = corners @ linear.T + np.array([matrix.e, matrix.f])
+            low = corners.min(axis=0)
+            high = corners.max(axis=0)
+        if self.center:
+            return -(low + high) / 2.0
+        return -low
+
+    def overcut_points(self, points):
+        """Points that retrace a closed path from its start for the overcut length."""
+        extra = []
+        travelled = 0.0
+        for (ax, ay), (bx, by) in zip(points, points[1:]):
+            length = math.hypot(bx - ax, by - ay)
+            if travelled + length >= self.overcut:
+                ratio = (self.overcut - travelled) / length
+                extra.append((ax + (bx - ax) * ratio, ay + (by - ay) * ratio))
+                break
+            travelled += length
+            extra.append((bx, by))
+        return extra
+
+    def compensate(self, points, pen_down):
+        """Drag-knife (tool offset) compensation for the whole point stream.
+
+        The pivot is run ``tool_offset`` past every cut point along the cut
+        direction, then swung around the point on an arc until the blade faces the
+        next segment. Travel moves keep the direction of the last cut. Returns the
+        new points, their pen state and the index of the input point each came from.
+        """
+        offset = self.tool_offset
+        count = len(points)
+        delta = np.diff(points, axis=0)
+        length = np.hypot(delta[:, 0], delta[:, 1])
+        unit = delta / np.where(length > 0, length, 1.0)[:, None]
+
+        incoming = np.zeros_like(points)
+        incoming[1:] = unit
+        travel = np.flatnonzero(~pen_down[2:]) + 2
+        incoming[travel] = unit[travel - 2]
+        if count > 1 and not pen_down[1]:
+            incoming[1] = 0.0
+        outgoing = np.zeros_like(points)
+        outgoing[:-1] = unit
+
+        swivel = np.zeros(count, dtype=bool)
+        swivel[1:-1] = pen_down[2:]
+        start_angle = np.arctan2(incoming[:, 1], incoming[:, 0])
+        sweep = np.arctan2(outgoing[:, 1], outgoing[:, 0]) - start_angle
+        sweep = np.where(sweep > np.pi, sweep - 2 * np.pi, sweep)
+        sweep = np.where(sweep < -np.pi, sweep + 2 * np.pi, sweep)
+        step = 2 * math.acos(max(-1.0, 1.0 - min(self.flat, offset) / offset))
+        arc_steps = np.where(swivel, np.maximum(np.ceil(np.abs(sweep) / step) - 1, 0), 0).astype(np.int64)
+
+        emitted = 1 + np.where(swivel, arc_steps + 1, 0)
+        source = np.repeat(np.arange(count), emitted)
+        local = np.arange(emitted.sum()) - np.repeat(np.cumsum(emitted) - emitted, emitted)
+        angle = start_angle[source] + np.sign(sweep[source]) * local * step
+        out = points[source] + offset * np.column_stack((np.cos(angle), np.sin(angle)))
+        corner = local == 0
+        out[corner] = points[source[corner]] + incoming[source[corner]] * offset
+        toward = local == arc_steps[source] + 1
+        out[toward] = points[source[toward]] + outgoing[source[toward]] * offset
+        out_pen_down = np.where(corner, pen_down[source], True)
+        return out, out_pen_down, source
+
+    def format_stream(self, points, pen_down, state_index, state_table):
+        """Yield PU/PD commands, joining consecutive pen-down points into one PD."""
+        xy = np.rint(points).astype(np.int64)
+        if not self.center:
+            np.maximum(xy, 0, out=xy)
+        keep = np.ones(len(xy), dtype=bool)
+        keep[1:] = (pen_down[1:] != pen_down[:-1]) | np.any(xy[1:] != xy[:-1], axis=1)
+        xy = xy[keep]
+        pen_down = pen_down[keep]
+        state_index = state_index[keep]
+
+        state_change = np.ones(len(xy), dtype=bool)
+        state_change[1:] = state_index[1:] != state_index[:-1]
+        new_command = ~pen_down | state_change
+        new_command[1:] |= ~pen_down[:-1]
+        starts = np.flatnonzero(new_command).tolist()
+        ends = starts[1:] + [len(xy)]
+
+        last_pen, last_speed, last_force = -1, -1, -1
+        first = 0
+        while first < len(starts):
+            # Commands up to about FORMAT_BATCH points (at least one) per piece.
+            last = bisect.bisect_right(starts, starts[first] + FORMAT_BATCH, lo=first + 1)
+            base = starts[first]
+            coords = list(map(str, xy[base:ends[last - 1]].ravel().tolist()))
+            parts = []
+            for begin, end in zip(starts[first:last], ends[first:last]):
+                if state_change[begin]:
+                    pen, speed, force = state_table[state_index[begin]]
+                    if pen != last_pen:
+                        parts.append(f";PU;SP{pen}")
+                    if speed != last_speed and speed > 0:
+                        parts.append(f";VS{speed}")
+                    if force != last_force and force > 0:
+                        parts.append(f";FS{force}")
+                    last_pen, last_speed, last_force = pen, speed, force
+                parts.append(";PD" if pen_down[begin] else ";PU")
+                parts.append(",".join(coords[2 * (begin - base):2 * (end - base)]))
+            yield "".join(parts)
+            first = last
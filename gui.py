@@ -1,9 +1,64 @@
+import threading
 import time
 from pathlib import Path
 
 from inkex.gui import Gtk, GLib
 from gi.repository import GdkPixbuf
+from hotplug import HotplugMonitor
+from plot import SERIAL_OPTIONS, PlotCancelled
 from plotters import plotters
+from spool import spawn_runner
+
+# Minimum seconds between progress updates posted from the send worker.
+PROGRESS_INTERVAL = 0.1
+# Seconds between device polls when no hotplug events are available.
+POLL_INTERVAL = 2
+# Safety-net poll interval while hotplug events are being delivered.
+HOTPLUG_FALLBACK_INTERVAL = 30
+# Let sysfs attributes and device nodes settle before enumerating after an event.
+HOTPLUG_SETTLE_MS = 250
+# Seconds closing the window waits for the send thread to pause before handing the job off.
+HANDOFF_TIMEOUT = 5
+# Seconds a decoded icon is trusted before its file mtime is checked again.
+ICON_RECHECK_SECONDS = 30
+# Quiet time after an option change before the job is generated again in the background.
+PREPARE_DELAY_MS = 600
+
+# (icon name, size) -> (path, mtime_ns, pixbuf, checked_at)
+_pixbuf_cache = {}
+# (icon key, fallback, size) -> icon name to show, or None for the theme's image-missing
+_icon_resolution = {}
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def load_icon_pixbuf(base_dir, name, size):
+    """Return a scaled pixbuf for icons/<name>.png, decoding only when the file changed."""
+    key = (name, size)
+    path = base_dir / f"{name}.png"
+    now = time.monotonic()
+    cached = _pixbuf_cache.get(key)
+    if cached and cached[0] == path and now - cached[3] < ICON_RECHECK_SECONDS:
+        return cached[2]
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        _pixbuf_cache.pop(key, None)
+        return None
+    if cached and cached[0] == path and cached[1] == mtime:
+        _pixbuf_cache[key] = (path, mtime, cached[2], now)
+        return cached[2]
+    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+        str(path), width=size, height=size, preserve_aspect_ratio=True
+    )
+    _pixbuf_cache[key] = (path, mtime, pixbuf, now)
+    return pixbuf
 
 
 class KMPlotGUI:
@@ -54,10 +109,33 @@ class KMPlotGUI:
         self.port_combo.connect("changed", self.on_port_changed)
         self.port_combo.set_halign(Gtk.Align.CENTER)
 
+        self.all_ports_check = Gtk.CheckButton()
+        self.all_ports_check.set_no_show_all(True)
+        self.all_ports_check.set_tooltip_text(
+            "Cut this document on every connected plotter of the selected model at once."
+        )
+
         self.cut_button = Gtk.Button(label="Send to plotter")
         self.cut_button.set_sensitive(False)
         self.cut_button.connect("clicked", self.on_cut_clicked)
 
+        self.recut_button = Gtk.Button(label="Cut again")
+        self.recut_button.set_tooltip_text("Send the last job sent to any plotter again, without regenerating it.")
+        self.recut_button.set_sensitive(False)
+        self.recut_button.connect("clicked", self.on_recut_clicked)
+
+        self.estimate_button = Gtk.Button(label="Estimate")
+        self.estimate_button.set_tooltip_text("Generate the job without sending it and show how long it will take.")
+        self.estimate_button.connect("clicked", self.on_estimate_clicked)
+
+        self.cancel_button = Gtk.Button(label="Cancel")
+        self.cancel_button.set_no_show_all(True)
+        self.cancel_button.connect("clicked", self.on_cancel_clicked)
+
+        self.progress_bar = Gtk.ProgressBar()
+        self.progress_bar.set_show_text(True)
+        self.progress_bar.set_no_show_all(True)
+
         self.status_bar = Gtk.Label(label="Searching for devices...")
         self.status_bar.set_xalign(0)
 
@@ -74,6 +152,7 @@ class KMPlotGUI:
         port_row.set_halign(Gtk.Align.CENTER)
         port_row.pack_start(self.port_combo, False, False, 0)
         main_box.pack_start(port_row, False, False, 0)
+        main_box.pack_start(self.all_ports_check, False, False, 0)
         main_box.pack_start(self.port_info_frame, False, False, 10)
         main_box.pack_start(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL), False, False, 12)
         main_box.pack_start(self.device_image, False, False, 6)
@@ -166,6 +245,10 @@ class KMPlotGUI:
             [("xonxoff", "XON/XOFF"), ("rtscts", "RTS/CTS"), ("dsrdtrrtscts", "DSR/DTR+RTS/CTS"), ("none", "None")],
             str(getattr(self.options, "serialFlowControl", "xonxoff")).lower(),
         )
+        pacing_combo = combo(
+            [("auto", "Per device"), ("buffer", "Ask for buffer space"), ("off", "Flow control only")],
+            str(getattr(self.options, "serialPacing", "auto")).lower(),
+        )
         resx_spin = spin_float(float(getattr(self.options, "resolutionX", 1016.0)), 10, 5000, 10, digits=1)
         resy_spin = spin_float(float(getattr(self.options, "resolutionY", 1016.0)), 10, 5000, 10, digits=1)
         pen_spin = spin_int(int(getattr(self.options, "pen", 1)), 0, 10, 1)
@@ -175,6 +258,20 @@ class KMPlotGUI:
             [("0", "0°"), ("90", "90°"), ("180", "180°"), ("270", "270°")],
             str(getattr(self.options, "orientation", "0")),
         )
+        encoder_combo = combo(
+            [("native", "Built-in"), ("inkscape", "Inkscape's encoder")],
+            str(getattr(self.options, "encoder", "native")),
+        )
+        output_combo = combo(
+            [
+                ("auto", "Best for device"),
+                ("absolute", "Compact"),
+                ("relative", "Relative (PR)"),
+                ("pe", "Polyline encoded (PE)"),
+                ("off", "As generated"),
+            ],
+            str(getattr(self.options, "compactOutput", "auto")),
+        )
         mirrorx_check = Gtk.CheckButton(label="Mirror X")
         mirrorx_check.set_active(bool(getattr(self.options, "mirrorX", False)))
         mirrory_check = Gtk.CheckButton(label="Mirror Y")
@@ -185,9 +282,24 @@ class KMPlotGUI:
         precut_check.set_active(bool(getattr(self.options, "precut", True)))
         autoalign_check = Gtk.CheckButton(label="Auto align")
         autoalign_check.set_active(bool(getattr(self.options, "autoAlign", True)))
+        optimize_check = Gtk.CheckButton(label="Optimize travel")
+        optimize_check.set_active(bool(getattr(self.options, "optimizeTravel", True)))
+        inner_check = Gtk.CheckButton(label="Cut inner contours first")
+        inner_check.set_active(bool(getattr(self.options, "innerFirst", True)))
         overcut_spin = spin_float(float(getattr(self.options, "overcut", 1.0)), 0, 10, 0.1, digits=2)
         flat_spin = spin_float(float(getattr(self.options, "flat", 1.2)), 0.1, 10, 0.1, digits=2)
+        adaptive_check = Gtk.CheckButton(label="Match curves to resolution")
+        adaptive_check.set_active(bool(getattr(self.options, "adaptiveFlatten", True)))
         tool_spin = spin_float(float(getattr(self.options, "toolOffset", 0.25)), 0, 10, 0.05, digits=2)
+        copies_spin = spin_int(int(getattr(self.options, "copies", 1)), 1, 1000, 1)
+        media_spin = spin_float(float(getattr(self.options, "mediaWidth", 0.0)), 0, 5000, 10, digits=0)
+        spacing_spin = spin_float(float(getattr(self.options, "nestSpacing", 2.0)), 0, 50, 0.5, digits=1)
+        nest_shape_combo = combo(
+            [("hull", "Convex hull"), ("box", "Bounding box")],
+            str(getattr(self.options, "nestShape", "hull")).lower(),
+        )
+        nest_rotate_check = Gtk.CheckButton(label="Allow 90° rotation")
+        nest_rotate_check.set_active(bool(getattr(self.options, "nestRotate", False)))
 
         def set_tip(widget, text):
             try:
@@ -196,40 +308,62 @@ class KMPlotGUI:
                 pass
 
         # Tooltips for plot settings to guide users.
+        set_tip(pacing_combo, "Ask the plotter how much room its buffer has (ESC.B) and never send more. Per device uses the setting in plotters.py.")
         set_tip(resx_spin, "Horizontal resolution in dots per inch (higher is finer).")
         set_tip(resy_spin, "Vertical resolution in dots per inch (higher is finer).")
         set_tip(pen_spin, "Pen number to use when cutting/drawing.")
         set_tip(force_spin, "Downward force in grams; higher presses harder.")
         set_tip(speed_spin, "Movement speed in cm/s; higher is faster.")
         set_tip(orientation_combo, "Rotate the plot by the selected angle.")
+        set_tip(encoder_combo, "HPGL encoder: km-plot's own, or the hpgl_encoder of the Inkscape running km-plot. Inkscape's output is whatever that version produces and can differ between Inkscape releases.")
+        set_tip(output_combo, "Shrink the HPGL sent over serial. Relative and PE output are only used for devices that list them in plotters.py.")
         set_tip(mirrorx_check, "Flip the design horizontally.")
         set_tip(mirrory_check, "Flip the design vertically.")
         set_tip(center_check, "Center the zero point on the page.")
         set_tip(precut_check, "Use a small precut to help corners release cleanly.")
         set_tip(autoalign_check, "Attempt to auto-align the plot to the material.")
+        set_tip(optimize_check, "Reorder paths to reduce pen-up travel between cuts (built-in encoder only).")
+        set_tip(inner_check, "Cut holes and inner details before the outline around them so the material does not shift (built-in encoder only).")
         set_tip(overcut_spin, "Extend cuts past corners to ensure complete separation.")
         set_tip(flat_spin, "Flatness compensation factor.")
+        set_tip(adaptive_check, "Flatten curves to the same accuracy at any resolution and drop points the plotter cannot resolve (built-in encoder only).")
         set_tip(tool_spin, "Offset distance for the tool tip (in mm).")
+        set_tip(copies_spin, "Cut this many copies of the design, packed onto the roll.")
+        set_tip(media_spin, "Usable width of the media across the plotter's Y axis (in mm); needed for more than one copy.")
+        set_tip(spacing_spin, "Gap left between copies (in mm).")
+        set_tip(nest_shape_combo, "Pack copies by their convex hull, so they can interlock, or by their bounding box.")
+        set_tip(nest_rotate_check, "Turn all copies by 90° when that uses less roll.")
 
         add_conn_row("Baud rate", baud_spin); self.adv_controls["serialBaudRate"] = baud_spin
         add_conn_row("Byte size", bytesize_combo); self.adv_controls["serialByteSize"] = bytesize_combo
         add_conn_row("Stop bits", stopbits_combo); self.adv_controls["serialStopBits"] = stopbits_combo
         add_conn_row("Parity", parity_combo); self.adv_controls["serialParity"] = parity_combo
         add_conn_row("Flow control", flow_combo); self.adv_controls["serialFlowControl"] = flow_combo
+        add_conn_row("Pacing", pacing_combo); self.adv_controls["serialPacing"] = pacing_combo
         add_plot_row("Resolution X (dpi)", resx_spin); self.adv_controls["resolutionX"] = resx_spin
         add_plot_row("Resolution Y (dpi)", resy_spin); self.adv_controls["resolutionY"] = resy_spin
         add_plot_row("Pen number", pen_spin); self.adv_controls["pen"] = pen_spin
         add_plot_row("Force (g)", force_spin); self.adv_controls["force"] = force_spin
         add_plot_row("Speed (cm/s)", speed_spin); self.adv_controls["speed"] = speed_spin
         add_plot_row("Orientation", orientation_combo); self.adv_controls["orientation"] = orientation_combo
+        add_plot_row("Encoder", encoder_combo); self.adv_controls["encoder"] = encoder_combo
+        add_plot_row("Output", output_combo); self.adv_controls["compactOutput"] = output_combo
         add_plot_row("Mirror X", mirrorx_check); self.adv_controls["mirrorX"] = mirrorx_check
         add_plot_row("Mirror Y", mirrory_check); self.adv_controls["mirrorY"] = mirrory_check
         add_plot_row("Center", center_check); self.adv_controls["center"] = center_check
         add_plot_row("Precut", precut_check); self.adv_controls["precut"] = precut_check
         add_plot_row("Auto align", autoalign_check); self.adv_controls["autoAlign"] = autoalign_check
+        add_plot_row("Path order", optimize_check); self.adv_controls["optimizeTravel"] = optimize_check
+        add_plot_row("Inner first", inner_check); self.adv_controls["innerFirst"] = inner_check
         add_plot_row("Overcut (mm)", overcut_spin); self.adv_controls["overcut"] = overcut_spin
         add_plot_row("Flatness", flat_spin); self.adv_controls["flat"] = flat_spin
+        add_plot_row("Adaptive curves", adaptive_check); self.adv_controls["adaptiveFlatten"] = adaptive_check
         add_plot_row("Tool offset (mm)", tool_spin); self.adv_controls["toolOffset"] = tool_spin
+        add_plot_row("Copies", copies_spin); self.adv_controls["copies"] = copies_spin
+        add_plot_row("Media width (mm)", media_spin); self.adv_controls["mediaWidth"] = media_spin
+        add_plot_row("Copy spacing (mm)", spacing_spin); self.adv_controls["nestSpacing"] = spacing_spin
+        add_plot_row("Packing", nest_shape_combo); self.adv_controls["nestShape"] = nest_shape_combo
+        add_plot_row("Rotation", nest_rotate_check); self.adv_controls["nestRotate"] = nest_rotate_check
 
         # Connect change handlers to keep self.options in sync.
         baud_spin.connect("value-changed", lambda w: self.update_option("serialBaudRate", int(w.get_value())))
@@ -241,6 +375,9 @@ class KMPlotGUI:
         overcut_spin.connect("value-changed", lambda w: self.update_option("overcut", float(w.get_value())))
         flat_spin.connect("value-changed", lambda w: self.update_option("flat", float(w.get_value())))
         tool_spin.connect("value-changed", lambda w: self.update_option("toolOffset", float(w.get_value())))
+        copies_spin.connect("value-changed", lambda w: self.update_option("copies", int(w.get_value())))
+        media_spin.connect("value-changed", lambda w: self.update_option("mediaWidth", float(w.get_value())))
+        spacing_spin.connect("value-changed", lambda w: self.update_option("nestSpacing", float(w.get_value())))
 
         bytesize_combo.connect(
             "changed",
@@ -257,15 +394,31 @@ class KMPlotGUI:
             "changed",
             lambda w: self.update_option_from_combo("serialFlowControl", w, default="xonxoff"),
         )
+        pacing_combo.connect(
+            "changed", lambda w: self.update_option_from_combo("serialPacing", w, default="auto")
+        )
         orientation_combo.connect(
             "changed", lambda w: self.update_option_from_combo("orientation", w, default="0")
         )
+        encoder_combo.connect(
+            "changed", lambda w: self.update_option_from_combo("encoder", w, default="native")
+        )
+        output_combo.connect(
+            "changed", lambda w: self.update_option_from_combo("compactOutput", w, default="auto")
+        )
+        nest_shape_combo.connect(
+            "changed", lambda w: self.update_option_from_combo("nestShape", w, default="hull")
+        )
 
         mirrorx_check.connect("toggled", lambda w: self.update_option("mirrorX", w.get_active()))
         mirrory_check.connect("toggled", lambda w: self.update_option("mirrorY", w.get_active()))
         center_check.connect("toggled", lambda w: self.update_option("center", w.get_active()))
         precut_check.connect("toggled", lambda w: self.update_option("precut", w.get_active()))
         autoalign_check.connect("toggled", lambda w: self.update_option("autoAlign", w.get_active()))
+        optimize_check.connect("toggled", lambda w: self.update_option("optimizeTravel", w.get_active()))
+        inner_check.connect("toggled", lambda w: self.update_option("innerFirst", w.get_active()))
+        adaptive_check.connect("toggled", lambda w: self.update_option("adaptiveFlatten", w.get_active()))
+        nest_rotate_check.connect("toggled", lambda w: self.update_option("nestRotate", w.get_active()))
 
         conn_box.pack_start(conn_grid, False, False, 0)
         conn_scroller = Gtk.ScrolledWindow()
@@ -288,52 +441,108 @@ class KMPlotGUI:
         footer = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         footer.pack_start(self.status_bar, True, True, 0)
         footer.pack_end(self.cut_button, False, False, 0)
+        footer.pack_end(self.recut_button, False, False, 0)
+        footer.pack_end(self.estimate_button, False, False, 0)
+        footer.pack_end(self.cancel_button, False, False, 0)
 
         root.pack_start(notebook, True, True, 0)
         root.pack_end(footer, False, False, 0)
+        root.pack_end(self.progress_bar, False, False, 0)
 
         self.window.add(root)
         self.window.connect("destroy", self.on_window_close)
         self.window.show_all()
 
+    def start_device_watch(self):
+        self.hotplug = HotplugMonitor(debug=self.debug)
+        if self.hotplug.open():
+            self.hotplug_watch_id = GLib.io_add_watch(
+                self.hotplug.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_hotplug_event
+            )
+            interval = HOTPLUG_FALLBACK_INTERVAL
+        else:
+            self.hotplug = None
+            interval = POLL_INTERVAL
+        self.debug(f"Using poll interval: {interval} seconds")
+        self.poll_id = GLib.timeout_add_seconds(interval, self.poll_devices)
+
+    def stop_device_watch(self):
+        for attr in ("poll_id", "hotplug_watch_id", "hotplug_settle_id"):
+            source_id = getattr(self, attr, None)
+            if source_id:
+                GLib.source_remove(source_id)
+                setattr(self, attr, None)
+        if self.hotplug:
+            self.hotplug.close()
+            self.hotplug = None
+
+    def on_hotplug_event(self, _fd, _condition):
+        events = self.hotplug.read_events() if self.hotplug else []
+        for action, _subsystem, devname in events:
+            self.debug(f"Hotplug {action}: {devname or 'unknown'}")
+        if events and not self.hotplug_settle_id:
+            self.hotplug_settle_id = GLib.timeout_add(HOTPLUG_SETTLE_MS, self.on_hotplug_settled)
+        return True
+
+    def on_hotplug_settled(self):
+        if self.sending:
+            return True
+        self.hotplug_settle_id = None
+        self.poll_devices()
+        return False
+
     def poll_devices(self):
         if getattr(self, "sending", False):
             return True
         self.debug("Polling for devices...")
-        self.update_status_bar("Searching for devices...")
-        devices = list(self.enumerate_with_serial())
-        self.port_entries = []
-        for device_entry in devices:
-            device_path = device_entry["device"]
-            vidpid = device_entry["vidpid"]
-            info_text = device_entry["info"]
-            plotter_info = plotters.get(vidpid)
-            if isinstance(plotter_info, dict):
-                name = plotter_info.get("name", vidpid)
-                icon_key = plotter_info.get("icon")
-            elif plotter_info:
-                name = str(plotter_info)
-                icon_key = None
-            else:
-                name = "Unknown device"
-                icon_key = None
-            display = f"{device_path} ({vidpid})" if vidpid else device_path
-            self.port_entries.append(
-                {
-                    "device": device_path,
-                    "vidpid": vidpid,
-                    "name": name,
-                    "display": display,
-                    "info": info_text,
-                    "icon": icon_key,
-                    "supported": plotter_info is not None,
-                }
-            )
+        self.apply_port_changes(self.scan_ports())
+        return True
+
+    def start_initial_scan(self):
+        """Enumerate ports on a worker so the window is up before pyserial and sysfs are touched."""
+
+        def scan():
+            try:
+                changes = self.scan_ports()
+            except Exception as exc:  # pylint: disable=broad-except
+                self.debug(f"Initial port scan failed: {exc!r}")
+                changes = None
+            GLib.idle_add(self.finish_initial_scan, changes)
+
+        threading.Thread(target=scan, name="kmplot-scan", daemon=True).start()
+
+    def finish_initial_scan(self, changes):
+        # Hotplug and polling only start now, so scan_ports() never runs on two threads.
+        if changes is not None:
+            self.apply_port_changes(changes)
+        self.start_device_watch()
+        return False
+
+    def apply_port_changes(self, changes):
+        if self.ports_rendered and not changes["added"] and not changes["removed"]:
+            return
+        self.ports_rendered = True
+        previous = self.selected_port_entry()
+        removed = {entry["device"] for entry in changes["removed"]}
+        added = {entry["device"]: self.make_port_entry(entry) for entry in changes["added"]}
+        entries = []
+        for entry in self.port_entries:
+            device = entry["device"]
+            if device in added:
+                entries.append(added.pop(device))
+            elif device not in removed:
+                entries.append(entry)
+        entries.extend(added.values())
+        self.port_entries = entries
 
         if self.port_store:
-            self.port_store.clear()
-            for entry in self.port_entries:
-                self.port_store.append([entry["device"], entry["vidpid"] or "", entry["display"]])
+            if self.port_combo:
+                self.port_combo.handler_block_by_func(self.on_port_changed)
+            try:
+                self.sync_port_store()
+            finally:
+                if self.port_combo:
+                    self.port_combo.handler_unblock_by_func(self.on_port_changed)
 
         if not self.port_entries:
             self.debug("No ports detected this cycle.")
@@ -346,9 +555,10 @@ class KMPlotGUI:
                 self.port_info_label.set_text("No Serial Devices Found")
                 self.port_info_frame.set_visible(True)
             self.set_device_icon(None, fallback="noport")
-            self.cut_button.set_sensitive(False)
+            self.update_all_ports_check()
+            self.set_send_buttons_sensitive(False)
             self.update_status_bar("Waiting for a supported plotter...")
-            return True
+            return
 
         if self.port_combo:
             self.port_combo.set_sensitive(True)
@@ -363,57 +573,407 @@ class KMPlotGUI:
                     active_idx = idx
                     break
 
-        if self.port_combo:
+        if self.port_combo and self.port_combo.get_active() != active_idx:
             self.port_combo.handler_block_by_func(self.on_port_changed)
             self.port_combo.set_active(active_idx)
             self.port_combo.handler_unblock_by_func(self.on_port_changed)
 
-        self.apply_port_entry(self.port_entries[active_idx], update_status=not getattr(self, "sending", False))
-        return True
+        selected = self.port_entries[active_idx]
+        if selected != previous:
+            self.apply_port_entry(selected, update_status=True)
+        else:
+            self.update_all_ports_check()
+            self.update_status_bar("Ready")
+
+    def selected_port_entry(self):
+        for entry in self.port_entries:
+            if entry["device"] == self.current_device:
+                return entry
+        return None
+
+    def sync_port_store(self):
+        """Apply port_entries to the combo model with in-place removals, updates and appends."""
+        wanted = {entry["device"]: entry for entry in self.port_entries}
+        present = set()
+        tree_iter = self.port_store.get_iter_first()
+        while tree_iter is not None:
+            device = self.port_store[tree_iter][0]
+            entry = wanted.get(device)
+            if entry is None:
+                if not self.port_store.remove(tree_iter):
+                    tree_iter = None
+                continue
+            row = [entry["device"], entry["vidpid"] or "", entry["display"]]
+            if list(self.port_store[tree_iter]) != row:
+                self.port_store.set(tree_iter, [0, 1, 2], row)
+            present.add(device)
+            tree_iter = self.port_store.iter_next(tree_iter)
+        for entry in self.port_entries:
+            if entry["device"] not in present:
+                self.port_store.append([entry["device"], entry["vidpid"] or "", entry["display"]])
+
+    def make_port_entry(self, device_entry):
+        device_path = device_entry["device"]
+        vidpid = device_entry["vidpid"]
+        plotter_info = plotters.get(vidpid)
+        if isinstance(plotter_info, dict):
+            name = plotter_info.get("name", vidpid)
+            icon_key = plotter_info.get("icon")
+        elif plotter_info:
+            name = str(plotter_info)
+            icon_key = None
+        else:
+            name = "Unknown device"
+            icon_key = None
+        display = f"{device_path} ({vidpid})" if vidpid else device_path
+        return {
+            "device": device_path,
+            "vidpid": vidpid,
+            "name": name,
+            "display": display,
+            "info": device_entry["info"],
+            "icon": icon_key,
+            "supported": plotter_info is not None,
+        }
 
     def apply_port_entry(self, entry, update_status=False):
         self.current_device = entry["device"]
+        if entry["vidpid"] != self.current_vidpid:
+            # The model decides the output encoding (plotters.py), so the job may differ.
+            self.schedule_prepare()
         self.current_vidpid = entry["vidpid"]
         detail = entry["vidpid"] or "unknown VID/PID"
         if self.port_info_label:
             info_text = entry.get("info") or ""
             self.port_info_label.set_text(info_text)
         self.set_device_icon(entry.get("icon"))
-        self.cut_button.set_sensitive(True)
+        self.set_send_buttons_sensitive(not self.estimating)
+        self.update_all_ports_check()
         if update_status:
             self.update_status_bar("Ready")
 
+    def matching_ports(self):
+        """Connected ports with the selected port's VID:PID, the selected one first."""
+        if not self.current_device:
+            return []
+        ports = [self.current_device]
+        if self.current_vidpid:
+            ports += [
+                entry["device"] for entry in self.port_entries
+                if entry["vidpid"] == self.current_vidpid and entry["device"] != self.current_device
+            ]
+        return ports
+
+    def update_all_ports_check(self):
+        if not self.all_ports_check:
+            return
+        count = len(self.matching_ports())
+        if count < 2:
+            self.all_ports_check.hide()
+            return
+        entry = self.selected_port_entry()
+        name = entry["name"] if entry else self.current_vidpid
+        self.all_ports_check.set_label(f"Send to all {count} {name} plotters")
+        self.all_ports_check.show()
+
     def on_port_changed(self, _combo):
         idx = self.port_combo.get_active() if self.port_combo else -1
         if idx is None or idx < 0 or idx >= len(self.port_entries):
             return
         self.apply_port_entry(self.port_entries[idx], update_status=True)
 
+    def option_changed(self, key):
+        if key not in SERIAL_OPTIONS:
+            self.schedule_prepare()
+
+    def schedule_prepare(self):
+        """Generate the job in the background once the options settle, so Send finds it cached."""
+        if self.prepare_timer:
+            GLib.source_remove(self.prepare_timer)
+        self.prepare_timer = GLib.timeout_add(PREPARE_DELAY_MS, self.start_prepare)
+
+    def start_prepare(self):
+        self.prepare_timer = None
+        if self.sending or self.estimating:
+            # The send or estimate generates (and caches) the job itself; see on_estimate_finished.
+            return False
+        try:
+            engine = self.plot_engine.snapshot()
+            _cache, key = engine.hpgl_cache()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.debug(f"Background generation unavailable: {exc!r}")
+            return False
+        running = self.prepare_job
+        if running and running[0] == key and running[1].is_alive():
+            return False
+        self.stop_prepare()
+        if key is None:
+            return False
+        cancel = threading.Event()
+        thread = threading.Thread(
+            target=self.run_prepare_worker, args=(engine, cancel), name="kmplot-prepare", daemon=True
+        )
+        self.prepare_job = (key, thread, cancel)
+        thread.start()
+        return False
+
+    def run_prepare_worker(self, engine, cancel):
+        """Runs on its own thread over a snapshot of the document; errors show up again on Send."""
+        started = time.monotonic()
+        try:
+            ready = engine.prepare(cancel)
+        except Exception as exc:  # pylint: disable=broad-except
+            self.debug(f"Background generation failed: {exc!r}")
+            return
+        if ready:
+            self.debug(f"Job generated in the background in {time.monotonic() - started:.1f}s")
+
+    def stop_prepare(self):
+        if self.prepare_job:
+            self.prepare_job[2].set()
+            self.prepare_job = None
+
+    def wait_for_prepared(self):
+        """On the send thread: let a background run for this very job finish rather than start over."""
+        running = self.prepare_job
+        if not running or not running[1].is_alive():
+            return
+        _cache, key = self.plot_engine.hpgl_cache()
+        if key == running[0]:
+            running[1].join()
+        else:
+            running[2].set()
+
     def on_window_close(self, *_args):
-        if self.poll_id:
-            GLib.source_remove(self.poll_id)
+        self.stop_device_watch()
+        self.stop_prepare()
+        if self.sending and self.pause_event:
+            # Hand the job over instead of dropping it: stop between chunks, leave it
+            # queued at its checkpoint and let a detached runner finish the queue.
+            self.pause_event.set()
+            if self.send_thread:
+                self.send_thread.join(HANDOFF_TIMEOUT)
+            try:
+                spawn_runner()
+            except Exception as exc:  # pylint: disable=broad-except
+                self.debug(f"Could not start the background sender: {exc!r}")
         Gtk.main_quit()
 
     def on_cut_clicked(self, _button):
+        self.start_send(recut=False)
+
+    def on_recut_clicked(self, _button):
+        self.start_send(recut=True)
+
+    def set_send_buttons_sensitive(self, sensitive):
+        self.cut_button.set_sensitive(sensitive)
+        self.recut_button.set_sensitive(sensitive)
+
+    def start_send(self, recut):
         if not self.current_device:
             self.show_dialog("No plotter detected yet.", Gtk.MessageType.ERROR)
             self.update_status_bar("No plotter detected.", error=True)
             return
+        if self.sending or self.estimating:
+            return
+        ports = [self.current_device]
+        if self.all_ports_check.get_visible() and self.all_ports_check.get_active():
+            ports = self.matching_ports()
+        self.sending = True
+        self.estimate_button.set_sensitive(False)
+        self.all_ports_check.set_sensitive(False)
+        self.cancel_event = threading.Event()
+        self.pause_event = threading.Event()
+        self.last_progress_post = 0.0
+        self.port_progress = {}
+        self.set_send_buttons_sensitive(False)
+        if self.port_combo:
+            self.port_combo.set_sensitive(False)
+        self.cancel_button.set_sensitive(True)
+        self.cancel_button.show()
+        self.progress_bar.set_fraction(0.0)
+        message = "Queueing the last job again..." if recut else "Generating HPGL..."
+        self.progress_bar.set_text(message)
+        self.progress_bar.show()
+        self.update_status_bar(message)
+        self.send_thread = threading.Thread(
+            target=self.run_cut_worker,
+            args=(ports, self.cancel_event, self.pause_event, recut),
+            name="kmplot-send",
+            daemon=True,
+        )
+        self.send_thread.start()
+
+    def run_cut_worker(self, ports, cancel_event, pause_event, recut=False):
+        """Runs on the send thread; every GTK update goes back through GLib.idle_add."""
+        error = None
+        cancelled = False
+        jobs = []
         try:
-            self.sending = True
-            self.update_status_bar("Sending to plotter...")
-            self.flush_gui()
-            time.sleep(0.05)
-            self.perform_cut(self.current_device)
-            self.show_dialog(
-                f"Sent the document to {self.current_device}.", Gtk.MessageType.INFO
-            )
-            self.update_status_bar("Sent")
+            if not recut:
+                self.wait_for_prepared()
+            if recut:
+                jobs = self.plot_engine.perform_recut(
+                    ports, progress=self.report_port_progress, cancel=cancel_event, pause=pause_event
+                )
+            elif len(ports) > 1:
+                jobs = self.plot_engine.perform_cut_on(
+                    ports, progress=self.report_port_progress, cancel=cancel_event, pause=pause_event
+                )
+            else:
+                jobs = [
+                    self.perform_cut(ports[0], progress=self.report_progress, cancel=cancel_event, pause=pause_event)
+                ]
+        except PlotCancelled:
+            cancelled = True
         except Exception as exc:  # pylint: disable=broad-except
-            self.show_dialog(f"Cut failed: {exc}", Gtk.MessageType.ERROR)
-            self.update_status_bar(f"Cut failed: {exc}", error=True)
-        finally:
-            self.sending = False
+            error = exc
+        GLib.idle_add(self.on_cut_finished, ports, error, cancelled, jobs)
+
+    def report_progress(self, sent, total, rate):
+        now = time.monotonic()
+        if total and sent < total and now - self.last_progress_post < PROGRESS_INTERVAL:
+            return
+        self.last_progress_post = now
+        GLib.idle_add(self.show_progress, sent, total, rate)
+
+    def report_port_progress(self, port, sent, total, rate):
+        self.port_progress[port] = (sent, total, rate)
+        self.report_progress(*self.combined_progress())
+
+    def combined_progress(self):
+        values = list(self.port_progress.values())
+        return (
+            sum(sent for sent, _total, _rate in values),
+            sum(total or 0 for _sent, total, _rate in values),
+            sum(rate for _sent, _total, rate in values),
+        )
+
+    def show_progress(self, sent, total, rate):
+        if not self.sending:
+            return False
+        if total:
+            fraction = min(sent / total, 1.0)
+            remaining = (total - sent) / rate if rate > 0 else 0.0
+            text = f"{fraction * 100:.0f}% - {rate:.0f} B/s - ETA {format_duration(remaining)}"
+            if len(self.port_progress) > 1:
+                text += " (" + ", ".join(
+                    f"{Path(port).name} {port_sent / port_total * 100:.0f}%"
+                    for port, (port_sent, port_total, _rate) in sorted(self.port_progress.items())
+                    if port_total
+                ) + ")"
+            self.progress_bar.set_fraction(fraction)
+        else:
+            text = f"{sent} bytes - {rate:.0f} B/s"
+            self.progress_bar.pulse()
+        self.progress_bar.set_text(text)
+        self.update_status_bar("Sending to plotter...")
+        return False
+
+    def on_estimate_clicked(self, _button):
+        if self.sending or self.estimating:
+            return
+        self.estimating = True
+        self.estimate_button.set_sensitive(False)
+        self.set_send_buttons_sensitive(False)
+        self.update_status_bar("Estimating...")
+        try:
+            # dry_run() converts the document in place; the live one stays on this thread.
+            engine = self.plot_engine.snapshot()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.on_estimate_finished(None, exc)
+            return
+        threading.Thread(
+            target=self.run_estimate_worker, args=(engine,), name="kmplot-estimate", daemon=True
+        ).start()
+
+    def run_estimate_worker(self, engine):
+        estimate = None
+        error = None
+        try:
+            estimate = engine.dry_run()
+        except Exception as exc:  # pylint: disable=broad-except
+            error = exc
+        GLib.idle_add(self.on_estimate_finished, estimate, error)
+
+    def on_estimate_finished(self, estimate, error):
+        self.estimating = False
+        self.estimate_button.set_sensitive(True)
+        self.set_send_buttons_sensitive(bool(self.current_device))
+        # Options changed meanwhile were not generated ahead; a current job is a cache hit.
+        self.schedule_prepare()
+        if error is not None:
+            self.update_status_bar(f"Estimate failed: {error}", error=True)
+            return False
+        self.update_status_bar(
+            f"About {format_duration(estimate['estimated_seconds'])}: "
+            f"{estimate['bytes']} bytes take {format_duration(estimate['wire_seconds'])} "
+            f"at {estimate['baud']} baud, head moves {format_duration(estimate['motion_seconds'])} "
+            f"({estimate['pen_down_mm'] / 1000:.1f} m cut, {estimate['pen_up_mm'] / 1000:.1f} m travel)"
+        )
+        return False
+
+    def on_cancel_clicked(self, _button):
+        if self.cancel_event:
+            self.cancel_event.set()
+        self.cancel_button.set_sensitive(False)
+        self.update_status_bar("Cancelling...")
+
+    def on_cut_finished(self, ports, error, cancelled, jobs):
+        self.sending = False
+        self.cancel_event = None
+        self.pause_event = None
+        self.send_thread = None
+        self.cancel_button.hide()
+        self.progress_bar.hide()
+        if self.port_combo:
+            self.port_combo.set_sensitive(bool(self.port_entries))
+        self.all_ports_check.set_sensitive(True)
+        self.set_send_buttons_sensitive(bool(self.current_device))
+        self.estimate_button.set_sensitive(True)
+        if cancelled:
+            self.update_status_bar("Cancelled")
+        elif error is not None:
+            self.show_dialog(f"Cut failed: {error}", Gtk.MessageType.ERROR)
+            self.update_status_bar(f"Cut failed: {error}", error=True)
+        elif len(ports) > 1:
+            self.report_ports_finished(jobs)
+        elif jobs[0].state == "queued":
+            self.update_status_bar("Queued: another km-plot window is sending; it will plot this next.")
+        else:
+            self.show_dialog(f"Sent the document to {ports[0]}.", Gtk.MessageType.INFO)
+            summary = "Sent"
+            if self.plot_engine.last_send:
+                summary += f" in {self.plot_engine.last_send['seconds']:.0f}s"
+            nesting = self.plot_engine.last_nesting
+            if nesting:
+                summary += f", {nesting['copies']} copies on {nesting['roll_length_mm']:.0f} mm of roll"
+            compaction = self.plot_engine.last_compaction
+            if compaction and compaction["bytes_after"] < compaction["bytes_before"]:
+                summary += (
+                    f" ({compaction['ratio'] * 100:.0f}% of plain HPGL, "
+                    f"~{compaction['seconds_saved']:.0f}s saved)"
+                )
+            self.update_status_bar(summary)
+        return False
+
+    def report_ports_finished(self, jobs):
+        """One line per plotter: each job of a multi-plotter cut ends on its own."""
+        lines = []
+        failed = False
+        for job in jobs:
+            port = job.manifest.get("device")
+            if job.state == "done":
+                lines.append(f"{port}: sent")
+            elif job.state == "queued":
+                lines.append(f"{port}: queued behind another km-plot window")
+            else:
+                failed = True
+                lines.append(f"{port}: {job.state} ({job.manifest.get('error') or 'not sent'})")
+        level = Gtk.MessageType.WARNING if failed else Gtk.MessageType.INFO
+        self.show_dialog("\n".join(lines), level)
+        done = sum(job.state == "done" for job in jobs)
+        self.update_status_bar(f"Sent to {done} of {len(jobs)} plotters", error=failed)
 
     def show_dialog(self, message, level):
         dialog = Gtk.MessageDialog(
@@ -441,29 +1001,41 @@ class KMPlotGUI:
             base_dir = Path(__file__).resolve().parent / "icons"
 
         def load_icon(name):
-            icon_path = base_dir / f"{name}.png"
-            if icon_path.exists():
+            try:
+                return load_icon_pixbuf(base_dir, name, target_px)
+            except Exception as exc:
                 try:
-                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
-                        str(icon_path), width=target_px, height=target_px, preserve_aspect_ratio=True
-                    )
-                    self.device_image.set_from_pixbuf(pixbuf)
-                    return True
-                except Exception as exc:
-                    try:
-                        self.debug(f"Failed to load icon {icon_path}: {exc}")
-                    except Exception:
-                        pass
-            return False
+                    self.debug(f"Failed to load icon {base_dir / name}.png: {exc}")
+                except Exception:
+                    pass
+            return None
 
-        if icon_key and load_icon(icon_key):
-            return
-        if fallback and load_icon(fallback):
-            return
-        if load_icon("unknown"):
+        resolve_key = (icon_key, fallback, target_px)
+        pixbuf = None
+        if resolve_key in _icon_resolution:
+            name = _icon_resolution[resolve_key]
+            pixbuf = load_icon(name) if name else None
+            if name and pixbuf is None:
+                del _icon_resolution[resolve_key]
+        if resolve_key not in _icon_resolution:
+            name = None
+            for candidate in (icon_key, fallback, "unknown"):
+                if candidate:
+                    pixbuf = load_icon(candidate)
+                    if pixbuf is not None:
+                        name = candidate
+                        break
+            _icon_resolution[resolve_key] = name
+
+        if pixbuf is not None:
+            if self.shown_icon is not pixbuf:
+                self.device_image.set_from_pixbuf(pixbuf)
+                self.shown_icon = pixbuf
             return
-        self.device_image.set_from_icon_name("image-missing", Gtk.IconSize.DIALOG)
-        self.device_image.set_pixel_size(target_px)
+        if self.shown_icon != "image-missing":
+            self.device_image.set_from_icon_name("image-missing", Gtk.IconSize.DIALOG)
+            self.device_image.set_pixel_size(target_px)
+            self.shown_icon = "image-missing"
 
     def flush_gui(self):
         """Process pending GTK events so label updates are shown before blocking work."""
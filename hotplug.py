@@ -0,0 +1,71 @@
+import socket
+import sys
+
+# Kernel object uevents and the multicast group the kernel (not udev) broadcasts on.
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 16384
+
+
+class HotplugMonitor:
+    """Listens for kernel tty add/remove uevents on a non-blocking netlink socket."""
+
+    def __init__(self, subsystems=("tty",), debug=None):
+        self.subsystems = {s.encode("ascii") for s in subsystems}
+        self.sock = None
+        self.debug = debug or (lambda _msg: None)
+
+    def open(self):
+        if not sys.platform.startswith("linux") or not hasattr(socket, "AF_NETLINK"):
+            self.debug("Hotplug events unavailable on this platform; using polling.")
+            return False
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK,
+                socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                NETLINK_KOBJECT_UEVENT,
+            )
+            sock.bind((0, UEVENT_KERNEL_GROUP))
+        except OSError as exc:
+            self.debug(f"Hotplug netlink socket failed: {exc!r}; using polling.")
+            return False
+        self.sock = sock
+        return True
+
+    def fileno(self):
+        return self.sock.fileno() if self.sock else -1
+
+    def read_events(self):
+        """Drain pending uevents and return (action, subsystem, devname) for watched subsystems."""
+        events = []
+        if not self.sock:
+            return events
+        while True:
+            try:
+                data = self.sock.recv(UEVENT_BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                self.debug(f"Hotplug netlink read failed: {exc!r}")
+                break
+            event = self.parse_uevent(data)
+            if event and event[1] in self.subsystems:
+                events.append(tuple(part.decode("utf8", "replace") for part in event))
+        return events
+
+    @staticmethod
+    def parse_uevent(data):
+        fields = {}
+        for item in data.split(b"\0")[1:]:
+            key, sep, value = item.partition(b"=")
+            if sep:
+                fields[key] = value
+        action = fields.get(b"ACTION")
+        if action not in (b"add", b"remove", b"change"):
+            return None
+        return action, fields.get(b"SUBSYSTEM", b""), fields.get(b"DEVNAME", b"")
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
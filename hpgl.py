@@ -0,0 +1,469 @@
+"""Read and write the ';'-separated HPGL command stream produced by the encoders."""
+import math
+
+
+# Commands compact output collects before handing them on as one string.
+OUTPUT_BATCH = 256
+# Commands PenTracker.feed() turns into pen moves.
+MOTION_COMMANDS = ("PU", "PD", "PA", "PR", "PE")
+# State commands that only need sending when their value changes.
+STATE_COMMANDS = ("SP", "VS", "FS")
+# Output encodings understood by compact().
+ENCODINGS = ("absolute", "relative", "pe")
+# PE commands are restarted at the next pen-up move past this length, so a
+# spooled job always has a resume point (a command boundary) nearby.
+PE_SPLIT_CHARS = 2048
+
+
+def iter_command_text(hpgl):
+    """Yield (offset, text) for each ';'-separated command.
+
+    ``hpgl`` is a string or an iterable of string pieces (split anywhere, even
+    inside a command); offsets count characters from the start of the whole
+    stream, so a job can be scanned without holding all of it.
+    """
+    if isinstance(hpgl, str):
+        hpgl = (hpgl,)
+    pending = ""
+    offset = 0
+    for piece in hpgl:
+        pending += piece
+        parts = pending.split(";")
+        pending = parts.pop()
+        for part in parts:
+            yield offset, part
+            offset += len(part) + 1
+    if pending:
+        yield offset, pending
+
+
+def iter_commands(hpgl):
+    """Yield (mnemonic, params) for each command in an HPGL string or stream of pieces."""
+    for _offset, raw in iter_command_text(hpgl):
+        raw = raw.strip()
+        if raw:
+            yield raw[:2].upper(), raw[2:].strip()
+
+
+def parse_coords(params):
+    if not params:
+        return []
+    values = [int(round(float(value))) for value in params.split(",")]
+    if len(values) % 2:
+        raise ValueError(f"Odd number of coordinates: {params!r}")
+    return list(zip(values[0::2], values[1::2]))
+
+
+def iter_moves(hpgl):
+    """Yield ("PU" | "PD", (x, y)) for every pen position, whatever the encoding.
+
+    Absolute, PR and PE coordinates are all resolved to absolute points; a PU or
+    PD without coordinates yields the current position. Every other command is
+    yielded as (mnemonic, params).
+    """
+    tracker = PenTracker()
+    for mnemonic, params in iter_commands(hpgl):
+        moves = tracker.feed(mnemonic, params)
+        if mnemonic in MOTION_COMMANDS:
+            yield from moves
+        else:
+            yield mnemonic, params
+
+
+class PenTracker:
+    """Follows pen position, PA/PR mode and SP/VS/FS state through a command stream."""
+
+    def __init__(self):
+        self.position = (0, 0)
+        self.relative = False
+        self.pen = "PU"
+        self.state = {}
+
+    def feed(self, mnemonic, params):
+        """Apply one command; returns the (pen, point) moves it makes."""
+        if mnemonic == "PE":
+            moves = []
+            for pen, position, pen_select in _decode_pe(params, self.position):
+                if pen_select is not None:
+                    self.state["SP"] = str(pen_select)
+                    continue
+                self.pen = pen
+                self.position = position
+                moves.append((pen, position))
+            return moves
+        if mnemonic in STATE_COMMANDS:
+            self.state[mnemonic] = params
+            return []
+        if mnemonic == "IN":
+            self.relative = False
+            self.pen = "PU"
+            self.state.clear()
+            return []
+        if mnemonic in ("PA", "PR"):
+            self.relative = mnemonic == "PR"
+        elif mnemonic in ("PU", "PD"):
+            self.pen = mnemonic
+        else:
+            return []
+        points = parse_coords(params)
+        if not points and mnemonic in ("PU", "PD"):
+            return [(self.pen, self.position)]
+        moves = []
+        for x, y in points:
+            if self.relative:
+                self.position = (self.position[0] + x, self.position[1] + y)
+            else:
+                self.position = (x, y)
+            moves.append((self.pen, self.position))
+        return moves
+
+    def restart_commands(self):
+        """Commands that bring a freshly initialised plotter to this pen-up state."""
+        x, y = (int(round(value)) for value in self.position)
+        commands = ["IN"]
+        commands += [name + self.state[name] for name in STATE_COMMANDS if name in self.state]
+        commands.append(f"PU{x},{y}")
+        if self.relative:
+            commands.append("PR")
+        return ";".join(commands) + ";"
+
+
+def resume_point(hpgl, offset):
+    """Where to restart a job (a string or pieces) of which the first ``offset`` characters were delivered.
+
+    Returns (start, prefix): send ``prefix`` and then ``hpgl[start:]``. ``start`` is
+    the last command boundary at or before ``offset`` where the pen is up or is
+    about to be lifted, so at worst the path in progress is cut again from its
+    beginning. ``prefix`` terminates whatever partial command reached the plotter,
+    then re-initialises it and restores the pen, speed, force, position and
+    coordinate mode in effect there.
+    """
+    if offset <= 0:
+        return 0, ""
+    tracker = PenTracker()
+    best = (0, ";")
+    for start, raw in iter_command_text(hpgl):
+        if start > offset:
+            break
+        raw = raw.strip()
+        if raw:
+            mnemonic, params = raw[:2].upper(), raw[2:].strip()
+            if tracker.pen == "PU" or mnemonic == "PU" or (mnemonic == "PE" and params.lstrip("7").startswith("<")):
+                best = (start, ";" + tracker.restart_commands())
+            tracker.feed(mnemonic, params)
+    return best
+
+
+def _decode_pe(params, position):
+    """Yield (pen, point, None) per PE coordinate pair and (None, None, pen) per ':' flag."""
+    seven_bit = False
+    fraction = 0
+    pen_up = False
+    absolute = False
+    pair = []
+    idx = 0
+    while idx < len(params):
+        char = params[idx]
+        if char == "7":
+            seven_bit = True
+            idx += 1
+        elif char == "<":
+            pen_up = True
+            idx += 1
+        elif char == "=":
+            absolute = True
+            idx += 1
+        elif char in ":>":
+            value, idx = _decode_pe_number(params, idx + 1, seven_bit)
+            if char == ">":
+                fraction = value
+            else:
+                yield None, None, value
+        elif ord(char) >= 63:
+            value, idx = _decode_pe_number(params, idx, seven_bit)
+            pair.append(value / (1 << fraction) if fraction else value)
+            if len(pair) == 2:
+                if absolute:
+                    position = (pair[0], pair[1])
+                else:
+                    position = (position[0] + pair[0], position[1] + pair[1])
+                yield ("PU" if pen_up else "PD"), position, None
+                pair = []
+                pen_up = absolute = False
+        else:
+            idx += 1
+
+
+def _decode_pe_number(params, idx, seven_bit):
+    bits, terminal, top = (5, 95, 126) if seven_bit else (6, 191, 254)
+    value = 0
+    shift = 0
+    while idx < len(params):
+        code = ord(params[idx])
+        idx += 1
+        if terminal <= code <= top:
+            value |= (code - terminal) << shift
+            break
+        value |= (code - 63) << shift
+        shift += bits
+    return (value >> 1 if not value & 1 else -(value >> 1)), idx
+
+
+def measure(hpgl):
+    """Distance travelled with the pen down and up, per VS speed in effect.
+
+    Returns {"pen_down": {speed: units}, "pen_up": {speed: units}, "lifts": n}
+    where speed is the VS parameter string, or None for the device default.
+    """
+    pen_down = {}
+    pen_up = {}
+    lifts = 0
+    speed = None
+    position = (0, 0)
+    was_down = False
+    for mnemonic, value in iter_moves(hpgl):
+        if mnemonic == "VS":
+            speed = value or None
+        elif mnemonic == "IN":
+            speed = None
+            was_down = False
+        elif mnemonic in ("PU", "PD"):
+            table = pen_down if mnemonic == "PD" else pen_up
+            table[speed] = table.get(speed, 0.0) + math.hypot(value[0] - position[0], value[1] - position[1])
+            if mnemonic == "PU" and was_down:
+                lifts += 1
+            was_down = mnemonic == "PD"
+            position = value
+    return {"pen_down": pen_down, "pen_up": pen_up, "lifts": lifts}
+
+
+def split_runs(hpgl):
+    """Split HPGL into blocks of raw commands and runs of subpaths.
+
+    Each block is either a command string (``"SP1"``, ``"VS20"``, ...) that must
+    stay in place, or a list of subpaths. A subpath is a list of (x, y) points
+    whose first point is the pen-up target and the rest are pen-down points.
+    Pen-up moves that are not followed by a cut are dropped; a bare "PU" is kept
+    as a command.
+    """
+    blocks = []
+    run = []
+    path = None
+    position = (0, 0)
+    for mnemonic, params in iter_commands(hpgl):
+        if mnemonic == "PU" and params:
+            position = parse_coords(params)[-1]
+            path = None
+            continue
+        if mnemonic == "PD":
+            points = parse_coords(params) or [position]
+            if path is None:
+                path = [position]
+                run.append(path)
+            path.extend(points)
+            position = points[-1]
+            continue
+        if run:
+            blocks.append(run)
+            run = []
+        path = None
+        blocks.append(mnemonic + params)
+    if run:
+        blocks.append(run)
+    return blocks
+
+
+def format_path(points):
+    first = points[0]
+    text = f";PU{first[0]},{first[1]}"
+    if len(points) > 1:
+        text += ";PD" + ",".join(f"{x},{y}" for x, y in points[1:])
+    return text
+
+
+def join_runs(blocks):
+    """Inverse of split_runs(); every command is emitted with a leading ';'."""
+    parts = []
+    for block in blocks:
+        if isinstance(block, str):
+            parts.append(";" + block)
+        else:
+            parts.extend(format_path(points) for points in block)
+    return "".join(parts)
+
+
+def compact(hpgl, encoding="absolute"):
+    """Rewrite an encoder stream in fewer bytes without changing what gets cut."""
+    return "".join(iter_compact(hpgl, encoding))
+
+
+def iter_compact(hpgl, encoding="absolute"):
+    """compact() for a string or a stream of pieces, yielding the output in batches.
+
+    Consecutive PD lists are merged; pen-up moves followed by another pen-up
+    move, repeated SP/VS/FS values, zero-length PD points and bare PU commands
+    that a following move makes redundant are dropped. ``encoding`` picks how
+    coordinates are written: "absolute" (PU/PD), "relative" (PR deltas) or "pe"
+    (HP-GL/2 Polyline Encoded). The result always ends in absolute mode, so
+    commands appended after it behave as before.
+    """
+    writer = _Writer(encoding)
+    state = {}
+    position = None
+    target = None
+    lift = False
+    pen_down = False
+    for mnemonic, params in iter_commands(hpgl):
+        if len(writer.parts) >= OUTPUT_BATCH:
+            yield writer.take()
+        if mnemonic == "PU":
+            if params:
+                target = parse_coords(params)[-1]
+            lift = pen_down
+            continue
+        if mnemonic == "PD":
+            if target is not None:
+                writer.move(target)
+                position = target
+                pen_down = False
+            elif lift:
+                writer.lift()
+                pen_down = False
+            target = None
+            lift = False
+            if not params and position is None:
+                writer.command("PD")
+                pen_down = True
+                continue
+            for point in parse_coords(params) or [position]:
+                if point == position and pen_down:
+                    continue
+                writer.draw(point)
+                position = point
+                pen_down = True
+            continue
+        if mnemonic in STATE_COMMANDS:
+            if state.get(mnemonic) == params:
+                continue
+            state[mnemonic] = params
+            if mnemonic == "SP" and pen_down:
+                writer.lift()
+                pen_down = lift = False
+            writer.command(mnemonic + params)
+            continue
+        # Anything else may depend on the pen position, so settle it first.
+        if target is not None:
+            writer.move(target)
+            target = None
+        elif lift:
+            writer.lift()
+        pen_down = lift = False
+        state.clear()
+        position = None
+        writer.command(mnemonic + params, foreign=True)
+    if target is not None:
+        writer.move(target)
+    elif lift:
+        writer.lift()
+    yield writer.finish()
+
+
+def pe_number(value):
+    """One integer in 7-bit (base 32) Polyline Encoded form, low digits first."""
+    value = 2 * value if value >= 0 else -2 * value + 1
+    chars = []
+    while value >= 32:
+        chars.append(chr(63 + (value & 31)))
+        value >>= 5
+    chars.append(chr(95 + value))
+    return "".join(chars)
+
+
+class _Writer:
+    """Output side of compact(): buffers one PU/PD/PE command at a time."""
+
+    def __init__(self, encoding):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown HPGL encoding: {encoding!r}")
+        self.encoding = encoding
+        self.parts = []
+        self.kind = None
+        self.coords = []
+        # Last point written; None while the plotter position is unknown to us.
+        self.position = None
+        self.relative = False
+        self.pe_length = 0
+
+    def move(self, point):
+        self.point(point, "PU")
+
+    def draw(self, point):
+        self.point(point, "PD")
+
+    def point(self, point, kind):
+        if self.encoding == "pe":
+            self.pe_point(point, kind)
+            return
+        if self.encoding == "relative" and self.position is not None and not self.relative:
+            self.flush()
+            self.parts.append(";PR")
+            self.relative = True
+        if kind != self.kind:
+            self.flush()
+            self.kind = kind
+        if self.relative:
+            self.coords.append(f"{point[0] - self.position[0]},{point[1] - self.position[1]}")
+        else:
+            self.coords.append(f"{point[0]},{point[1]}")
+        self.position = point
+
+    def pe_point(self, point, kind):
+        if self.kind != "PE7" or (kind == "PU" and self.pe_length > PE_SPLIT_CHARS):
+            self.flush()
+            self.kind = "PE7"
+            self.pe_length = 0
+        flag = "<" if kind == "PU" else ""
+        if self.position is None:
+            x, y = point
+            flag += "="
+        else:
+            x, y = point[0] - self.position[0], point[1] - self.position[1]
+        self.coords.append(flag + pe_number(x) + pe_number(y))
+        self.pe_length += len(self.coords[-1])
+        self.position = point
+
+    def flush(self):
+        if self.kind == "PE7":
+            self.parts.append(";PE7" + "".join(self.coords))
+        elif self.kind is not None:
+            self.parts.append(f";{self.kind}" + ",".join(self.coords))
+        self.kind = None
+        self.coords = []
+
+    def lift(self):
+        self.flush()
+        self.parts.append(";PU")
+
+    def command(self, text, foreign=False):
+        """Emit a non-motion command; ``foreign`` ones may change mode or position."""
+        self.flush()
+        if foreign:
+            self.restore_absolute()
+            self.position = None
+        self.parts.append(";" + text)
+
+    def restore_absolute(self):
+        if self.relative:
+            self.parts.append(";PA")
+            self.relative = False
+
+    def take(self):
+        """The commands written so far, as one string; they are not kept."""
+        text = "".join(self.parts)
+        self.parts = []
+        return text
+
+    def finish(self):
+        self.flush()
+        self.restore_absolute()
+        return self.take()
@@ -0,0 +1,71 @@
+"""Import-time profile for KM_PLOT_PROFILE_IMPORTS=1.
+
+install_from_env() is called by each entry point before anything heavy loads.
+install() wraps __import__ and, at exit, prints to stderr the modules that took
+longest to import, by their own time (excluding the modules they imported in
+turn) and including them. For a full tree, Python's own PYTHONPROFILEIMPORTTIME=1
+works as well.
+"""
+import atexit
+import builtins
+import os
+import sys
+import time
+
+# Number of modules listed in the report.
+REPORT_LIMIT = 25
+
+_original_import = builtins.__import__
+_started = time.perf_counter()
+# name -> [inclusive seconds, self seconds]
+_timings = {}
+# Time spent in nested imports, one slot per import being timed.
+_nested = []
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    _nested.append(0.0)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - started
+        nested = _nested.pop()
+        if _nested:
+            _nested[-1] += elapsed
+        totals = _timings.setdefault(name, [0.0, 0.0])
+        totals[0] += elapsed
+        totals[1] += elapsed - nested
+
+
+def install_from_env():
+    """install() when KM_PLOT_PROFILE_IMPORTS is set; returns whether it was."""
+    if os.environ.get("KM_PLOT_PROFILE_IMPORTS", "").lower() in {"1", "true", "yes"}:
+        install()
+        return True
+    return False
+
+
+def install():
+    if builtins.__import__ is _timed_import:
+        return
+    builtins.__import__ = _timed_import
+    atexit.register(report)
+
+
+def mark(label):
+    """Note a startup milestone, e.g. the window becoming visible, while profiling."""
+    if builtins.__import__ is not _timed_import:
+        return
+    print(f"[KMPlot] {label}: {time.perf_counter() - _started:.3f}s after start", file=sys.stderr, flush=True)
+
+
+def report():
+    ranked = sorted(_timings.items(), key=lambda item: item[1][1], reverse=True)
+    total = sum(own for _inclusive, own in _timings.values())
+    lines = [f"[KMPlot] Import time: {total:.3f}s in {len(_timings)} modules"]
+    for name, (inclusive, own) in ranked[:REPORT_LIMIT]:
+        lines.append(f"[KMPlot]   {own * 1000:8.1f} ms self {inclusive * 1000:8.1f} ms total  {name}")
+    print("\n".join(lines), file=sys.stderr, flush=True)
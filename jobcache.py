@@ -0,0 +1,164 @@
+"""On-disk cache of generated HPGL, keyed by the document and the plot options.
+
+PlotEngine.iter_hpgl() looks a job up here before generating it: a hit is
+replayed from ``<key>.hpgl`` without touching the geometry, and a miss is
+written alongside the send and kept once it completes. The key covers a digest
+of the serialized SVG, every option in plot.PLOTTER_DEFAULTS except the
+serial-only ones, the device's VID:PID (plotters.py decides its output
+encodings) and the code that generates the HPGL, so upgrading km-plot never
+replays stale output. Entries live in KM_PLOT_CACHE (else the user cache
+directory); the least recently used go once the cache holds more than
+KM_PLOT_CACHE_MB megabytes (0 turns it off).
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from spool import cache_home, write_atomic
+
+# Default size cap in megabytes.
+CACHE_MAX_MB = 256
+# Bytes read from a cached job at a time while it is replayed.
+READ_BLOCK = 64 * 1024
+# Modules whose source decides the generated HPGL.
+CODE_MODULES = ("encoder.py", "hpgl.py", "nesting.py", "pathopt.py", "plot.py", "plotters.py")
+
+_code_digest = None
+
+
+def default_cache_dir():
+    configured = os.environ.get("KM_PLOT_CACHE")
+    return Path(configured) if configured else cache_home() / "hpgl"
+
+
+def max_cache_bytes():
+    try:
+        megabytes = float(os.environ.get("KM_PLOT_CACHE_MB", CACHE_MAX_MB))
+    except ValueError:
+        megabytes = CACHE_MAX_MB
+    return int(megabytes * 1024 * 1024)
+
+
+def code_digest():
+    global _code_digest
+    if _code_digest is None:
+        digest = hashlib.sha256()
+        base = Path(__file__).resolve().parent
+        for name in CODE_MODULES:
+            try:
+                digest.update((base / name).read_bytes())
+            except OSError:
+                digest.update(name.encode("utf8"))
+        _code_digest = digest.hexdigest()
+    return _code_digest
+
+
+def cache_key(document, options, vidpid=None):
+    """Hex digest naming the HPGL for a document (given by its digest), these options and this device."""
+    header = {"code": code_digest(), "document": document, "options": options, "vidpid": (vidpid or "").lower()}
+    return hashlib.sha256(json.dumps(header, sort_keys=True, default=str).encode("utf8")).hexdigest()
+
+
+class HpglCache:
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = Path(directory) if directory else default_cache_dir()
+        self.max_bytes = max_cache_bytes() if max_bytes is None else max_bytes
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def paths(self, key):
+        return self.directory / f"{key}.hpgl", self.directory / f"{key}.json"
+
+    def lookup(self, key):
+        """The stored metadata for ``key`` (marking it recently used), or None."""
+        hpgl_path, meta_path = self.paths(key)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf8"))
+            if hpgl_path.stat().st_size != meta.get("bytes"):
+                return None
+            os.utime(hpgl_path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def iter_text(self, key):
+        """Yield a cached job in blocks; latin-1 keeps offsets equal to bytes, as in the spool."""
+        with open(self.paths(key)[0], "rb") as handle:
+            for block in iter(lambda: handle.read(READ_BLOCK), b""):
+                yield block.decode("latin-1")
+
+    def store(self, key, pieces, meta=None, debug=None):
+        """Yield ``pieces`` unchanged while copying them into the cache.
+
+        The entry is only kept when the stream is consumed to the end, with
+        ``meta()`` (a dict) saved beside it; a cache that cannot be written never
+        stops the pieces.
+        """
+        hpgl_path, meta_path = self.paths(key)
+        tmp = hpgl_path.with_name(f"{hpgl_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        handle = None
+        size = 0
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            handle = open(tmp, "wb")
+        except OSError as exc:
+            if debug:
+                debug(f"HPGL cache not writable: {exc}")
+        complete = False
+        try:
+            for piece in pieces:
+                if handle is not None:
+                    try:
+                        data = piece.encode("latin-1")
+                        handle.write(data)
+                        size += len(data)
+                    except (OSError, UnicodeEncodeError) as exc:
+                        if debug:
+                            debug(f"Not caching this job: {exc}")
+                        handle.close()
+                        handle = None
+                yield piece
+            complete = True
+        finally:
+            if handle is not None:
+                handle.close()
+                if complete:
+                    try:
+                        os.replace(tmp, hpgl_path)
+                        info = dict(meta() if meta else {}, bytes=size, created=time.time())
+                        write_atomic(meta_path, json.dumps(info, indent=1, default=str).encode("utf8"))
+                    except OSError as exc:
+                        if debug:
+                            debug(f"Could not keep the job in the HPGL cache: {exc}")
+                    else:
+                        self.evict()
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for path in self.directory.glob("*.hpgl"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for stale in (path, path.with_suffix(".json")):
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass
+            total -= size
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
-import glob
 import os
-import platform
-import subprocess
 import sys
+
+import importprofile
+
+# Per-module import timing on stderr (KM_PLOT_PROFILE_IMPORTS=1); installed before anything heavy loads.
+importprofile.install_from_env()
+
 from pathlib import Path
-import ctypes
 
 # Make bundled deps (e.g., pyserial) importable before loading inkex.
 BASE_DIR = Path(__file__).resolve().parent
@@ -19,6 +21,8 @@ DEBUG = os.environ.get("KM_PLOT_DEBUG", "").lower() in {"1", "true", "yes"}
 # Hide the transient console window that appears on Windows.
 if os.name == "nt":  # pragma: win32-only
     try:
+        import ctypes
+
         hwnd = ctypes.windll.kernel32.GetConsoleWindow()
         if hwnd:
             ctypes.windll.user32.ShowWindow(hwnd, 0)  # SW_HIDE
@@ -26,18 +30,24 @@ if os.name == "nt":  # pragma: win32-only
         pass
 
 import inkex
-from gui import KMPlotGUI, Gtk, GLib
+from gui import KMPlotGUI, Gtk
 from plot import PlotEngine
-from plotters import plotters
 
-try:
-    import serial.tools.list_ports  # type: ignore
-except Exception as exc:  # pragma: no cover
-    serial_ports = None
-    serial_import_error = repr(exc)
-else:
-    serial_ports = serial.tools.list_ports
-    serial_import_error = None
+# pyserial's port enumeration, imported by load_serial_ports() off the GUI thread.
+serial_ports = None
+serial_import_error = None
+
+
+def load_serial_ports():
+    global serial_ports, serial_import_error
+    if serial_ports is None and serial_import_error is None:
+        try:
+            import serial.tools.list_ports  # type: ignore
+        except Exception as exc:  # pragma: no cover
+            serial_import_error = repr(exc)
+        else:
+            serial_ports = serial.tools.list_ports
+    return serial_ports
 
 
 class KMPlot(KMPlotGUI, inkex.EffectExtension):
@@ -48,50 +58,55 @@ class KMPlot(KMPlotGUI, inkex.EffectExtension):
         self.device_label = None
         self.port_info_label = None
         self.port_combo = None
+        self.all_ports_check = None
         self.port_store = None
         self.cut_button = None
+        self.recut_button = None
+        self.estimate_button = None
+        self.cancel_button = None
+        self.progress_bar = None
         self.status_bar = None
         self.current_device = None
         self.current_vidpid = None
         self.poll_id = None
+        self.hotplug = None
+        self.hotplug_watch_id = None
+        self.hotplug_settle_id = None
         self.port_entries = []
+        self.known_ports = {}
+        self.ports_rendered = False
+        self.port_cache = None
+        self.link_cache = None
+        self.cached_ports = {}
+        self.linked_ports = {}
+        self.links_shown = False
         self.sending = False
+        self.estimating = False
+        self.send_thread = None
+        self.cancel_event = None
+        self.pause_event = None
+        self.prepare_timer = None
+        self.prepare_job = None
+        self.last_progress_post = 0.0
+        self.port_progress = {}
         self.device_image = None
+        self.shown_icon = None
         self.icons_dir = BASE_DIR / "icons"
         self.plot_engine = PlotEngine(self)
 
     def effect(self):
         self.debug("KM Plot extension starting; setting up window.")
         self.build_window()
-        interval = 2
-        self.debug(f"Using poll interval: {interval} seconds")
+        importprofile.mark("Window built")
+        self.schedule_prepare()
         self.update_status_bar("Searching for devices...")
-        self.poll_id = GLib.timeout_add_seconds(interval, self.poll_devices)
-        self.poll_devices()
+        self.start_initial_scan()
         Gtk.main()
 
-    def find_matching_device(self):
-        devices = list(self.enumerate_with_serial())
-        if not devices:
-            self.debug("pyserial enumeration returned no devices.")
-        for entry in devices:
-            vidpid = entry["vidpid"]
-            if vidpid in plotters:
-                return entry["device"], vidpid, plotters[vidpid]
-        return None
-
     def enumerate_with_serial(self):
-        if not serial_ports:
-            reason = (
-                f" import error: {serial_import_error}"
-                if serial_import_error
-                else ""
-            )
-            self.debug(
-                f"pyserial not available; skipping VID/PID enumeration.{reason}"
-            )
+        """Every USB serial port as an entry, listed afresh (links too when plain nodes show none)."""
+        if not self.serial_available():
             return []
-        devices = []
         try:
             ports = list(serial_ports.comports())
         except Exception as exc:
@@ -111,52 +126,131 @@ class KMPlot(KMPlotGUI, inkex.EffectExtension):
         if not ports:
             self.debug("serial.tools.list_ports still returned no ports.")
             return []
+        return [entry for entry in map(self.port_entry, ports) if entry]
 
-        for port in ports:
-            device = (
-                getattr(port, "device", None)
-                or getattr(port, "name", None)
-                or getattr(port, "path", None)
-                or getattr(port, "port", None)
-                or (port if isinstance(port, str) else None)
-            )
-            vid = getattr(port, "vid", None) or getattr(port, "vendor_id", None)
-            pid = getattr(port, "pid", None) or getattr(port, "product_id", None)
-            vidpid = getattr(port, "vidpid", None)
-            manufacturer = getattr(port, "manufacturer", None)
-            product = getattr(port, "product", None)
-
-            if vidpid:
-                vidpid = str(vidpid).lower()
-            elif vid is not None and pid is not None:
-                try:
-                    vidpid = f"{int(vid):04x}:{int(pid):04x}".lower()
-                except Exception:
-                    vidpid = f"{str(vid).lower()}:{str(pid).lower()}"
-
-            self.debug(
-                f"Serial port candidate: device={device}, vid={vid}, pid={pid}, vidpid={vidpid}"
-            )
-            if device and vid is not None and pid is not None and vidpid:
-                info_lines = []
-                if manufacturer:
-                    info_lines.append(str(manufacturer))
-                if product:
-                    info_lines.append(str(product))
-                devices.append(
-                    {
-                        "device": device,
-                        "vidpid": vidpid,
-                        "info": "\n".join(info_lines),
-                    }
-                )
-        return devices
+    def serial_available(self):
+        if load_serial_ports():
+            return True
+        reason = (
+            f" import error: {serial_import_error}"
+            if serial_import_error
+            else ""
+        )
+        self.debug(
+            f"pyserial not available; skipping VID/PID enumeration.{reason}"
+        )
+        return False
+
+    def port_entry(self, port):
+        """{"device", "vidpid", "info"} for a pyserial port, or None when it has no USB VID/PID."""
+        device = (
+            getattr(port, "device", None)
+            or getattr(port, "name", None)
+            or getattr(port, "path", None)
+            or getattr(port, "port", None)
+            or (port if isinstance(port, str) else None)
+        )
+        vid = getattr(port, "vid", None) or getattr(port, "vendor_id", None)
+        pid = getattr(port, "pid", None) or getattr(port, "product_id", None)
+        vidpid = getattr(port, "vidpid", None)
+        manufacturer = getattr(port, "manufacturer", None)
+        product = getattr(port, "product", None)
+
+        if vidpid:
+            vidpid = str(vidpid).lower()
+        elif vid is not None and pid is not None:
+            try:
+                vidpid = f"{int(vid):04x}:{int(pid):04x}".lower()
+            except Exception:
+                vidpid = f"{str(vid).lower()}:{str(pid).lower()}"
+
+        self.debug(
+            f"Serial port candidate: device={device}, vid={vid}, pid={pid}, vidpid={vidpid}"
+        )
+        if not (device and vid is not None and pid is not None and vidpid):
+            return None
+        info_lines = []
+        if manufacturer:
+            info_lines.append(str(manufacturer))
+        if product:
+            info_lines.append(str(product))
+        return {
+            "device": device,
+            "vidpid": vidpid,
+            "info": "\n".join(info_lines),
+        }
+
+    def scan_ports(self):
+        """Ports added and removed since the previous scan, keyed by device path.
+
+        On Linux the diff comes straight from ComportsCache.refresh(), which only
+        reads sysfs for nodes that are new or changed; elsewhere every scan is a
+        full enumeration compared with the last one. As in enumerate_with_serial(),
+        /dev symlinks are only listed while no plain USB serial port is present,
+        from a second cache so that case is incremental too.
+        """
+        if self.port_cache is None and sys.platform.startswith("linux") and self.serial_available():
+            try:
+                from serial.tools.list_ports_linux import ComportsCache
+            except Exception as exc:  # pragma: no cover
+                self.debug(f"Port cache unavailable: {exc!r}")
+                self.port_cache = False
+            else:
+                self.port_cache = ComportsCache()
+                self.link_cache = ComportsCache(include_links=True)
+        if not self.port_cache:
+            return self.diff_ports({entry["device"]: entry for entry in self.enumerate_with_serial()})
+        try:
+            changes = self.apply_cache_diff(self.cached_ports, self.port_cache)
+            if self.cached_ports:
+                if self.links_shown:
+                    # Links were shown until now; compare against them once.
+                    self.links_shown = False
+                    return self.diff_ports(dict(self.cached_ports))
+                self.known_ports = dict(self.cached_ports)
+                return changes
+            self.apply_cache_diff(self.linked_ports, self.link_cache)
+            self.links_shown = True
+        except Exception as exc:
+            self.debug(f"Port cache refresh failed: {exc!r}")
+            return {"added": [], "removed": [], "unchanged": list(self.known_ports.values())}
+        return self.diff_ports(dict(self.linked_ports))
+
+    def apply_cache_diff(self, ports, cache):
+        """Refresh ``cache`` and apply its diff to ``ports`` (device -> entry); returns the changes."""
+        added, removed, _unchanged = cache.refresh()
+        changes = {"added": [], "removed": [], "unchanged": []}
+        for port in removed:
+            entry = ports.pop(port.device, None)
+            if entry:
+                changes["removed"].append(entry)
+        for entry in filter(None, map(self.port_entry, added)):
+            ports[entry["device"]] = entry
+            changes["added"].append(entry)
+        added_devices = {entry["device"] for entry in changes["added"]}
+        changes["unchanged"] = [entry for device, entry in ports.items() if device not in added_devices]
+        return changes
+
+    def diff_ports(self, current):
+        """Compare a full enumeration (device -> entry) with the previous scan."""
+        changes = {"added": [], "removed": [], "unchanged": []}
+        for device, entry in current.items():
+            if self.known_ports.get(device) == entry:
+                changes["unchanged"].append(entry)
+            else:
+                changes["added"].append(entry)
+        for device, entry in self.known_ports.items():
+            if current.get(device) != entry:
+                changes["removed"].append(entry)
+        self.known_ports = current
+        return changes
 
-    def perform_cut(self, device_path):
-        return self.plot_engine.perform_cut(device_path)
+    def perform_cut(self, device_path, progress=None, cancel=None, pause=None):
+        return self.plot_engine.perform_cut(device_path, progress=progress, cancel=cancel, pause=pause)
 
     def update_option(self, key, value):
         setattr(self.options, key, value)
+        self.option_changed(key)
 
     def update_option_from_combo(self, key, combo, default):
         model = combo.get_model()
@@ -166,6 +260,7 @@ class KMPlot(KMPlotGUI, inkex.EffectExtension):
         else:
             value = default
         setattr(self.options, key, value)
+        self.option_changed(key)
 
     def debug(self, message):
         text = f"[KMPlot] {message}"
@@ -0,0 +1,230 @@
+"""Pack copies of one design onto the roll: identical copies on a lattice, as little roll as possible.
+
+Lengths are in device units. The media width runs along the plotter's Y axis
+and the roll along X. Copies repeat across the width every ``step``; each
+following row is shifted sideways by whatever lets it sit closest to the row
+before, so with the convex hull as the outline the copies interlock, and with
+the bounding box they simply stack. Every copy is the same points moved into
+place (all turned 90° when that uses less roll), so the design is encoded once.
+"""
+import math
+
+import numpy as np
+
+# Outlines the packing can use.
+SHAPES = ("box", "hull")
+# Sideways shifts tried between one row and the next.
+ROW_SHIFTS = 48
+# Rows apart (1..N) whose copies are checked for overlap; further rows never reach.
+ROW_CHECKS = 3
+# Slack when testing whether a lattice point is inside the no-go region.
+EPSILON = 1e-6
+
+
+class Layout:
+    """Where each copy goes: ``offsets`` in cutting order, added to the design's points as base() gives them."""
+
+    def __init__(self, rotated, offsets, length, rows, shape):
+        self.rotated = rotated
+        self.offsets = offsets
+        self.length = length
+        self.rows = rows
+        self.shape = shape
+
+    def base(self, points):
+        """``points`` (an (N, 2) integer array of the design) turned as laid out; a copy is this plus its offset."""
+        origin = points.min(axis=0)
+        if self.rotated:
+            points = np.column_stack((-points[:, 1], points[:, 0]))
+        return points - points.min(axis=0) + origin
+
+
+def convex_hull(points):
+    """Counter-clockwise hull vertices of an (N, 2) array (monotone chain)."""
+    unique = sorted(set(map(tuple, np.asarray(points).tolist())))
+    if len(unique) < 3:
+        return unique
+
+    def half(ordered):
+        chain = []
+        for point in ordered:
+            while len(chain) >= 2:
+                (ax, ay), (bx, by) = chain[-2], chain[-1]
+                if (bx - ax) * (point[1] - ay) - (by - ay) * (point[0] - ax) > 0:
+                    break
+                chain.pop()
+            chain.append(point)
+        return chain[:-1]
+
+    return half(unique) + half(reversed(unique))
+
+
+def outline(points, shape):
+    """Convex outline of the design: its bounding box or its convex hull."""
+    if shape == "box":
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+        return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    return convex_hull(points)
+
+
+def difference_body(polygon):
+    """Vertices of P ⊕ -P: a copy moved by t overlaps the original iff t is inside it.
+
+    Both polygons are convex and counter-clockwise, so the sum's edges are
+    theirs merged by angle.
+    """
+    vertices = np.asarray(polygon, dtype=float)
+    if len(vertices) < 3:
+        # A point or a segment: give it a sliver of width so the geometry stays a polygon.
+        low, high = vertices.min(axis=0), vertices.max(axis=0) + 1.0
+        vertices = np.array([low, (high[0], low[1]), high, (low[0], high[1])])
+    edges = np.roll(vertices, -1, axis=0) - vertices
+    edges = np.concatenate((edges, -edges))
+    edges = edges[np.hypot(edges[:, 0], edges[:, 1]) > 0]
+    angles = np.mod(np.arctan2(edges[:, 1], edges[:, 0]), 2 * math.pi)
+    edges = edges[np.argsort(angles, kind="stable")]
+    low = vertices[np.lexsort((vertices[:, 0], vertices[:, 1]))[0]]
+    high = vertices[np.lexsort((-vertices[:, 0], -vertices[:, 1]))[0]]
+    # The sum's lowest (then leftmost) vertex, where the edge with angle 0 starts.
+    start = low - high
+    return start + np.concatenate(([[0.0, 0.0]], np.cumsum(edges, axis=0)[:-1]))
+
+
+class Region:
+    """Translations that would bring two copies closer than ``spacing``: the difference body, grown."""
+
+    def __init__(self, polygon, spacing):
+        body = difference_body(polygon)
+        edges = np.roll(body, -1, axis=0) - body
+        lengths = np.hypot(edges[:, 0], edges[:, 1])
+        keep = lengths > 0
+        self.normals = np.column_stack((edges[keep, 1], -edges[keep, 0])) / lengths[keep, None]
+        self.limits = np.einsum("ij,ij->i", self.normals, body[keep]) + spacing
+        self.reach_y = float(np.abs(body[:, 1]).max()) + spacing
+
+    def across(self):
+        """Smallest step along +Y that clears the region."""
+        ny = self.normals[:, 1]
+        up = ny > EPSILON
+        return float((self.limits[up] / ny[up]).min())
+
+    def clearance(self, y):
+        """Smallest x >= 0 with (x, y) outside the region, or 0 when the line y misses it."""
+        nx, ny = self.normals[:, 0], self.normals[:, 1]
+        rest = self.limits - ny * y
+        flat = np.abs(nx) <= EPSILON
+        if np.any(rest[flat] < -EPSILON):
+            return 0.0
+        ahead = nx > EPSILON
+        behind = nx < -EPSILON
+        high = (rest[ahead] / nx[ahead]).min() if ahead.any() else math.inf
+        low = (rest[behind] / nx[behind]).max() if behind.any() else -math.inf
+        if low > high + EPSILON:
+            return 0.0
+        return max(high, 0.0)
+
+
+def row_advance(region, step, shift):
+    """How far along the roll each row must go when it is shifted ``shift`` across from the last."""
+    advance = 0.0
+    for rows in range(1, ROW_CHECKS + 1):
+        across = rows * shift
+        first = math.floor((-region.reach_y - across) / step)
+        last = math.ceil((region.reach_y - across) / step)
+        for k in range(first, last + 1):
+            advance = max(advance, region.clearance(across + k * step) / rows)
+    return advance
+
+
+def lattice(polygon, spacing, width, copies, shape):
+    """The best Layout (unrotated) for one outline, or None if a copy does not fit across."""
+    vertices = np.asarray(polygon, dtype=float)
+    size = vertices.max(axis=0) - vertices.min(axis=0)
+    if size[1] > width:
+        return None
+    region = Region(polygon, spacing)
+    step = max(int(math.ceil(region.across() - EPSILON)), 1)
+    shifts = [0] if shape == "box" else range(0, step, max(1, step // ROW_SHIFTS))
+    best = None
+    for shift in shifts:
+        advance = max(int(math.ceil(row_advance(region, step, shift) - EPSILON)), 1)
+        offsets = []
+        row = 0
+        while len(offsets) < copies:
+            first = (row * shift) % step
+            # Row 0 always fits a copy, and rows come back to its shift, so this ends.
+            count = int((width - size[1] - first) // step) + 1 if first + size[1] <= width else 0
+            across = [first + k * step for k in range(min(count, copies - len(offsets)))]
+            if row % 2:
+                across.reverse()
+            offsets += [(row * advance, y) for y in across]
+            row += 1
+        if len(offsets) < copies:
+            continue
+        length = (row - 1) * advance + size[0]
+        if best is None or length < best.length:
+            best = Layout(False, offsets, length, row, shape)
+    return best
+
+
+def layout(points, copies, width, spacing=0.0, shape="hull", rotate=False):
+    """Pack ``copies`` of the design (an (N, 2) integer array) across ``width``; the Layout using least roll.
+
+    Raises ValueError when the design is wider than the media however it is turned.
+    """
+    points = np.asarray(points, dtype=np.int64)
+    candidates = [points]
+    if rotate:
+        candidates.append(np.column_stack((-points[:, 1], points[:, 0])))
+    best = None
+    for rotated, candidate in enumerate(candidates):
+        candidate = candidate - candidate.min(axis=0)
+        result = lattice(outline(candidate, shape), spacing, width, copies, shape)
+        if result is not None and (best is None or result.length < best.length):
+            result.rotated = bool(rotated)
+            best = result
+    if best is None:
+        raise ValueError("The design is wider than the media")
+    return best
+
+
+def iter_nested(blocks, layout, first_path=None):
+    """HPGL for every copy from hpgl.split_runs() blocks of one copy, a piece per run and copy.
+
+    Commands (pen, speed, force) stay where they are and are sent once; each run
+    of subpaths between them is cut on every copy in turn, in the layout's order,
+    before the next command. ``first_path`` (points) is cut once, ahead of the first run.
+    """
+    runs = [np.asarray([point for path in block for point in path], dtype=np.int64)
+            for block in blocks if not isinstance(block, str)]
+    if not runs:
+        return
+    # One copy's worth of points; each copy's run is translated as it is written.
+    base = layout.base(np.concatenate(runs))
+    start = 0
+    for block in blocks:
+        if isinstance(block, str):
+            yield ";" + block
+            continue
+        if first_path:
+            yield format_paths(np.asarray(first_path, dtype=np.int64), [len(first_path)])
+            first_path = None
+        lengths = [len(path) for path in block]
+        end = start + sum(lengths)
+        run = base[start:end]
+        for offset in layout.offsets:
+            yield format_paths(run + offset, lengths)
+        start = end
+
+
+def format_paths(points, lengths):
+    """";PU..;PD.." for consecutive subpaths of ``lengths`` points in an integer array."""
+    coords = list(map(str, points.ravel().tolist()))
+    parts = []
+    begin = 0
+    for count in lengths:
+        parts.append(f";PU{coords[2 * begin]},{coords[2 * begin + 1]}")
+        if count > 1:
+            parts.append(";PD" + ",".join(coords[2 * begin + 2:2 * (begin + count)]))
+        begin += count
+    return "".join(parts)
@@ -0,0 +1,333 @@
+"""Pen-up travel minimisation for lists of subpaths (nearest neighbour + 2-opt)."""
+import math
+import time
+
+# Segment length (in tour positions) considered by each 2-opt move.
+TWO_OPT_WINDOW = 24
+# Wall-clock budget for 2-opt improvement passes, in seconds.
+TWO_OPT_SECONDS = 2.0
+# Closed paths whose bounding box covers more grid cells than this skip the grid.
+LARGE_BOX_CELLS = 256
+
+
+def is_closed(points):
+    return len(points) > 2 and points[0] == points[-1]
+
+
+def travel_distance(paths, start=(0, 0)):
+    """Total pen-up distance when cutting ``paths`` in order from ``start``."""
+    total = 0.0
+    x, y = start
+    for points in paths:
+        sx, sy = points[0]
+        total += math.hypot(sx - x, sy - y)
+        x, y = points[-1]
+    return total
+
+
+def rotate_closed(points, x, y):
+    """Restart a closed path at the vertex nearest to (x, y)."""
+    best = 0
+    best_dist = None
+    for idx, (px, py) in enumerate(points[:-1]):
+        dist = (px - x) ** 2 + (py - y) ** 2
+        if best_dist is None or dist < best_dist:
+            best = idx
+            best_dist = dist
+    if best == 0:
+        return points
+    body = points[:-1]
+    body = body[best:] + body[:best]
+    return body + [body[0]]
+
+
+def bounding_box(points):
+    xs = [x for x, _y in points]
+    ys = [y for _x, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_polygon(x, y, points):
+    inside = False
+    px, py = points[-1]
+    for qx, qy in points:
+        if (qy > y) != (py > y) and x < (px - qx) * (y - qy) / (py - qy) + qx:
+            inside = not inside
+        px, py = qx, qy
+    return inside
+
+
+def containment_prerequisites(paths):
+    """Map each closed path to the paths lying directly inside it.
+
+    The result is a ``prerequisites`` mapping for order_paths(): everything inside
+    a contour is cut before the contour itself. Candidate parents come from a grid
+    of closed-path bounding boxes (outlines spanning many cells are checked for
+    every path instead) and are tried smallest first, so only a few
+    point-in-polygon tests run per path.
+    """
+    boxes = [bounding_box(points) for points in paths]
+    closed = [idx for idx, points in enumerate(paths) if is_closed(points)]
+    if not closed:
+        return {}
+    spans = sorted(max(boxes[idx][2] - boxes[idx][0], boxes[idx][3] - boxes[idx][1]) for idx in closed)
+    size = max(spans[len(spans) // 2], 1)
+    areas = [(box[2] - box[0]) * (box[3] - box[1]) for box in boxes]
+    grid = {}
+    large = []
+    for idx in closed:
+        x0, y0, x1, y1 = boxes[idx]
+        cols = range(int(x0 // size), int(x1 // size) + 1)
+        rows = range(int(y0 // size), int(y1 // size) + 1)
+        if len(cols) * len(rows) > LARGE_BOX_CELLS:
+            large.append(idx)
+            continue
+        for cx in cols:
+            for cy in rows:
+                grid.setdefault((cx, cy), []).append(idx)
+
+    prerequisites = {}
+    for idx, points in enumerate(paths):
+        x, y = points[0]
+        x0, y0, x1, y1 = boxes[idx]
+        candidates = [
+            other for other in large + grid.get((int(x // size), int(y // size)), [])
+            if other != idx and areas[other] > areas[idx]
+            and boxes[other][0] <= x0 and boxes[other][1] <= y0
+            and boxes[other][2] >= x1 and boxes[other][3] >= y1
+        ]
+        candidates.sort(key=lambda other: areas[other])
+        for other in candidates:
+            if point_in_polygon(x, y, paths[other]):
+                prerequisites.setdefault(other, set()).add(idx)
+                break
+    return prerequisites
+
+
+def stable_order(paths, prerequisites):
+    """Keep document order, but cut each path's prerequisites before it."""
+    done = [False] * len(paths)
+    ordered = []
+    for root in range(len(paths)):
+        stack = [root]
+        while stack:
+            idx = stack[-1]
+            if done[idx]:
+                stack.pop()
+                continue
+            pending = [other for other in sorted(prerequisites.get(idx, ())) if not done[other]]
+            if pending:
+                stack.extend(reversed(pending))
+                continue
+            done[idx] = True
+            ordered.append(paths[idx])
+            stack.pop()
+    return ordered
+
+
+class _Grid:
+    """Uniform grid of candidate entry points, rebuilt coarser as it empties."""
+
+    def __init__(self, entries):
+        self.build(entries)
+
+    def build(self, entries):
+        self.cells = {}
+        self.live = 0
+        xs = [e[0] for e in entries]
+        ys = [e[1] for e in entries]
+        if xs:
+            self.min_x = min(xs)
+            self.min_y = min(ys)
+            span = max(max(xs) - self.min_x, max(ys) - self.min_y, 1)
+        else:
+            self.min_x = self.min_y = 0
+            span = 1
+        per_side = max(1, int(math.sqrt(max(len(entries), 1) / 2)))
+        self.size = max(span / per_side, 1.0)
+        self.bounds = None
+        self.built = max(len(entries), 1)
+        for entry in entries:
+            self.add(entry)
+
+    def cell(self, x, y):
+        return int((x - self.min_x) // self.size), int((y - self.min_y) // self.size)
+
+    def add(self, entry):
+        key = self.cell(entry[0], entry[1])
+        self.cells.setdefault(key, []).append(entry)
+        self.live += 1
+        if self.bounds is None:
+            self.bounds = [key[0], key[0], key[1], key[1]]
+        else:
+            bounds = self.bounds
+            bounds[0] = min(bounds[0], key[0])
+            bounds[1] = max(bounds[1], key[0])
+            bounds[2] = min(bounds[2], key[1])
+            bounds[3] = max(bounds[3], key[1])
+
+    def ring(self, cx, cy, radius):
+        """Cells at Chebyshev distance ``radius`` from (cx, cy), clipped to the occupied bounds."""
+        if radius == 0:
+            return [(cx, cy)]
+        lo_x, hi_x, lo_y, hi_y = self.bounds
+        xs = range(max(cx - radius, lo_x), min(cx + radius, hi_x) + 1)
+        ys = range(max(cy - radius + 1, lo_y), min(cy + radius - 1, hi_y) + 1)
+        cells = []
+        for row in (cy - radius, cy + radius):
+            if lo_y <= row <= hi_y:
+                cells += [(col, row) for col in xs]
+        for col in (cx - radius, cx + radius):
+            if lo_x <= col <= hi_x:
+                cells += [(col, row) for row in ys]
+        return cells
+
+    def entries(self, visited):
+        return [e for bucket in self.cells.values() for e in bucket if not visited[e[2]]]
+
+    def nearest(self, x, y, visited):
+        """Return the closest unvisited entry to (x, y), or None."""
+        if self.live * 4 < self.built and self.built > 64:
+            self.build(self.entries(visited))
+        if self.bounds is None:
+            return None
+        cx, cy = self.cell(x, y)
+        lo_x, hi_x, lo_y, hi_y = self.bounds
+        reach = max(cx - lo_x, hi_x - cx, cy - lo_y, hi_y - cy)
+        best = None
+        best_dist = math.inf
+        # Rings closer than the occupied bounds are empty; start at the first that reaches them.
+        radius = max(0, lo_x - cx, cx - hi_x, lo_y - cy, cy - hi_y)
+        while radius <= reach:
+            if best is not None and best_dist <= ((radius - 1) * self.size) ** 2:
+                break
+            for key in self.ring(cx, cy, radius):
+                bucket = self.cells.get(key)
+                if not bucket:
+                    continue
+                alive = [e for e in bucket if not visited[e[2]]]
+                self.live -= len(bucket) - len(alive)
+                if not alive:
+                    del self.cells[key]
+                    continue
+                self.cells[key] = alive
+                for entry in alive:
+                    dist = (entry[0] - x) ** 2 + (entry[1] - y) ** 2
+                    if dist < best_dist:
+                        best = entry
+                        best_dist = dist
+            radius += 1
+        return best
+
+
+def _nearest_neighbour(paths, start, allow_reverse, prerequisites):
+    count = len(paths)
+    visited = [False] * count
+    waiting = [0] * count
+    dependents = [[] for _ in range(count)]
+    for idx, before in (prerequisites or {}).items():
+        for other in before:
+            waiting[idx] += 1
+            dependents[other].append(idx)
+
+    def entries_for(idx):
+        points = paths[idx]
+        first = points[0]
+        items = [(first[0], first[1], idx, False)]
+        if allow_reverse and not is_closed(points):
+            last = points[-1]
+            items.append((last[0], last[1], idx, True))
+        return items
+
+    grid = _Grid([e for idx in range(count) if not waiting[idx] for e in entries_for(idx)])
+    order = []
+    x, y = start
+    while len(order) < count:
+        entry = grid.nearest(x, y, visited)
+        if entry is None:
+            # Only reachable with cyclic prerequisites; release everything left.
+            grid.build([e for idx in range(count) if not visited[idx] for e in entries_for(idx)])
+            for idx in range(count):
+                waiting[idx] = 0
+            continue
+        idx, flipped = entry[2], entry[3]
+        visited[idx] = True
+        points = paths[idx]
+        if flipped:
+            points = points[::-1]
+        elif allow_reverse and is_closed(points):
+            points = rotate_closed(points, x, y)
+        order.append((idx, points))
+        x, y = points[-1]
+        for other in dependents[idx]:
+            waiting[other] -= 1
+            if waiting[other] == 0 and not visited[other]:
+                for new_entry in entries_for(other):
+                    grid.add(new_entry)
+    return order
+
+
+def _two_opt(order, start, prerequisites, deadline):
+    """Windowed 2-opt: reverse tour segments (and their paths) while it shortens travel."""
+    count = len(order)
+    if count < 3:
+        return order
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(-1, count - 2):
+            if i % 256 == 0 and time.monotonic() >= deadline:
+                break
+            ax, ay = order[i][1][-1] if i >= 0 else start
+            bx, by = order[i + 1][1][0]
+            base = math.hypot(bx - ax, by - ay)
+            for j in range(i + 2, min(count, i + 1 + TWO_OPT_WINDOW)):
+                cx, cy = order[j][1][-1]
+                if j + 1 < count:
+                    dx, dy = order[j + 1][1][0]
+                    old = base + math.hypot(dx - cx, dy - cy)
+                    new = math.hypot(cx - ax, cy - ay) + math.hypot(dx - bx, dy - by)
+                else:
+                    old = base
+                    new = math.hypot(cx - ax, cy - ay)
+                if new + 1e-9 >= old:
+                    continue
+                segment = order[i + 1:j + 1]
+                if prerequisites:
+                    members = {idx for idx, _points in segment}
+                    if any(members.intersection(prerequisites.get(idx, ())) for idx in members):
+                        continue
+                order[i + 1:j + 1] = [(idx, points[::-1]) for idx, points in reversed(segment)]
+                improved = True
+                bx, by = order[i + 1][1][0]
+                base = math.hypot(bx - ax, by - ay)
+    return order
+
+
+def order_paths(paths, start=(0, 0), allow_reverse=True, prerequisites=None,
+                time_budget=TWO_OPT_SECONDS):
+    """Reorder subpaths to minimise pen-up travel.
+
+    ``paths`` is a list of point lists. When ``allow_reverse`` is set open paths
+    may be cut backwards and closed paths may start at any vertex; otherwise only
+    the order changes. ``prerequisites`` maps a path index to the indices that must
+    be cut before it. Returns (ordered point lists, stats) where stats holds the
+    travel distance before and after, in input units.
+    """
+    started = time.monotonic()
+    before = travel_distance(paths, start)
+    order = _nearest_neighbour(paths, start, allow_reverse, prerequisites)
+    if allow_reverse and time_budget > 0:
+        order = _two_opt(order, start, prerequisites, started + time_budget)
+    ordered = [points for _idx, points in order]
+    after = travel_distance(ordered, start)
+    if after > before and not prerequisites:
+        ordered = list(paths)
+        after = before
+    stats = {
+        "paths": len(paths),
+        "travel_before": before,
+        "travel_after": after,
+        "seconds": time.monotonic() - started,
+    }
+    return ordered, stats
@@ -1,65 +1,983 @@
+import contextlib
+import copy
 import errno
+import hashlib
 import os
 import platform
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import hpgl as hpgl_commands
+import pathopt
+from plotters import plotters
+
+# Bytes handed to the serial driver per write; bounds memory and cancel latency.
+SEND_CHUNK_SIZE = 256
+# Stop writing while the driver's output queue holds more than this many bytes.
+TX_HIGH_WATER = 1024
+# Seconds between output queue checks while the end of a job drains.
+DRAIN_POLL = 0.05
+# Seconds without progress (XOFF held, buffer full) after which a send checks the plotter is still connected.
+DRAIN_STALL_SECONDS = 60.0
+# Seconds between port checks while the final flush() (tcdrain) has not returned.
+DRAIN_FLUSH_SECONDS = 10.0
+# HP RS-232 device-control escapes: report free buffer bytes, and extended status.
+ESC_BUFFER_SPACE = b"\x1b.B"
+ESC_STATUS = b"\x1b.O"
+# Bytes of the free space a plotter reports that buffer pacing leaves unused.
+BUFFER_MARGIN = 32
+# Seconds to wait for a reply once a query has left the output queue.
+BUFFER_REPLY_TIMEOUT = 1.0
+# Seconds between queries while the plotter reports a full buffer.
+BUFFER_POLL = 0.05
+# Lifts the tool and resets the plotter when a send is cancelled mid-job.
+CANCEL_TRAILER = b";PU;SP0;IN; "
+# Ends every generated job: tool up at the origin, pen put away, plotter reset.
+JOB_TRAILER = ";PU0,0;SP0;IN; "
+# Serial frame size per option value, for turning byte counts into wire time.
+DATA_BITS = {"5": 5, "five": 5, "6": 6, "six": 6, "7": 7, "seven": 7, "8": 8, "eight": 8}
+STOP_BITS = {"1": 1.0, "one": 1.0, "1.5": 1.5, "onepointfive": 1.5, "2": 2.0, "two": 2.0}
+# Head speed assumed for time estimates when the job leaves VS at the device default.
+DEFAULT_SPEED_CM_S = 10.0
+# Time assumed for lifting and lowering the tool around each pen-up move.
+PEN_LIFT_SECONDS = 0.05
+
+# Option values used when the host (Inkscape, the GUI or the CLI) does not set them.
+PLOTTER_DEFAULTS = {
+    "serialBaudRate": "9600",
+    "serialByteSize": "eight",
+    "serialStopBits": "one",
+    "serialParity": "none",
+    "serialFlowControl": "xonxoff",
+    "resolutionX": 1016.0,
+    "resolutionY": 1016.0,
+    "pen": 1,
+    "force": 0,
+    "speed": 0,
+    "orientation": "0",
+    "mirrorX": False,
+    "mirrorY": False,
+    "center": False,
+    "overcut": 1.0,
+    "precut": True,
+    "flat": 1.2,
+    "adaptiveFlatten": True,
+    "autoAlign": True,
+    "toolOffset": 0.25,
+    "optimizeTravel": True,
+    "innerFirst": True,
+    "copies": 1,
+    "mediaWidth": 0.0,
+    "nestSpacing": 2.0,
+    "nestShape": "hull",
+    "nestRotate": False,
+    "encoder": "native",
+    "compactOutput": "auto",
+    "serialPacing": "auto",
+}
+# Options that only configure the serial link; the HPGL never depends on them.
+SERIAL_OPTIONS = (
+    "serialBaudRate",
+    "serialByteSize",
+    "serialStopBits",
+    "serialParity",
+    "serialFlowControl",
+    "serialPacing",
+)
+
+
+class PlotCancelled(Exception):
+    pass
+
+
+class PlotPaused(Exception):
+    """Sending stopped between chunks; the plotter was left as it was so the job can resume."""
+
+
+class BufferPacer:
+    """Writes only as much as the plotter reports room for (ESC.B), ahead of XON/XOFF.
+
+    Each query is queued behind the data already written, so its answer counts
+    that data as buffered. A plotter that never answers is streamed to with flow
+    control alone from then on; one that keeps answering with a full buffer is
+    busy, not gone, and is waited for.
+    """
+
+    def __init__(self, engine, ser):
+        self.engine = engine
+        self.ser = ser
+        self.credit = 0
+        # Most room the plotter has reported, a floor for its buffer size.
+        self.largest = 0
+        self.active = True
+        self.queries = 0
+        self.waited = 0.0
+
+    def write(self, chunk, cancel=None):
+        # Views are released even on an error, so a traceback does not keep a mapped job file exported.
+        with memoryview(chunk) as view:
+            offset = 0
+            while offset < len(view):
+                if not self.active:
+                    self.engine.wait_for_tx_room(self.ser, cancel)
+                    with view[offset:] as rest:
+                        self.ser.write(rest)
+                    return
+                if self.credit <= 0:
+                    self.wait_for_room(cancel)
+                    continue
+                size = min(self.credit, len(view) - offset)
+                with view[offset:offset + size] as part:
+                    self.ser.write(part)
+                self.credit -= size
+                offset += size
+
+    def wait_for_room(self, cancel=None):
+        started = reported = time.monotonic()
+        try:
+            while True:
+                free = self.query(ESC_BUFFER_SPACE, cancel)
+                if free is None:
+                    self.active = False
+                    self.engine.ext.debug("Plotter did not answer ESC.B; pacing with flow control only")
+                    return
+                self.largest = max(self.largest, free - BUFFER_MARGIN)
+                # Wait for a useful amount of room rather than trickling out a few bytes per query.
+                if free - BUFFER_MARGIN >= max(min(SEND_CHUNK_SIZE, self.largest // 2), 1):
+                    self.credit = free - BUFFER_MARGIN
+                    return
+                if time.monotonic() - reported > DRAIN_STALL_SECONDS:
+                    status = self.query(ESC_STATUS, cancel)
+                    self.engine.ext.debug(
+                        f"Plotter buffer full for {time.monotonic() - started:.0f}s (ESC.O status {status}); still waiting"
+                    )
+                    reported = time.monotonic()
+                time.sleep(BUFFER_POLL)
+        finally:
+            self.waited += time.monotonic() - started
+
+    def query(self, escape, cancel=None):
+        """Send a device-control escape and return the number it answers, or None on no answer."""
+        ser = self.ser
+        ser.reset_input_buffer()
+        ser.write(escape)
+        self.queries += 1
+        reply = b""
+        deadline = time.monotonic() + BUFFER_REPLY_TIMEOUT
+        while not reply.endswith((b"\r", b"\n")):
+            if cancel is not None and cancel.is_set():
+                self.engine.abort_send(ser)
+                raise PlotCancelled("Cancelled while waiting for the plotter's buffer")
+            try:
+                queued = ser.out_waiting
+            except Exception:
+                queued = 0
+            if queued:
+                # The query has not left the port yet; the plotter cannot have seen it.
+                deadline = time.monotonic() + BUFFER_REPLY_TIMEOUT
+            elif time.monotonic() > deadline:
+                return None
+            reply += ser.read(max(ser.in_waiting, 1))
+        match = re.search(rb"\d+", reply)
+        return int(match.group()) if match else None
+
+
+def port_present(device):
+    """False once ``device`` has left the system (unplugged); True while it is there or cannot be told."""
+    if os.path.isabs(device) and os.name != "nt":
+        return os.path.exists(device)
+    try:
+        import serial.tools.list_ports
+
+        return any(port.device == device for port in serial.tools.list_ports.comports())
+    except Exception:
+        return True
+
+
+def list_usb_ports():
+    """(device path, lower-case vid:pid) for every USB serial port pyserial reports."""
+    try:
+        import serial.tools.list_ports
+    except Exception as exc:
+        raise RuntimeError(f"pyserial not available: {exc}") from exc
+    ports = []
+    for port in serial.tools.list_ports.comports():
+        if port.vid is not None and port.pid is not None:
+            ports.append((port.device, f"{port.vid:04x}:{port.pid:04x}"))
+    return ports
+
+
+def usb_port_identities():
+    """{device path: "vid:pid/serial number"} (bus location when there is no serial) for USB serial ports.
+
+    Unlike the path, this follows one particular plotter when it is plugged in again.
+    """
+    try:
+        import serial.tools.list_ports
+    except Exception as exc:
+        raise RuntimeError(f"pyserial not available: {exc}") from exc
+    identities = {}
+    for port in serial.tools.list_ports.comports():
+        identity = getattr(port, "serial_number", None) or getattr(port, "location", None)
+        if port.vid is not None and port.pid is not None and identity:
+            identities[port.device] = f"{port.vid:04x}:{port.pid:04x}/{identity}"
+    return identities
+
+
+class DocumentSnapshot:
+    """A copy of an extension's document and options, for generating on another thread."""
+
+    def __init__(self, ext):
+        self.svg = copy.deepcopy(ext.svg)
+        self.options = SimpleNamespace(**vars(ext.options))
+        self.current_vidpid = getattr(ext, "current_vidpid", None)
+        self.debug = ext.debug
 
 
 class PlotEngine:
 
     def __init__(self, extension):
         self.ext = extension
+        # (svg element, digest of it as first seen): preprocess() later edits it in place.
+        self.digest = None
+        self.last_send = None
+        self.last_optimization = None
+        self.last_compaction = None
+        self.last_nesting = None
+        self.last_estimate = None
+        self.last_job = None
+        self.travel = [0.0, 0.0]
+
+    def perform_cut(self, device_path, progress=None, cancel=None, pause=None, name=None):
+        """Generate the job, spool it, and send the queue unless another process already is.
 
-    def perform_cut(self, device_path):
+        The job is written to the spool while it is sent, so the plotter starts
+        on the first bytes. Returns the spool.Job; its state is "queued" when
+        another km-plot process holds the queue (it will send the job) or when
+        ``pause`` stopped the send.
+        """
         self.ext.debug(f"Generating HPGL and sending to {device_path}")
-        hpgl = self.generate_hpgl()
-        self.send_hpgl_serial(device_path, hpgl)
+        pieces = self.iter_hpgl()
+        if cancel is not None and cancel.is_set():
+            raise PlotCancelled("Cancelled before sending")
+        job = self.create_job([device_path], name)
 
-    def ensure_plotter_defaults(self):
-        defaults = {
-            "serialBaudRate": "9600",
-            "serialByteSize": "eight",
-            "serialStopBits": "one",
-            "serialParity": "none",
-            "serialFlowControl": "xonxoff",
-            "resolutionX": 1016.0,
-            "resolutionY": 1016.0,
-            "pen": 1,
-            "force": 0,
-            "speed": 0,
-            "orientation": "0",
-            "mirrorX": False,
-            "mirrorY": False,
-            "center": False,
-            "overcut": 1.0,
-            "precut": True,
-            "flat": 1.2,
-            "autoAlign": True,
-            "toolOffset": 0.25,
+        def report(_port, sent, total, rate):
+            if progress is not None:
+                progress(sent, total, rate)
+
+        with self.job_writer([job], pieces, cancel):
+            job = self.send_spooled([job], report, cancel, pause)[0]
+        self.last_job = job
+        self.last_send = job.manifest.get("result")
+        return job
+
+    def perform_cut_on(self, device_paths, progress=None, cancel=None, pause=None, name=None):
+        """Cut the document on every port in ``device_paths`` at once, one job each.
+
+        ``progress(port, sent, total, rate)`` is called per port. Returns the
+        spool.Jobs, in the order of ``device_paths``; the caller reports each job's
+        state, since one plotter failing does not stop the others.
+        """
+        self.ext.debug(f"Generating HPGL and sending to {', '.join(device_paths)}")
+        pieces = self.iter_hpgl()
+        if cancel is not None and cancel.is_set():
+            raise PlotCancelled("Cancelled before sending")
+        jobs = [self.create_job([port], name) for port in device_paths]
+        with self.job_writer(jobs, pieces, cancel):
+            return self.send_spooled(jobs, progress, cancel, pause, raise_errors=False)
+
+    def perform_cut_file(self, device_path, path, progress=None, cancel=None, pause=None, name=None):
+        """Send a pre-generated HPGL file as it is; see perform_cut().
+
+        The file is spooled in place and sent from a read-only mmap, so its size
+        does not matter to memory use; ``progress`` reports offsets into it.
+        """
+        self.ext.debug(f"Sending {path} to {device_path}")
+        job = self.create_job([device_path], name or os.path.basename(path), source=path)
+
+        def report(_port, sent, total, rate):
+            if progress is not None:
+                progress(sent, total, rate)
+
+        job = self.send_spooled([job], report, cancel, pause)[0]
+        self.last_job = job
+        self.last_send = job.manifest.get("result")
+        return job
+
+    def perform_recut(self, device_paths, job=None, progress=None, cancel=None, pause=None):
+        """Cut a finished job (default: the last one sent) again on ``device_paths``, one job each.
+
+        Needs neither the document nor any generation: the old job's HPGL is
+        queued as it is, so only a job the current plotter model understands
+        is taken (see spool.Job.portable_to). ``progress(port, sent, total, rate)``
+        is called per port; with one port the first failed or cancelled job
+        raises, as in perform_cut().
+        """
+        import spool
+
+        queue = spool.Spool()
+        vidpid = getattr(self.ext, "current_vidpid", None)
+        job = job or queue.last_done([vidpid])
+        if job is None:
+            raise RuntimeError("No finished job this plotter can cut again")
+        if not job.portable_to(vidpid):
+            raise RuntimeError(
+                f"Job {job.id} was compacted to {job.manifest.get('encoding')} output for another "
+                "plotter model; send the document again instead"
+            )
+        self.ext.debug(f"Cutting job {job.id} again on {', '.join(device_paths)}")
+        jobs = [queue.recut(job, [port]) for port in device_paths]
+        self.last_compaction = None
+        finished = self.send_spooled(jobs, progress, cancel, pause, raise_errors=len(jobs) == 1)
+        self.last_job = finished[-1]
+        self.last_send = self.last_job.manifest.get("result")
+        return finished
+
+    def create_job(self, targets, name=None, source=None):
+        """Queue a spool job for the first free port in ``targets``: empty, or the HPGL file ``source``."""
+        import spool
+
+        if name is None:
+            name = self.ext.svg.get("sodipodi:docname")
+        options = {key: getattr(self.ext.options, key, value) for key, value in PLOTTER_DEFAULTS.items()}
+        device = targets[0] if len(targets) == 1 else None
+        return spool.Spool().create(
+            device,
+            getattr(self.ext, "current_vidpid", None),
+            options=options,
+            name=name,
+            targets=targets,
+            source=source,
+            encoding=None if source else self.output_encoding(),
+        )
+
+    @contextlib.contextmanager
+    def job_writer(self, jobs, pieces, cancel=None):
+        """Write ``pieces`` into ``jobs`` on a worker thread for the duration of the block.
+
+        Leaving the block waits for the writer, so no job is left half written;
+        a generation error is raised there unless the block raised one already.
+        """
+        import spool
+
+        errors = []
+
+        def checked():
+            for piece in pieces:
+                if cancel is not None and cancel.is_set():
+                    raise PlotCancelled("Cancelled while generating")
+                yield piece
+
+        def produce():
+            try:
+                spool.write_jobs(jobs, checked())
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+
+        writer = threading.Thread(target=produce, name="kmplot-generate", daemon=True)
+        writer.start()
+        try:
+            yield writer
+        finally:
+            writer.join()
+        if errors and not isinstance(errors[0], PlotCancelled):
+            raise RuntimeError(f"HPGL generation failed: {errors[0]}") from errors[0]
+
+    def send_spooled(self, jobs, progress=None, cancel=None, pause=None, raise_errors=True):
+        """Send the spool (if this process gets its lock) and return ``jobs`` as they ended.
+
+        ``progress(port, sent, total, rate)`` only reports ``jobs``. With
+        ``raise_errors`` the first failed or cancelled job raises.
+        """
+        import dispatch
+        import spool
+
+        queue = spool.Spool()
+        ids = {job.id for job in jobs}
+
+        def report(port, job, sent, total, rate):
+            if progress is not None and job.id in ids:
+                progress(port, sent, total, rate)
+
+        senders = dispatch.send_queue(queue, self.ext.debug, report, cancel, pause)
+        if senders is None:
+            self.ext.debug("Another km-plot process is sending; job queued")
+        finished = [queue.get(job.id) or job for job in jobs]
+        self.last_send = None
+        for job in finished:
+            if job.state == "queued" and cancel is not None and cancel.is_set():
+                # Never reached its plotter; don't leave it for the next runner.
+                job.update(state="cancelled", error="Cancelled before sending")
+        queue.prune()
+        if not raise_errors or senders is None:
+            return finished
+        for job in finished:
+            if job.state == "cancelled":
+                raise PlotCancelled(job.manifest.get("error") or "Cancelled")
+            if job.state == "done" or (job.state == "queued" and pause is not None and pause.is_set()):
+                continue
+            errors = [str(senders[port].error) for port in job.targets if port in senders and senders[port].error]
+            raise RuntimeError(job.manifest.get("error") or "; ".join(errors) or f"Job {job.id} is {job.state}")
+        return finished
+
+    def dry_run(self):
+        """Generate the job without opening the port and return its estimate."""
+        self.ext.debug("Generating HPGL for a dry run")
+        pieces = self.iter_hpgl()
+        return self.estimate_job(pieces, self.last_nesting)
+
+    def estimate_job(self, hpgl, nesting=None):
+        """Byte count, pen distances and the wire and mechanical time for a job (a string or pieces).
+
+        ``nesting`` is the job's own last_nesting, for its roll length; HPGL read
+        from a file has none.
+        """
+        options = self.ext.options
+        size = [0]
+
+        def counted(pieces):
+            for piece in pieces:
+                size[0] += len(piece)
+                yield piece
+
+        motion = hpgl_commands.measure(counted((hpgl,) if isinstance(hpgl, str) else hpgl))
+        size = size[0]
+        units_per_mm = (float(options.resolutionX) + float(options.resolutionY)) / 2.0 / 25.4
+        default_speed = float(getattr(options, "speed", 0)) or DEFAULT_SPEED_CM_S
+        motion_seconds = motion["lifts"] * PEN_LIFT_SECONDS
+        for table in (motion["pen_down"], motion["pen_up"]):
+            for speed, units in table.items():
+                cm_per_second = float(speed) if speed and float(speed) > 0 else default_speed
+                motion_seconds += units / units_per_mm / 10.0 / cm_per_second
+        wire_seconds = self.wire_seconds(size)
+        self.last_estimate = {
+            "bytes": size,
+            "pen_down_mm": sum(motion["pen_down"].values()) / units_per_mm,
+            "pen_up_mm": sum(motion["pen_up"].values()) / units_per_mm,
+            "pen_lifts": motion["lifts"],
+            "baud": int(getattr(options, "serialBaudRate", 9600)),
+            "wire_seconds": wire_seconds,
+            "motion_seconds": motion_seconds,
+            # The plotter cuts from its buffer while the rest arrives, so the slower side wins.
+            "estimated_seconds": max(wire_seconds, motion_seconds),
         }
-        for key, value in defaults.items():
+        if nesting:
+            self.last_estimate["roll_length_mm"] = nesting["roll_length_mm"]
+        self.ext.debug(
+            f"Estimate: {size} bytes, {wire_seconds:.0f}s on the wire, "
+            f"{motion_seconds:.0f}s of head movement"
+        )
+        return self.last_estimate
+
+    def ensure_plotter_defaults(self):
+        for key, value in PLOTTER_DEFAULTS.items():
             if not hasattr(self.ext.options, key):
                 setattr(self.ext.options, key, value)
 
     def generate_hpgl(self):
+        return "".join(self.iter_hpgl())
+
+    def iter_hpgl(self):
+        """Return the job as an iterator of HPGL text pieces, IN and trailer included.
+
+        Geometry (and with it any "No paths found" error) is done before this
+        returns; formatting and compaction happen piece by piece as it is consumed.
+        A document already generated with the same options is replayed from the
+        HPGL cache (see jobcache.py) instead.
+        """
         self.ensure_plotter_defaults()
+        cache, key = self.hpgl_cache()
+        cached = cache.lookup(key) if cache is not None else None
+        if cached is not None:
+            self.ext.debug(f"Reusing cached HPGL ({cached.get('bytes')} bytes)")
+            self.last_optimization = cached.get("optimization")
+            self.last_compaction = cached.get("compaction")
+            self.last_nesting = cached.get("nesting")
+            return cache.iter_text(key)
+        pieces = self.generate_pieces()
+        if cache is None:
+            return pieces
+        return cache.store(key, pieces, self.cache_meta, self.ext.debug)
+
+    def hpgl_cache(self):
+        """(jobcache.HpglCache, key for the current document and options), or (None, None)."""
         try:
-            import hpgl_encoder
-        except Exception as exc:
-            raise RuntimeError(f"hpgl_encoder not available: {exc}") from exc
+            import jobcache
+
+            cache = jobcache.HpglCache()
+            if not cache.enabled:
+                return None, None
+            options = {
+                key: getattr(self.ext.options, key, value)
+                for key, value in PLOTTER_DEFAULTS.items()
+                if key not in SERIAL_OPTIONS
+            }
+            key = jobcache.cache_key(self.document_digest(), options, getattr(self.ext, "current_vidpid", None))
+        except Exception as exc:  # pylint: disable=broad-except
+            self.ext.debug(f"HPGL cache unavailable: {exc!r}")
+            return None, None
+        return cache, key
+
+    def document_digest(self):
+        """Digest of the document as it was before preprocess() converted anything in it."""
+        svg = self.ext.svg
+        if self.digest is None or self.digest[0] is not svg:
+            from lxml import etree
+
+            self.digest = (svg, hashlib.sha256(etree.tostring(svg)).hexdigest())
+        return self.digest[1]
+
+    def snapshot(self):
+        """A PlotEngine over a copy of the document and options, sharing this one's cache keys."""
+        engine = PlotEngine(DocumentSnapshot(self.ext))
+        engine.digest = (engine.ext.svg, self.document_digest())
+        return engine
+
+    def prepare(self, cancel=None):
+        """Generate the job into the HPGL cache ahead of a send; True once it is there.
 
+        Setting ``cancel`` abandons the job between pieces (geometry, done first,
+        runs to its end); nothing is cached then.
+        """
+        cache, key = self.hpgl_cache()
+        if cache is None:
+            return False
+        if cache.lookup(key) is not None:
+            return True
+        pieces = self.iter_hpgl()
+        try:
+            for _piece in pieces:
+                if cancel is not None and cancel.is_set():
+                    return False
+        finally:
+            pieces.close()
+        return cache.lookup(key) is not None
+
+    def cache_meta(self):
+        return {
+            "optimization": self.last_optimization,
+            "compaction": self.last_compaction,
+            "nesting": self.last_nesting,
+        }
+
+    def generate_pieces(self):
+        """iter_hpgl() without the cache."""
+        if int(getattr(self.ext.options, "copies", 1)) > 1:
+            return self.convert_hpgl(self.compact_hpgl(self.nest_copies()))
+        self.last_nesting = None
         if self.ext.svg.xpath("//use|//flowRoot|//text") is not None:
             self.preprocess(["flowRoot", "text"])
+        self.travel = [0.0, 0.0]
+        if str(getattr(self.ext.options, "encoder", "native")) == "inkscape":
+            # Compatibility mode: the host encoder's bytes, not reordered or reformatted.
+            hpgl = (self.encode_with_inkscape(),)
+        else:
+            hpgl = self.encode_native()
+        self.report_travel()
+        return self.convert_hpgl(self.compact_hpgl(hpgl))
+
+    def nest_copies(self):
+        """HPGL pieces for ``copies`` of the document packed onto the roll (see nesting.py).
+
+        The design is generated once, as a single-copy job that goes through the
+        HPGL cache like any other, and every copy is its points moved into place.
+        The layout is done before this returns; the text is formatted as it is consumed.
+        """
+        import nesting
+
+        options = self.ext.options
+        copies = int(options.copies)
+        per_mm_x = float(options.resolutionX) / 25.4
+        per_mm_y = float(options.resolutionY) / 25.4
+        width = float(getattr(options, "mediaWidth", 0.0)) * per_mm_y
+        if width <= 0:
+            raise RuntimeError("Set the media width to cut more than one copy.")
+        spacing = max(float(getattr(options, "nestSpacing", 2.0)), 0.0) * (per_mm_x + per_mm_y) / 2.0
+        shape = str(getattr(options, "nestShape", "hull")).lower()
+        if shape not in nesting.SHAPES:
+            shape = "hull"
+
+        design = self.design_engine()
+        text = "".join(design.iter_hpgl())
+        if text.startswith("IN") and text.endswith(JOB_TRAILER):
+            text = text[len("IN"):-len(JOB_TRAILER)]
+        blocks = [block for block in hpgl_commands.split_runs(text) if block != "IN"]
+        points = [point for block in blocks if not isinstance(block, str) for path in block for point in path]
+        if not points:
+            raise RuntimeError("HPGL generation failed: No paths found")
+        try:
+            layout = nesting.layout(points, copies, width, spacing, shape, bool(getattr(options, "nestRotate", False)))
+        except ValueError as exc:
+            raise RuntimeError(f"Cannot nest {copies} copies: {exc}.") from exc
+
+        first_path = None
+        tool_offset = float(getattr(options, "toolOffset", 0.0)) * (per_mm_x + per_mm_y) / 2.0
+        if getattr(options, "precut", True) and tool_offset > 0.0:
+            # The design is generated without its precut, which is made once for the whole roll.
+            if getattr(options, "center", False):
+                origin = (min(x for x, _y in points), min(y for _x, y in points))
+            else:
+                origin = (0, 0)
+            first_path = [origin, (origin[0], origin[1] + int(round(tool_offset * 8)))]
+        self.last_optimization = design.last_optimization
+        self.last_nesting = {
+            "copies": copies,
+            "rows": layout.rows,
+            "rotated": layout.rotated,
+            "shape": shape,
+            "roll_length_mm": float(layout.length) / per_mm_x,
+            "media_width_mm": width / per_mm_y,
+        }
+        self.ext.debug(
+            f"Nested {copies} copies in {layout.rows} rows"
+            f"{' (turned 90°)' if layout.rotated else ''}: {self.last_nesting['roll_length_mm']:.0f} mm of roll"
+        )
+        return nesting.iter_nested(blocks, layout, first_path)
+
+    def design_engine(self):
+        """A single-copy engine over this document, as nesting uses it: plain HPGL, no precut."""
+        options = SimpleNamespace(**vars(self.ext.options))
+        options.copies = 1
+        options.compactOutput = "off"
+        options.precut = False
+        ext = SimpleNamespace(
+            svg=self.ext.svg,
+            options=options,
+            current_vidpid=getattr(self.ext, "current_vidpid", None),
+            debug=self.ext.debug,
+        )
+        engine = PlotEngine(ext)
+        engine.digest = (ext.svg, self.document_digest())
+        return engine
+
+    def encode_native(self):
+        try:
+            from encoder import HpglEncoder
+        except Exception as exc:
+            raise RuntimeError(f"Built-in HPGL encoder not available: {exc}") from exc
+        encoder = HpglEncoder(self.ext, order=self.order_subpaths)
+        try:
+            return encoder.iter_hpgl()
+        except Exception as exc:
+            raise RuntimeError(f"HPGL generation failed: {exc}") from exc
+
+    def encode_with_inkscape(self):
+        """The "inkscape" encoder: whatever hpgl_encoder the running Inkscape ships, output left as it emits it.
+
+        Nothing here pins that output, so it changes with the Inkscape version.
+        """
+        try:
+            import hpgl_encoder
+        except Exception as exc:
+            raise RuntimeError(f"hpgl_encoder not available: {exc}") from exc
         encoder = hpgl_encoder.hpglEncoder(self.ext)
         try:
-            hpgl = encoder.getHpgl()
+            return encoder.getHpgl()
         except Exception as exc:
             raise RuntimeError(f"HPGL generation failed: {exc}") from exc
-        return self.convert_hpgl(hpgl)
+
+    def order_subpaths(self, paths, start=(0, 0)):
+        """Order one run of subpaths: inner contours first and/or least pen-up travel."""
+        optimize = getattr(self.ext.options, "optimizeTravel", True)
+        inner_first = getattr(self.ext.options, "innerFirst", True)
+        if not optimize and not inner_first:
+            return paths
+        prerequisites = pathopt.containment_prerequisites(paths) if inner_first else None
+        if optimize:
+            ordered, _stats = pathopt.order_paths(paths, start=start, prerequisites=prerequisites)
+        else:
+            ordered = pathopt.stable_order(paths, prerequisites)
+        self.travel[0] += pathopt.travel_distance(paths, start)
+        self.travel[1] += pathopt.travel_distance(ordered, start)
+        return ordered
+
+    def report_travel(self):
+        before, after = self.travel
+        if not before and not after:
+            self.last_optimization = None
+            return
+        units_per_mm = float(getattr(self.ext.options, "resolutionX", 1016.0)) / 25.4
+        self.last_optimization = {
+            "travel_before_mm": before / units_per_mm,
+            "travel_after_mm": after / units_per_mm,
+        }
+        self.ext.debug(
+            f"Pen-up travel {self.last_optimization['travel_before_mm']:.0f} mm -> "
+            f"{self.last_optimization['travel_after_mm']:.0f} mm"
+        )
+
+    def device_info(self):
+        """The plotters.py entry for the current VID:PID (compared case-insensitively), or {}."""
+        vidpid = (getattr(self.ext, "current_vidpid", None) or "").lower()
+        for key, info in plotters.items():
+            if key.lower() == vidpid and isinstance(info, dict):
+                return info
+        return {}
+
+    def pacing_mode(self):
+        """"buffer" to pace writes by the plotter's free buffer space (ESC.B), else "off"."""
+        requested = str(getattr(self.ext.options, "serialPacing", "auto")).lower()
+        if requested == "auto":
+            requested = self.device_info().get("pacing", "off")
+        return "buffer" if requested == "buffer" else "off"
+
+    def output_encoding(self):
+        """Coordinate encoding for compact_hpgl(), limited to what plotters.py allows."""
+        requested = str(getattr(self.ext.options, "compactOutput", "auto")).lower()
+        if requested in ("off", "absolute"):
+            return requested
+        if requested == "auto" and str(getattr(self.ext.options, "encoder", "native")) == "inkscape":
+            # Compatibility mode keeps the Inkscape encoder's bytes unless asked otherwise.
+            return "off"
+        supported = self.device_info().get("encodings", ())
+        if requested == "auto":
+            for encoding in ("pe", "relative"):
+                if encoding in supported:
+                    return encoding
+            return "absolute"
+        if requested not in supported:
+            self.ext.debug(f"{requested} output is not enabled for this device in plotters.py; using absolute.")
+            return "absolute"
+        return requested
+
+    def compact_hpgl(self, hpgl):
+        encoding = self.output_encoding()
+        self.last_compaction = None
+        if encoding == "off":
+            return hpgl
+        return self.iter_compacted(hpgl, encoding)
+
+    def iter_compacted(self, hpgl, encoding):
+        """compact() over a stream of pieces; last_compaction is set once it is consumed."""
+        sizes = [0, 0]
+
+        def counted():
+            for piece in hpgl:
+                sizes[0] += len(piece)
+                yield piece
+
+        for piece in hpgl_commands.iter_compact(counted(), encoding):
+            sizes[1] += len(piece)
+            yield piece
+        self.record_compaction(encoding, *sizes)
+
+    def record_compaction(self, encoding, before, after):
+        self.last_compaction = {
+            "encoding": encoding,
+            "bytes_before": before,
+            "bytes_after": after,
+            "ratio": after / before if before else 1.0,
+            "seconds_saved": self.wire_seconds(before - after),
+        }
+        self.ext.debug(
+            f"Compact HPGL ({encoding}): {before} -> {after} bytes "
+            f"({self.last_compaction['ratio'] * 100:.0f}%), "
+            f"about {self.last_compaction['seconds_saved']:.0f}s less on the wire"
+        )
+
+    def wire_seconds(self, nbytes):
+        """Time ``nbytes`` take at the configured baud rate and frame format."""
+        options = self.ext.options
+        baud = max(int(getattr(options, "serialBaudRate", 9600)), 1)
+        data = DATA_BITS.get(str(getattr(options, "serialByteSize", "eight")).lower(), 8)
+        stop = STOP_BITS.get(str(getattr(options, "serialStopBits", "one")).lower(), 1.0)
+        parity = 0 if str(getattr(options, "serialParity", "none")).lower() == "none" else 1
+        return nbytes * (1 + data + parity + stop) / baud
 
     def convert_hpgl(self, hpgl):
         init = "IN"
-        return init + hpgl + ";PU0,0;SP0;IN; "
+        yield init
+        yield from hpgl
+        yield JOB_TRAILER
+
+    def send_hpgl_serial(self, device_path, hpgl, progress=None, cancel=None):
+        ser = self.open_serial(device_path)
+        try:
+            total = len(hpgl) if isinstance(hpgl, str) else None
+            self.stream_hpgl(ser, self.iter_chunks(hpgl), total, progress, cancel)
+        finally:
+            ser.close()
+
+    def iter_chunks(self, hpgl, size=SEND_CHUNK_SIZE):
+        """Yield encoded slices of at most ``size`` bytes, split after a ';' when possible.
+
+        ``hpgl`` is a string or an iterable of string pieces of any length.
+        """
+        if isinstance(hpgl, str):
+            hpgl = (hpgl,)
+        pending = ""
+        for piece in hpgl:
+            pending += piece
+            start = 0
+            while len(pending) - start > size:
+                end = start + size
+                boundary = pending.rfind(";", start, end)
+                if boundary >= start:
+                    end = boundary + 1
+                yield pending[start:end].encode("utf8")
+                start = end
+            pending = pending[start:]
+        if pending:
+            yield pending.encode("utf8")
 
-    def send_hpgl_serial(self, device_path, hpgl):
+    def iter_mapped_chunks(self, data, start=0, size=SEND_CHUNK_SIZE):
+        """Like iter_chunks() over bytes or an mmap from ``start``, yielding memoryviews of it.
+
+        Nothing is copied; each slice is released when the next one is asked for,
+        so the map can be closed once the generator is.
+        """
+        view = memoryview(data)
+        try:
+            end_of_data = len(view)
+            while start < end_of_data:
+                end = min(start + size, end_of_data)
+                if end < end_of_data:
+                    boundary = data.rfind(b";", start, end)
+                    if boundary >= start:
+                        end = boundary + 1
+                with view[start:end] as chunk:
+                    yield chunk
+                start = end
+        finally:
+            view.release()
+
+    def stream_hpgl(self, ser, chunks, total=None, progress=None, cancel=None, pause=None):
+        """Write chunks to an open port, reporting (sent, total, bytes/s) after each one.
+
+        Returns once the last byte has left the port (see drain()), so the port
+        can be closed and last_send["seconds"] is the real time on the wire.
+        """
+        sent = 0
+        pacer = BufferPacer(self, ser) if self.pacing_mode() == "buffer" else None
+        started = time.monotonic()
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                self.abort_send(ser)
+                raise PlotCancelled(f"Cancelled after {sent} bytes")
+            if pause is not None and pause.is_set():
+                raise PlotPaused(f"Paused after {sent} bytes")
+            if pacer is not None:
+                pacer.write(chunk, cancel)
+            else:
+                self.wait_for_tx_room(ser, cancel)
+                ser.write(chunk)
+            sent += len(chunk)
+            if progress is not None:
+                elapsed = max(time.monotonic() - started, 1e-6)
+                progress(sent, total, sent / elapsed)
+        written = time.monotonic() - started
+        self.drain(ser, cancel)
+        elapsed = time.monotonic() - started
+        rate = sent / elapsed if elapsed > 0 else 0.0
+        line_rate = 1.0 / self.wire_seconds(1)
+        self.last_send = {
+            "bytes": sent,
+            "seconds": elapsed,
+            "rate": rate,
+            "drain_seconds": elapsed - written,
+            # Sustained throughput as a share of what the line could carry, to compare pacing modes.
+            "line_usage": rate / line_rate,
+            "pacing": "off" if pacer is None else "buffer" if pacer.active else "no reply",
+        }
+        if pacer is not None:
+            self.last_send["buffer_queries"] = pacer.queries
+            self.last_send["buffer_wait_seconds"] = pacer.waited
+        self.ext.debug(
+            f"Sent {sent} bytes in {elapsed:.2f}s ({rate:.0f} B/s, {self.last_send['line_usage'] * 100:.0f}% "
+            f"of the line), {elapsed - written:.2f}s of it draining the output queue"
+        )
+        if pacer is not None:
+            self.ext.debug(f"Buffer pacing: {pacer.queries} ESC.B queries, {pacer.waited:.2f}s waiting for room")
+        return sent
+
+    def drain(self, ser, cancel=None):
+        """Wait until everything written has left the port; some adapters drop unsent data on close.
+
+        Polls the driver's output queue (TIOCOUTQ on POSIX) while it shrinks, then
+        lets flush() (tcdrain) wait out the UART. A queue that stops moving is
+        usually a plotter holding XOFF (paused, out of media) and is waited for;
+        every DRAIN_STALL_SECONDS the port is checked, and only once it has gone
+        is OSError raised, so the job is treated as interrupted rather than sent.
+        A flush that does not return is waited for the same way, checking every
+        DRAIN_FLUSH_SECONDS; the port is only handed back for closing once the
+        flush has returned or, after an unplug or cancel, been given that long
+        again. A port that cannot flush at all has only its (already empty)
+        queue to go by.
+        """
+        smallest = None
+        stalled_since = time.monotonic()
+        while True:
+            try:
+                pending = ser.out_waiting
+            except Exception as exc:
+                if not port_present(ser.port):
+                    raise OSError(errno.ENODEV, f"Plotter disconnected before its queue drained: {exc}") from exc
+                break
+            if pending <= 0:
+                break
+            if cancel is not None and cancel.is_set():
+                self.abort_send(ser)
+                raise PlotCancelled(f"Cancelled with {pending} bytes still queued")
+            now = time.monotonic()
+            if smallest is None or pending < smallest:
+                smallest, stalled_since = pending, now
+            elif now - stalled_since > DRAIN_STALL_SECONDS:
+                if not port_present(ser.port):
+                    raise OSError(errno.ENODEV, f"Plotter disconnected with {pending} bytes still queued")
+                self.ext.debug(f"Plotter is holding {pending} queued bytes (XOFF?); still waiting")
+                stalled_since = now
+            time.sleep(DRAIN_POLL)
+        flushed = threading.Event()
+
+        def flush():
+            try:
+                ser.flush()
+            except Exception as exc:  # pylint: disable=broad-except
+                self.ext.debug(f"Serial flush failed: {exc!r}")
+            finally:
+                flushed.set()
+
+        threading.Thread(target=flush, name="kmplot-drain", daemon=True).start()
+        waited_since = time.monotonic()
+        while not flushed.wait(DRAIN_POLL):
+            if cancel is not None and cancel.is_set():
+                # Dropping what is left ends tcdrain, so the port can be closed after it.
+                try:
+                    ser.reset_output_buffer()
+                except Exception as exc:  # pylint: disable=broad-except
+                    self.ext.debug(f"Serial output reset failed: {exc!r}")
+                self.abort_send(ser)
+                flushed.wait(DRAIN_FLUSH_SECONDS)
+                raise PlotCancelled("Cancelled while the last bytes were leaving the port")
+            if time.monotonic() - waited_since > DRAIN_FLUSH_SECONDS:
+                if not port_present(ser.port):
+                    flushed.wait(DRAIN_FLUSH_SECONDS)
+                    raise OSError(errno.ENODEV, "Plotter disconnected before the last bytes were sent")
+                self.ext.debug("Serial port is still sending its last bytes (XOFF?); still waiting")
+                waited_since = time.monotonic()
+
+    def wait_for_tx_room(self, ser, cancel=None):
+        while True:
+            try:
+                pending = ser.out_waiting
+            except Exception:
+                return
+            if pending <= TX_HIGH_WATER:
+                return
+            if cancel is not None and cancel.is_set():
+                return
+            time.sleep(0.01)
+
+    def abort_send(self, ser):
+        try:
+            ser.write(CANCEL_TRAILER)
+        except Exception as exc:
+            self.ext.debug(f"Failed to reset plotter after cancel: {exc!r}")
+
+    def open_serial(self, device_path):
         try:
             import serial
         except Exception as exc:
@@ -124,14 +1042,7 @@ class PlotEngine:
                     "or adjust udev permissions."
                 )
             raise RuntimeError(f"Failed to open serial port {device_path}: {exc}.{hint}") from exc
-        try:
-            ser.write(hpgl.encode("utf8"))
-            try:
-                ser.read(2)
-            except Exception:
-                pass
-        finally:
-            ser.close()
+        return ser
 
     def preprocess(self, convert):
         try:
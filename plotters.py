@@ -1,5 +1,9 @@
 plotters = {
     # vid:pid -> {"name": "wat is this", "icon": "iconname"}
+    # Optional "encodings": ("relative", "pe") lets compact output use PR deltas and/or
+    # HP-GL/2 Polyline Encoded (7-bit) coordinates; only list what the device accepts.
+    # Optional "pacing": "buffer" sends only as much as the plotter reports free buffer
+    # space for (ESC.B), for plotters that answer it behind adapters with unreliable XON/XOFF.
     "0403:6001": {"name": "FTDI FT232RL", "icon": "vinyl"},
     "1A86:7523": {"name": "QinHeng CH340/CH341", "icon": "vinyl"},
     "067B:2303": {"name": "Prolific PL2303", "icon": "vinyl"},
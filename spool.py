@@ -0,0 +1,602 @@
+"""On-disk plot queue with resumable jobs.
+
+Each job is ``<id>.hpgl`` plus a ``<id>.json`` manifest in the spool directory
+(KM_PLOT_SPOOL, else the user cache directory). A job is queued as soon as it is
+created and its HPGL is written as it is generated; a ``<id>.partial`` marker
+exists until the file is complete, and senders reading the job wait for more
+at its end while it does. While a job streams, the
+manifest's "checkpoint" records how many bytes have left the serial driver;
+after a dropped connection the job restarts from the last pen-up boundary
+before it (see hpgl.resume_point). A job names one port, or several
+("targets") when any idle plotter of a model may cut it; the port is fixed when
+a sender claims the job. The process holding the spool's lock file sends (see
+dispatch.py); other km-plot processes only add jobs to the queue.
+
+A job may instead name a pre-generated HPGL file ("source") that is sent in
+place, without a copy in the spool. Complete job files are sent from a
+read-only mmap, so even very large ones are never read into memory.
+"""
+import contextlib
+import json
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+import hpgl as hpgl_commands
+from plot import PlotCancelled, PlotEngine, PlotPaused, list_usb_ports, usb_port_identities
+
+# Seconds between manifest writes while a job streams.
+CHECKPOINT_INTERVAL = 1.0
+# How long a runner waits for a disconnected plotter to come back.
+RECONNECT_TIMEOUT = 120.0
+# Seconds between reconnect attempts.
+RECONNECT_POLL = 1.0
+# Bytes read at a time from a job file still being written, or scanned for a resume point.
+READ_BLOCK = 64 * 1024
+# Seconds between checks for more data at the end of a job still being written.
+TAIL_POLL = 0.05
+# A job file that has not grown for this long while marked partial is given up on.
+WRITE_STALL_SECONDS = 60.0
+# Finished jobs kept on disk (newest first) for inspection and re-cutting.
+KEEP_FINISHED = 20
+# Output encodings every HPGL plotter understands (see PlotEngine.output_encoding).
+PLAIN_ENCODINGS = ("absolute", "off")
+# Jobs in these states are picked up by a runner.
+RUNNABLE_STATES = ("queued",)
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+def cache_home():
+    """km-plot's directory in the user cache directory."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or str(Path.home() / "AppData" / "Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "km-plot"
+
+
+def default_spool_dir():
+    configured = os.environ.get("KM_PLOT_SPOOL")
+    return Path(configured) if configured else cache_home() / "spool"
+
+
+def write_atomic(path, data):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp, path)
+
+
+class JobFailed(RuntimeError):
+    """The job itself cannot be sent (its generation failed); the port is fine."""
+
+
+def write_jobs(jobs, hpgl):
+    """Write the same HPGL (a string or pieces) into several jobs as it is generated."""
+    if isinstance(hpgl, str):
+        hpgl = (hpgl,)
+    handles = []
+    try:
+        for job in jobs:
+            handles.append(open(job.hpgl_path, "ab"))
+        for piece in hpgl:
+            data = piece.encode("latin-1")
+            for handle in handles:
+                handle.write(data)
+                handle.flush()
+        for handle in handles:
+            os.fsync(handle.fileno())
+    except BaseException as exc:
+        for job in jobs:
+            job.partial_path.write_text(str(exc) or repr(exc), encoding="utf8")
+        raise
+    finally:
+        for handle in handles:
+            handle.close()
+    for job in jobs:
+        job.partial_path.unlink()
+
+
+class Job:
+
+    def __init__(self, spool, manifest):
+        self.spool = spool
+        self.manifest = manifest
+
+    @property
+    def id(self):
+        return self.manifest["id"]
+
+    @property
+    def state(self):
+        return self.manifest["state"]
+
+    @property
+    def targets(self):
+        return self.manifest.get("targets") or [self.manifest.get("device")]
+
+    @property
+    def hpgl_path(self):
+        source = self.manifest.get("source")
+        return Path(source) if source else self.spool.directory / f"{self.id}.hpgl"
+
+    @property
+    def manifest_path(self):
+        return self.spool.directory / f"{self.id}.json"
+
+    @property
+    def partial_path(self):
+        return self.spool.directory / f"{self.id}.partial"
+
+    def write(self, hpgl):
+        """Write the job's HPGL, a string or an iterable of pieces; senders may read along."""
+        write_jobs([self], hpgl)
+
+    def writing(self):
+        """None once the file is complete, "" while it is being written, or the writer's error."""
+        try:
+            return self.partial_path.read_text(encoding="utf8")
+        except FileNotFoundError:
+            return None
+
+    def size(self):
+        """Bytes in the complete job, or None while it is still being written."""
+        if self.manifest.get("bytes") is None and self.writing() is None:
+            self.manifest["bytes"] = self.hpgl_path.stat().st_size
+        return self.manifest.get("bytes")
+
+    def portable_to(self, vidpid):
+        """Whether a plotter with ``vidpid`` understands this job's HPGL.
+
+        PR and PE output is only made for models that list it in plotters.py, so
+        it stays with the model it was made for; plain output and HPGL files
+        queued as they are go anywhere.
+        """
+        if self.manifest.get("source") or self.manifest.get("encoding") in PLAIN_ENCODINGS:
+            return True
+        made_for = (self.manifest.get("vidpid") or "").lower()
+        return bool(made_for) and made_for == (vidpid or "").lower()
+
+    def check_source(self):
+        """Raise JobFailed if the file a job sends in place is gone or changed size since it was queued."""
+        source = self.manifest.get("source")
+        if not source:
+            return
+        try:
+            size = os.stat(source).st_size
+        except OSError as exc:
+            raise JobFailed(f"Cannot read {source}: {exc}") from exc
+        if size != self.manifest.get("bytes"):
+            raise JobFailed(f"{source} changed since it was queued")
+
+    @contextlib.contextmanager
+    def mapped(self):
+        """The complete job file as a read-only mmap (b"" when empty), closed on leaving the block."""
+        with open(self.hpgl_path, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                yield b""
+                return
+            data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        try:
+            yield data
+        finally:
+            try:
+                data.close()
+            except BufferError:
+                # A view of it is still held (by a traceback, say); it is unmapped once that goes.
+                pass
+
+    def iter_text(self, start=0):
+        """Yield the job from ``start`` in blocks, following the file while it is written.
+
+        latin-1 keeps string offsets equal to file (and wire) byte offsets.
+        """
+        with open(self.hpgl_path, "rb") as handle:
+            handle.seek(start)
+            waited_since = None
+            while True:
+                block = handle.read(READ_BLOCK)
+                if block:
+                    waited_since = None
+                    yield block.decode("latin-1")
+                    continue
+                status = self.writing()
+                if status is None:
+                    # Finished between the read and the check: send what it added last.
+                    block = handle.read()
+                    if block:
+                        yield block.decode("latin-1")
+                    self.manifest["bytes"] = handle.tell()
+                    return
+                if status:
+                    raise JobFailed(f"Generating the job failed: {status}")
+                now = time.monotonic()
+                waited_since = waited_since or now
+                if now - waited_since > WRITE_STALL_SECONDS:
+                    raise JobFailed("The job file stopped growing before it was complete")
+                time.sleep(TAIL_POLL)
+
+    def update(self, **fields):
+        self.manifest.update(fields)
+        self.manifest["updated"] = time.time()
+        write_atomic(self.manifest_path, json.dumps(self.manifest, indent=1).encode("utf8"))
+
+
+class Spool:
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory else default_spool_dir()
+        self.lock_handle = None
+        # Serialises claim() between the sender threads of one process.
+        self.claim_lock = threading.Lock()
+
+    def submit(self, hpgl, device, vidpid=None, options=None, name=None, targets=None, encoding=None):
+        """Queue a job and write its HPGL (a string or pieces); see create()."""
+        job = self.create(device, vidpid, options, name, targets, encoding=encoding)
+        job.write(hpgl)
+        return job
+
+    def create(
+        self, device, vidpid=None, options=None, name=None, targets=None, source=None, copy_from=None, encoding=None
+    ):
+        """Queue an empty job behind the existing ones; fill it with Job.write().
+
+        With ``targets`` (a list of ports) and no ``device``, the first of those
+        ports to go idle takes the job. With ``source``, the job is that HPGL
+        file, complete already and sent as it is; it must stay in place until sent.
+        With ``copy_from``, the job is complete with a copy (a hard link where
+        possible) of that file. ``encoding`` is the coordinate encoding the HPGL
+        was compacted to, if known (see Job.portable_to).
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+        job = Job(self, {
+            "id": job_id,
+            "name": name or job_id,
+            "device": device,
+            "targets": list(targets or ([device] if device else [])),
+            "vidpid": vidpid,
+            "options": dict(options or {}),
+            "encoding": encoding,
+            "bytes": None,
+            "checkpoint": 0,
+            "state": "queued",
+            "created": time.time(),
+        })
+        if source is not None:
+            source = Path(source).resolve()
+            job.manifest.update(source=str(source), bytes=source.stat().st_size)
+        elif copy_from is not None:
+            try:
+                os.link(copy_from, job.hpgl_path)
+            except OSError:
+                shutil.copyfile(copy_from, job.hpgl_path)
+            job.manifest["bytes"] = job.hpgl_path.stat().st_size
+        else:
+            # Marker and file first: a sender must never see a queued job without them.
+            job.partial_path.write_text("", encoding="utf8")
+            job.hpgl_path.write_bytes(b"")
+        job.update()
+        return job
+
+    def jobs(self, states=None):
+        """Jobs in queue order (oldest first), optionally only those in ``states``."""
+        found = []
+        if not self.directory.is_dir():
+            return found
+        for path in self.directory.glob("*.json"):
+            try:
+                manifest = json.loads(path.read_text(encoding="utf8"))
+            except (OSError, ValueError):
+                continue
+            if states is None or manifest.get("state") in states:
+                found.append(Job(self, manifest))
+        found.sort(key=lambda job: (job.manifest.get("created", 0), job.id))
+        return found
+
+    def get(self, job_id):
+        for job in self.jobs():
+            if job.id == job_id:
+                return job
+        return None
+
+    def last_done(self, vidpids=None):
+        """The job that most recently finished sending, or None.
+
+        With ``vidpids``, only a job every one of those plotter models can cut.
+        """
+        done = [
+            job for job in self.jobs(("done",))
+            if vidpids is None or all(job.portable_to(vidpid) for vidpid in vidpids)
+        ]
+        return max(done, key=lambda job: job.manifest.get("updated", 0)) if done else None
+
+    def recut(self, job, targets=None, options=None):
+        """Queue a finished job's HPGL again as a new job, for ``targets`` or the port it went to."""
+        manifest = job.manifest
+        targets = list(targets or [manifest.get("device")])
+        device = targets[0] if len(targets) == 1 else None
+        fields = {
+            "vidpid": manifest.get("vidpid"),
+            "options": manifest.get("options") if options is None else options,
+            "name": manifest.get("name"),
+            "targets": targets,
+            "encoding": manifest.get("encoding"),
+        }
+        if manifest.get("source"):
+            return self.create(device, source=manifest["source"], **fields)
+        return self.create(device, copy_from=job.hpgl_path, **fields)
+
+    def next_job(self, device=None):
+        """Oldest queued job, or the oldest that ``device`` may send."""
+        for job in self.jobs(RUNNABLE_STATES):
+            if device is None or device in job.targets:
+                return job
+        return None
+
+    def claim(self, device):
+        """Take the oldest queued job ``device`` may send and mark it as sending there."""
+        with self.claim_lock:
+            job = self.next_job(device)
+            if job is not None:
+                job.update(state="sending", device=device)
+            return job
+
+    def wanted_ports(self):
+        """{port: vid:pid} for every port some queued job may be sent to."""
+        ports = {}
+        for job in self.jobs(RUNNABLE_STATES):
+            for port in job.targets:
+                ports.setdefault(port, job.manifest.get("vidpid"))
+        return ports
+
+    def requeue(self, job):
+        """Queue an interrupted, failed or cancelled job again; it resumes at its checkpoint."""
+        if job.manifest.get("checkpoint", 0) > 0:
+            # Part of it is on the material of this plotter; only it can finish the job.
+            job.update(state="queued", error=None, targets=[job.manifest["device"]])
+        else:
+            job.update(state="queued", error=None)
+
+    def prune(self):
+        """Delete all but the KEEP_FINISHED most recently finished jobs (a "source" file is never touched)."""
+        finished = [job for job in self.jobs(FINISHED_STATES)]
+        finished.sort(key=lambda job: job.manifest.get("updated", 0), reverse=True)
+        for job in finished[KEEP_FINISHED:]:
+            paths = [job.manifest_path, job.partial_path]
+            if not job.manifest.get("source"):
+                paths.append(job.hpgl_path)
+            for path in paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def acquire(self):
+        """Take the runner lock; False if another process is already sending."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        handle = open(self.directory / "runner.lock", "a+b")
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self.lock_handle = handle
+        return True
+
+    def release(self):
+        if self.lock_handle is not None:
+            # Closing the handle drops the lock on every platform.
+            self.lock_handle.close()
+            self.lock_handle = None
+
+
+class JobContext:
+    """What PlotEngine needs from its extension, rebuilt from a job's manifest."""
+
+    def __init__(self, job, debug):
+        self.options = SimpleNamespace(**job.manifest.get("options", {}))
+        self.current_vidpid = job.manifest.get("vidpid")
+        self.svg = None
+        self.debug = debug
+
+
+class SpoolRunner:
+    """Sends spooled jobs and resumes them after the connection drops.
+
+    ``progress(job, sent, total, rate)`` reports each job's position in its HPGL
+    file. Setting ``cancel`` aborts the current job (the plotter is reset);
+    setting ``pause`` stops between chunks without touching the plotter and
+    leaves the job queued at its checkpoint, for another runner to continue.
+    After a disconnect the runner waits for the job's port to come back. A job
+    with part of it cut only continues on the same plotter (by its USB serial
+    number or location, see plot.usb_port_identities) under whichever path it
+    reappears, never on another plotter that took its path; one that has not
+    started may also go to another port with the same VID:PID that is not in
+    ``reserved`` (ports other senders drive).
+    """
+
+    def __init__(self, spool, debug, progress=None, cancel=None, pause=None, reserved=()):
+        self.spool = spool
+        self.debug = debug
+        self.progress = progress
+        self.cancel = cancel
+        self.pause = pause
+        self.reserved = reserved
+
+    def stopping(self):
+        return any(event is not None and event.is_set() for event in (self.cancel, self.pause))
+
+    def send(self, job):
+        """Send one claimed job to the end; returns the port it finished on."""
+        try:
+            return self.send_until_done(job)
+        except Exception as exc:
+            if job.state == "sending":
+                # Never leave it "sending": it stays at its checkpoint for --resume.
+                job.update(state="interrupted", error=str(exc))
+            raise
+
+    def send_until_done(self, job):
+        engine = PlotEngine(JobContext(job, self.debug))
+        device = job.manifest["device"]
+        while True:
+            checkpoint = job.manifest.get("checkpoint", 0)
+            try:
+                job.check_source()
+                start, prefix = hpgl_commands.resume_point(job.iter_text(), checkpoint) if checkpoint else (0, "")
+            except JobFailed as exc:
+                job.update(state="failed", error=str(exc))
+                raise
+            if start:
+                self.debug(f"Resuming job {job.id} at byte {start} of {job.size() or 'a partial file'}")
+            job.update(state="sending", device=device)
+            port_id = job.manifest.get("port_id")
+            try:
+                if checkpoint > 0 and port_id and self.port_identity(device) != port_id:
+                    # Another plotter took the path; the cut so far is on the first one's material.
+                    raise RuntimeError(f"{device} is not the plotter job {job.id} was started on")
+                ser = engine.open_serial(device)
+            except RuntimeError as exc:
+                if job.manifest.get("checkpoint", 0) <= 0:
+                    if len(job.targets) > 1:
+                        # Nothing sent yet: leave it to the other plotters it may go to.
+                        job.update(state="queued", targets=[port for port in job.targets if port != device])
+                    else:
+                        job.update(state="failed", error=str(exc))
+                    raise
+                ser = None
+                error = exc
+            if ser is not None:
+                if not job.manifest.get("checkpoint", 0):
+                    job.manifest["port_id"] = self.port_identity(device)
+                try:
+                    self.stream(engine, ser, job, start, prefix)
+                    job.update(state="done", checkpoint=job.size(), result=engine.last_send, error=None)
+                    return device
+                except PlotCancelled as exc:
+                    job.update(state="cancelled", error=str(exc))
+                    raise
+                except PlotPaused:
+                    self.spool.requeue(job)
+                    return device
+                except JobFailed as exc:
+                    # Part of the job may be on the material; lift the tool and reset.
+                    engine.abort_send(ser)
+                    job.update(state="failed", error=str(exc))
+                    raise
+                except OSError as exc:
+                    error = exc
+                finally:
+                    try:
+                        ser.close()
+                    except Exception:
+                        pass
+            job.update(state="interrupted", error=str(error))
+            self.debug(f"Job {job.id} interrupted at byte {job.manifest['checkpoint']}: {error}")
+            device = self.wait_for_device(job)
+            if device is None:
+                raise RuntimeError(
+                    f"Plotter did not come back; job {job.id} kept at byte {job.manifest['checkpoint']}"
+                )
+
+    def stream(self, engine, ser, job, start, prefix):
+        head = prefix.encode("latin-1")
+        last_saved = time.monotonic()
+
+        def chunks():
+            if head:
+                yield head
+            if job.writing() is None:
+                with job.mapped() as data:
+                    yield from engine.iter_mapped_chunks(data, start)
+            else:
+                yield from engine.iter_chunks(job.iter_text(start))
+
+        def report(sent, _total, rate):
+            nonlocal last_saved
+            try:
+                pending = ser.out_waiting
+            except Exception:
+                pending = 0
+            acked = start + max(sent - len(head) - pending, 0)
+            job.manifest["checkpoint"] = max(acked, job.manifest.get("checkpoint", 0))
+            now = time.monotonic()
+            if now - last_saved >= CHECKPOINT_INTERVAL:
+                job.update()
+                last_saved = now
+            if self.progress is not None:
+                self.progress(job, start + max(sent - len(head), 0), job.size(), rate)
+
+        pieces = chunks()
+        try:
+            engine.stream_hpgl(ser, pieces, None, report, self.cancel, self.pause)
+        finally:
+            # Closes the job's map now rather than whenever the traceback goes.
+            pieces.close()
+            job.update()
+
+    def port_identity(self, device):
+        try:
+            return usb_port_identities().get(device)
+        except RuntimeError:
+            return None
+
+    def wait_for_device(self, job):
+        """Wait for the job's port to reappear; see the class docstring for which others will do."""
+        device = job.manifest["device"]
+        vidpid = job.manifest.get("vidpid")
+        started = job.manifest.get("checkpoint", 0) > 0
+        port_id = job.manifest.get("port_id")
+        deadline = time.monotonic() + RECONNECT_TIMEOUT
+        while time.monotonic() < deadline and not self.stopping():
+            time.sleep(RECONNECT_POLL)
+            try:
+                ports = list_usb_ports()
+                identities = usb_port_identities() if started and port_id else {}
+            except RuntimeError:
+                ports = []
+            for path, port_vidpid in ports:
+                if started and port_id:
+                    # Part of the job is on this plotter's material: nothing else may finish
+                    # it, even another plotter that comes back on the same path.
+                    if identities.get(path) == port_id and (path == device or path not in self.reserved):
+                        return path
+                    continue
+                if path == device:
+                    return path
+                if path in self.reserved or started:
+                    continue
+                if vidpid and port_vidpid == vidpid:
+                    return path
+        return None
+
+
+def spawn_runner():
+    """Start a detached `cli.py --run-spool` that sends whatever is queued."""
+    command = [sys.executable, str(Path(__file__).resolve().parent / "cli.py"), "--run-spool"]
+    kwargs = {"stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    return subprocess.Popen(command, **kwargs)
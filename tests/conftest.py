@@ -0,0 +1,42 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# The modules live at the top of the repository, next to kmplot.py, with pyserial bundled in deps/.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "deps"))
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def pty():
+    """A pseudo-terminal to open as a serial port (``path``), with what reaches its other end in ``received``."""
+    if not hasattr(os, "openpty"):
+        pytest.skip("no pseudo-terminals here")
+    master, slave = os.openpty()
+    received = bytearray()
+
+    def read():
+        while True:
+            try:
+                received.extend(os.read(master, 65536))
+            except OSError:
+                return
+
+    def wait_for(size):
+        for _ in range(500):
+            if len(received) >= size:
+                return
+            time.sleep(0.01)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    yield SimpleNamespace(path=os.ttyname(slave), received=received, wait_for=wait_for)
+    os.close(slave)
+    reader.join(1)
+    os.close(master)
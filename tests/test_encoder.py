@@ -0,0 +1,93 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+inkex = pytest.importorskip("inkex")
+
+import encoder
+import plot
+
+HEADER = (
+    '<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"'
+    ' xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"'
+    ' xmlns:xlink="http://www.w3.org/1999/xlink" width="200mm" height="100mm" viewBox="0 0 200 100">'
+)
+PATH_LETTERS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2, "Z": 0}
+
+
+def path_data(rng):
+    parts = [rng.choice("Mm") + " ".join(f"{rng.uniform(-100, 100):.3f}" for _ in range(2 * rng.randint(1, 3)))]
+    for _ in range(rng.randint(1, 12)):
+        letter = rng.choice("MLHVCSQTZ")
+        numbers = [f"{rng.uniform(-100, 100):g}" for _ in range(PATH_LETTERS[letter] * rng.randint(1, 2))]
+        parts.append(rng.choice((letter, letter.lower())) + ",".join(numbers))
+    return " ".join(parts)
+
+
+def test_path_data_gives_the_superpath_inkex_would():
+    rng = random.Random(3)
+    for text in [path_data(rng) for _ in range(500)] + ["", "M1-2.5.5.5l.1.2zl1,1 3 3h-.5e1", "M 0 0 L 5 5 L 7"]:
+        expected = [[[tuple(handle) for handle in node] for node in sub] for sub in inkex.Path(text).to_superpath()]
+        assert encoder.parse_superpath(text) == expected
+
+
+def test_arcs_are_left_to_inkex():
+    assert encoder.parse_superpath("M 0 0 A 5 5 0 0 1 10 0") is None
+
+
+def shapes(rng, count):
+    return "".join(
+        f'<path d="M {rng.uniform(0, 180):.2f} {rng.uniform(0, 90):.2f} c 3 -4 6 4 {rng.uniform(2, 9):.2f} 1 l 2 5 z"/>'
+        for _ in range(count)
+    )
+
+
+def one_layer_document(seed=5, per_layer=500):
+    """Everything in one layer: transformed groups, sublayers with pen/speed labels, defs, hidden shapes, a <use>."""
+    rng = random.Random(seed)
+    parts = [HEADER, '<sodipodi:namedview id="view"/>', "<defs>", shapes(rng, 3000)]
+    parts += ['<path id="mark" d="M 0 0 L 5 5 L 0 5 z"/></defs>', shapes(rng, 1)]
+    parts.append('<g inkscape:groupmode="layer" inkscape:label="Layer 1" transform="translate(3,2)">')
+    parts.append('<g transform="scale(0.9) rotate(2)">')
+    for index in range(5):
+        label = f"pen {index % 3 + 1} speed {10 + index}"
+        parts.append(f'<g inkscape:groupmode="layer" inkscape:label="{label}" transform="translate({index},0)">')
+        parts += [shapes(rng, per_layer), "</g>", shapes(rng, 1)]
+    parts.append(f'<g style="display:none">{shapes(rng, 50)}</g><use xlink:href="#mark" x="20" y="30"/>')
+    parts.append("</g></g>" + shapes(rng, 1) + "</svg>")
+    return "".join(parts).encode("utf8")
+
+
+def make_encoder(document):
+    options = SimpleNamespace(**plot.PLOTTER_DEFAULTS)
+    svg = inkex.load_svg(document).getroot()
+    return encoder.HpglEncoder(SimpleNamespace(svg=svg, options=options, debug=lambda _message: None))
+
+
+def test_partition_splits_a_single_layer_and_skips_what_draws_nothing():
+    document = make_encoder(one_layer_document())
+    runs = document.partition(8)
+    assert len(runs) > 2
+    spans = [span for run in runs for span in run]
+    # Nothing from <defs> (child 1) or the namedview (child 0); the layer's insides are split up.
+    assert all(start >= 2 for path, start, _stop in spans if not path)
+    assert all(not path or path[0] == 3 for path, _start, _stop in spans)
+    assert sum(1 for path, _start, _stop in spans if len(path) >= 2) > 2
+    assert len(document.collect_spans(spans)) == len(make_encoder(one_layer_document()).collect_top_level())
+
+
+def test_small_documents_are_not_partitioned():
+    document = make_encoder(HEADER + shapes(random.Random(1), 10) + "</svg>")
+    assert document.partition(8) == []
+
+
+def test_parallel_flattening_matches_a_single_process(monkeypatch):
+    document = one_layer_document()
+    monkeypatch.setenv("KM_PLOT_WORKERS", "1")
+    serial = "".join(make_encoder(document).iter_hpgl())
+    monkeypatch.setenv("KM_PLOT_WORKERS", "2")
+    parallel_encoder = make_encoder(document)
+    assert parallel_encoder.flatten_parallel() is not None
+    parallel = "".join(make_encoder(document).iter_hpgl())
+    assert parallel == serial
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+import hpgl
+
+
+def encoder_stream(seed, negative=False):
+    """HPGL in the encoder's ";PU..;PD.." form: repeated state, zero-length points and bare PUs included."""
+    rng = random.Random(seed)
+    low = -3000 if negative else 0
+    parts = [";IN"]
+    for _layer in range(4):
+        parts += [f";SP{rng.randint(1, 2)}", f";VS{rng.choice((10, 20))}", ";FS80"]
+        for _path in range(40):
+            points = [(rng.randint(low, 3000), rng.randint(low, 3000)) for _ in range(rng.randint(1, 8))]
+            points.insert(2, points[1 if len(points) > 1 else 0])
+            parts.append(f";PU{points[0][0]},{points[0][1]}")
+            if len(points) > 1:
+                parts.append(";PD" + ",".join(f"{x},{y}" for x, y in points[1:]))
+            if rng.random() < 0.2:
+                parts.append(";PU")
+    parts.append(";PU0,0")
+    return "".join(parts)
+
+
+def strokes(text):
+    """Every non-zero pen-down stroke as (pen, speed, force, start, end)."""
+    state = {}
+    position = (0, 0)
+    result = []
+    for mnemonic, value in hpgl.iter_moves(text):
+        if mnemonic in hpgl.STATE_COMMANDS:
+            state[mnemonic] = value
+        elif mnemonic == "IN":
+            state.clear()
+        elif mnemonic in ("PU", "PD"):
+            if mnemonic == "PD" and value != position:
+                result.append((state.get("SP"), state.get("VS"), state.get("FS"), position, value))
+            position = value
+    return result
+
+
+@pytest.mark.parametrize("encoding", hpgl.ENCODINGS)
+@pytest.mark.parametrize("negative", (False, True))
+def test_compact_cuts_the_same_strokes(encoding, negative):
+    original = encoder_stream(7, negative)
+    compacted = hpgl.compact(original, encoding)
+    assert strokes(compacted) == strokes(original)
+    assert len(compacted) < len(original)
+
+
+def test_compact_ends_in_absolute_mode():
+    compacted = hpgl.compact(encoder_stream(3), "relative")
+    tracker = hpgl.PenTracker()
+    for mnemonic, params in hpgl.iter_commands(compacted):
+        tracker.feed(mnemonic, params)
+    assert not tracker.relative
+
+
+def pe8(value):
+    """One integer in 8-bit (base 64) Polyline Encoded form, which compact() never writes."""
+    value = 2 * value if value >= 0 else -2 * value + 1
+    chars = []
+    while value >= 64:
+        chars.append(chr(63 + (value & 63)))
+        value >>= 6
+    chars.append(chr(191 + value))
+    return "".join(chars)
+
+
+def test_decode_pe_eight_bit_pen_select_and_fraction():
+    params = ":" + pe8(3) + "<=" + pe8(1000) + pe8(-2000) + pe8(50) + pe8(-70) + ">" + pe8(1) + pe8(9) + pe8(4)
+    assert list(hpgl._decode_pe(params, (5, 5))) == [
+        (None, None, 3),
+        ("PU", (1000, -2000), None),
+        ("PD", (1050, -2070), None),
+        ("PD", (1054.5, -2068.0), None),
+    ]
+
+
+def test_decode_pe_seven_bit_matches_pe_number():
+    params = "7<" + hpgl.pe_number(-40) + hpgl.pe_number(12345) + hpgl.pe_number(0) + hpgl.pe_number(-1)
+    assert list(hpgl._decode_pe(params, (100, 100))) == [
+        ("PU", (60, 12445), None),
+        ("PD", (60, 12444), None),
+    ]
+
+
+@pytest.mark.parametrize("encoding", hpgl.ENCODINGS)
+def test_resume_point_lands_on_a_command_boundary(encoding):
+    text = hpgl.compact(encoder_stream(11), encoding)
+    everything = strokes(text)
+    for offset in range(1, len(text), 97):
+        start, prefix = hpgl.resume_point(text, offset)
+        assert start <= offset
+        assert start == 0 or text[start - 1] == ";"
+        # Resuming cuts everything from the boundary on, with the state in effect there.
+        done = len(strokes(text[:start]))
+        assert strokes(prefix + text[start:]) == everything[done:]
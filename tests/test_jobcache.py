@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import pytest
+
+inkex = pytest.importorskip("inkex")
+
+import plot
+
+DOCUMENT = b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 50"><path d="M 10 10 L 90 40"/></svg>'
+
+
+def cache_key(document=DOCUMENT, vidpid="0403:6001", **options):
+    ext = SimpleNamespace(
+        svg=inkex.load_svg(document).getroot(),
+        options=SimpleNamespace(**options),
+        current_vidpid=vidpid,
+        debug=lambda _message: None,
+    )
+    engine = plot.PlotEngine(ext)
+    engine.ensure_plotter_defaults()
+    _cache, key = engine.hpgl_cache()
+    return key
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("KM_PLOT_CACHE", str(tmp_path))
+    monkeypatch.setenv("KM_PLOT_CACHE_MB", "16")
+
+
+def test_same_document_and_settings_share_a_key():
+    assert cache_key() == cache_key()
+    assert cache_key(vidpid="0403:6001") == cache_key(vidpid="0403:6001".upper())
+
+
+def test_cut_settings_document_and_model_change_the_key():
+    key = cache_key()
+    assert cache_key(speed=20) != key
+    assert cache_key(copies=3) != key
+    assert cache_key(compactOutput="pe") != key
+    assert cache_key(vidpid="1a86:7523") != key
+    assert cache_key(document=DOCUMENT.replace(b"90 40", b"90 41")) != key
+
+
+def test_connection_settings_keep_the_key():
+    key = cache_key()
+    assert cache_key(serialBaudRate="115200", serialFlowControl="rtscts", serialPacing="buffer") == key
+
+
+def test_cache_off_gives_no_key(monkeypatch):
+    monkeypatch.setenv("KM_PLOT_CACHE_MB", "0")
+    assert cache_key() is None
@@ -0,0 +1,63 @@
+import pytest
+
+list_ports_linux = pytest.importorskip("serial.tools.list_ports_linux")
+
+
+class FakeSysFS:
+    """What SysFS reads from sysfs, without touching it; every build is counted."""
+
+    built = []
+
+    def __init__(self, device):
+        self.device = device
+        self.subsystem = "platform" if "ttyS" in device else "usb-serial"
+        FakeSysFS.built.append(device)
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    """The device nodes present: {path: inode}. Changing an inode stands for a replug."""
+    present = {}
+    FakeSysFS.built = []
+    monkeypatch.setattr(list_ports_linux, "SysFS", FakeSysFS)
+    monkeypatch.setattr(list_ports_linux, "device_nodes", lambda include_links=False: sorted(present))
+    monkeypatch.setattr(
+        list_ports_linux.ComportsCache,
+        "identity",
+        staticmethod(lambda device: (device, present[device], None) if device in present else None),
+    )
+    return present
+
+
+def devices(ports):
+    return sorted(port.device for port in ports)
+
+
+def test_refresh_reports_what_changed(nodes):
+    cache = list_ports_linux.ComportsCache()
+    nodes.update({"/dev/ttyS0": 1, "/dev/ttyUSB0": 2})
+    added, removed, unchanged = cache.refresh()
+    assert (devices(added), devices(removed), devices(unchanged)) == (["/dev/ttyUSB0"], [], [])
+
+    nodes["/dev/ttyUSB1"] = 3
+    added, removed, unchanged = cache.refresh()
+    assert (devices(added), devices(removed), devices(unchanged)) == (["/dev/ttyUSB1"], [], ["/dev/ttyUSB0"])
+
+    # Replugged: same path, new node.
+    nodes["/dev/ttyUSB0"] = 4
+    del nodes["/dev/ttyUSB1"]
+    added, removed, unchanged = cache.refresh()
+    assert devices(added) == ["/dev/ttyUSB0"]
+    assert devices(removed) == ["/dev/ttyUSB0", "/dev/ttyUSB1"]
+    assert unchanged == []
+    assert devices(cache.ports()) == ["/dev/ttyUSB0"]
+
+
+def test_refresh_only_reads_new_nodes(nodes):
+    cache = list_ports_linux.ComportsCache()
+    nodes.update({"/dev/ttyS0": 1, "/dev/ttyS1": 2, "/dev/ttyUSB0": 3})
+    cache.refresh()
+    cache.refresh()
+    cache.refresh()
+    # Hidden platform ports are remembered as well, so nothing is built twice.
+    assert sorted(FakeSysFS.built) == ["/dev/ttyS0", "/dev/ttyS1", "/dev/ttyUSB0"]
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import hpgl
+import nesting
+
+TRIANGLE = np.array([(0, 0), (400, 0), (0, 300), (0, 0)])
+OVAL = np.array(
+    [(int(300 * np.cos(angle)), int(120 * np.sin(angle))) for angle in np.linspace(0, 2 * np.pi, 60)]
+)
+
+
+def gap(first, second):
+    """Distance between two convex counter-clockwise polygons, 0 when they overlap."""
+    def inside(points, polygon):
+        edges = np.roll(polygon, -1, axis=0) - polygon
+        rel = points[:, None, :] - polygon[None, :, :]
+        cross = edges[None, :, 0] * rel[..., 1] - edges[None, :, 1] * rel[..., 0]
+        return bool(np.any(np.all(cross >= 0, axis=1)))
+
+    if inside(first, second) or inside(second, first):
+        return 0.0
+    best = np.inf
+    for points, polygon in ((first, second), (second, first)):
+        edge = np.roll(polygon, -1, axis=0) - polygon
+        rel = points[:, None, :] - polygon[None]
+        t = np.clip((rel * edge[None]).sum(-1) / np.maximum((edge * edge).sum(-1), 1e-12)[None], 0.0, 1.0)
+        away = rel - t[..., None] * edge[None]
+        best = min(best, float(np.hypot(away[..., 0], away[..., 1]).min()))
+    return best
+
+
+@pytest.mark.parametrize("points", (TRIANGLE, OVAL), ids=("triangle", "oval"))
+@pytest.mark.parametrize("shape", nesting.SHAPES)
+@pytest.mark.parametrize("rotate", (False, True))
+def test_copies_keep_their_spacing(points, shape, rotate):
+    spacing = 40
+    layout = nesting.layout(points, 25, 1500, spacing, shape, rotate)
+    assert len(layout.offsets) == 25
+    base = layout.base(points)
+    outline = np.asarray(nesting.outline(base, shape), dtype=float)
+    copies = [outline + offset for offset in layout.offsets]
+    # Offsets move the design from where it already sits, so measure across from there.
+    origin = base.min(axis=0)
+    for index, first in enumerate(copies):
+        low, high = first.min(axis=0) - origin, first.max(axis=0) - origin
+        assert low[1] >= 0 and high[1] <= 1500
+        for second in copies[index + 1:]:
+            assert gap(first, second) >= spacing - 1e-6
+    # Interlocking hulls never need more roll than stacked boxes.
+    if shape == "hull":
+        assert layout.length <= nesting.layout(points, 25, 1500, spacing, "box", rotate).length
+
+
+def test_design_wider_than_the_media_is_refused():
+    with pytest.raises(ValueError):
+        nesting.layout(TRIANGLE, 3, 200, 10, "hull", rotate=False)
+
+
+def test_every_copy_is_the_design_moved():
+    blocks = hpgl.split_runs(";IN;SP1;PU0,0;PD400,0,0,300,0,0;SP2;PU100,50;PD150,60")
+    points = np.array([point for block in blocks if not isinstance(block, str) for path in block for point in path])
+    layout = nesting.layout(points, 7, 1500, 40, "hull", rotate=True)
+    text = "".join(nesting.iter_nested(blocks, layout, first_path=[(0, 0), (0, 80)]))
+
+    commands = [mnemonic + params for mnemonic, params in hpgl.iter_commands(text)]
+    assert commands.count("SP2") == 1
+    paths = [list(block) for block in hpgl.split_runs(text) if not isinstance(block, str)]
+    first_run, second_run = paths
+    assert first_run[0] == [(0, 0), (0, 80)]
+    base = layout.base(points)
+    expected = [base[:4] + offset for offset in layout.offsets]
+    assert [np.asarray(path).tolist() for path in first_run[1:]] == [copy.tolist() for copy in expected]
+    assert len(second_run) == 7
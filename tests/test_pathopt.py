@@ -0,0 +1,85 @@
+import math
+import random
+
+import pathopt
+
+
+def strokes(seed, count=300):
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(count):
+        x, y = rng.randint(20000, 25000), rng.randint(20000, 25000)
+        paths.append([(x, y), (x + rng.randint(-80, 80), y + rng.randint(-80, 80))])
+    return paths
+
+
+def test_order_paths_keeps_every_path_and_shortens_travel():
+    paths = strokes(1)
+    ordered, stats = pathopt.order_paths(paths)
+    assert sorted(map(sorted, ordered)) == sorted(map(sorted, paths))
+    assert stats["travel_after"] < stats["travel_before"] / 4
+    assert math.isclose(stats["travel_after"], pathopt.travel_distance(ordered))
+
+
+def test_first_path_is_the_nearest_even_from_far_away():
+    paths = strokes(2)
+    for start in ((0, 0), (-400000, 90000), (22500, 22500)):
+        ordered, _stats = pathopt.order_paths(paths, start=start, time_budget=0)
+        nearest = min(math.hypot(x - start[0], y - start[1]) for path in paths for x, y in (path[0], path[-1]))
+        first = ordered[0][0]
+        assert math.hypot(first[0] - start[0], first[1] - start[1]) == nearest
+
+
+def square(x, y, size):
+    return [(x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)]
+
+
+def nested_squares(seed):
+    """Groups of concentric squares (letters with counters, washers) and some open strokes, shuffled."""
+    rng = random.Random(seed)
+    paths = []
+    for _group in range(30):
+        x, y = rng.randint(0, 5000), rng.randint(0, 5000)
+        for depth in range(rng.randint(1, 4)):
+            paths.append(square(x + 10 * depth, y + 10 * depth, 100 - 20 * depth))
+    for _stroke in range(20):
+        x, y = rng.randint(0, 5000), rng.randint(0, 5000)
+        paths.append([(x, y), (x + rng.randint(1, 50), y + rng.randint(1, 50))])
+    rng.shuffle(paths)
+    return paths
+
+
+def positions(paths, ordered):
+    """Index in ``ordered`` of each path, however order_paths() rotated or reversed it."""
+    where = {frozenset(points): index for index, points in enumerate(ordered)}
+    return [where[frozenset(points)] for points in paths]
+
+
+def assert_inner_first(paths, ordered, prerequisites):
+    # A closed path may start at another vertex, so compare point sets.
+    assert sorted(sorted(set(points)) for points in ordered) == sorted(sorted(set(points)) for points in paths)
+    at = positions(paths, ordered)
+    for outer, inner in prerequisites.items():
+        for idx in inner:
+            assert at[idx] < at[outer]
+
+
+def test_prerequisites_are_the_contours_directly_inside():
+    paths = [square(0, 0, 100), square(10, 10, 80), square(20, 20, 60), square(500, 0, 100)]
+    assert pathopt.containment_prerequisites(paths) == {0: {1}, 1: {2}}
+
+
+def test_order_paths_never_cuts_an_outline_before_its_inside():
+    for seed in range(5):
+        paths = nested_squares(seed)
+        prerequisites = pathopt.containment_prerequisites(paths)
+        assert prerequisites
+        ordered, stats = pathopt.order_paths(paths, prerequisites=prerequisites)
+        assert_inner_first(paths, ordered, prerequisites)
+        assert stats["travel_after"] <= stats["travel_before"]
+
+
+def test_stable_order_never_cuts_an_outline_before_its_inside():
+    paths = nested_squares(1)
+    prerequisites = pathopt.containment_prerequisites(paths)
+    assert_inner_first(paths, pathopt.stable_order(paths, prerequisites), prerequisites)
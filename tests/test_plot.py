@@ -0,0 +1,250 @@
+import errno
+import mmap
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import plot
+
+
+class HeldPort:
+    """A port whose output queue stays full for ``held`` polls, as when the plotter sends XOFF."""
+
+    def __init__(self, held, port="/dev/ttyUSB0"):
+        self.held = held
+        self.port = port
+        self.flushed = False
+
+    @property
+    def out_waiting(self):
+        if self.held:
+            self.held -= 1
+            return 512
+        return 0
+
+    def flush(self):
+        self.flushed = True
+
+
+def engine():
+    return plot.PlotEngine(SimpleNamespace(options=SimpleNamespace(), debug=lambda _message: None))
+
+
+@pytest.fixture
+def quick_drain(monkeypatch):
+    monkeypatch.setattr(plot, "DRAIN_POLL", 0.0)
+    monkeypatch.setattr(plot, "DRAIN_STALL_SECONDS", 0.0)
+
+
+def test_drain_waits_for_a_plotter_holding_xoff(quick_drain, monkeypatch):
+    monkeypatch.setattr(plot, "port_present", lambda device: True)
+    ser = HeldPort(50)
+    engine().drain(ser)
+    assert ser.held == 0
+    assert ser.flushed
+
+
+def test_drain_fails_once_the_plotter_is_unplugged(quick_drain, monkeypatch):
+    monkeypatch.setattr(plot, "port_present", lambda device: False)
+    with pytest.raises(OSError) as raised:
+        engine().drain(HeldPort(50))
+    assert raised.value.errno == errno.ENODEV
+
+
+def test_drain_can_be_cancelled_while_held(quick_drain, monkeypatch):
+    monkeypatch.setattr(plot, "port_present", lambda device: True)
+    ser = HeldPort(10 ** 9)
+    ser.write = lambda data: None
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(plot.PlotCancelled):
+        engine().drain(ser, cancel)
+
+
+class SlowFlushPort:
+    """A port whose queue is empty but whose flush() (tcdrain) only returns once ``released`` is set."""
+
+    def __init__(self, port="/dev/ttyUSB0"):
+        self.port = port
+        self.out_waiting = 0
+        self.released = threading.Event()
+        self.flush_returned = threading.Event()
+        self.written = []
+
+    def flush(self):
+        self.released.wait(5)
+        self.flush_returned.set()
+
+    def reset_output_buffer(self):
+        self.released.set()
+
+    def write(self, data):
+        self.written.append(data)
+
+
+@pytest.fixture
+def quick_flush(quick_drain, monkeypatch):
+    monkeypatch.setattr(plot, "DRAIN_FLUSH_SECONDS", 0.05)
+
+
+def test_drain_keeps_waiting_for_a_slow_flush(quick_flush, monkeypatch):
+    monkeypatch.setattr(plot, "port_present", lambda device: True)
+    ser = SlowFlushPort()
+    threading.Timer(0.3, ser.released.set).start()
+    engine().drain(ser)
+    assert ser.flush_returned.is_set()
+
+
+def test_drain_gives_up_on_a_flush_once_the_plotter_is_unplugged(quick_flush, monkeypatch):
+    monkeypatch.setattr(plot, "port_present", lambda device: False)
+    ser = SlowFlushPort()
+    with pytest.raises(OSError) as raised:
+        engine().drain(ser)
+    assert raised.value.errno == errno.ENODEV
+    ser.released.set()
+
+
+def test_cancel_during_the_flush_ends_it_before_returning(quick_flush, monkeypatch):
+    monkeypatch.setattr(plot, "port_present", lambda device: True)
+    ser = SlowFlushPort()
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(plot.PlotCancelled):
+        engine().drain(ser, cancel)
+    # The port is only handed back for closing once tcdrain has returned.
+    assert ser.flush_returned.is_set()
+    assert ser.written == [plot.CANCEL_TRAILER]
+
+
+class BufferedPlotter:
+    """Answers ESC.B with the room left in a ``size``-byte buffer that empties by ``rate`` bytes per query."""
+
+    def __init__(self, size=1000, rate=300, answers=True):
+        self.size = size
+        self.rate = rate
+        self.answers = answers
+        self.buffered = 0
+        self.fullest = 0
+        self.reply = b""
+        self.received = bytearray()
+        self.port = "/dev/ttyUSB0"
+        self.out_waiting = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.reply)
+
+    def write(self, data):
+        if bytes(data) == plot.ESC_BUFFER_SPACE:
+            self.buffered = max(self.buffered - self.rate, 0)
+            if self.answers:
+                self.reply = f"{self.size - self.buffered}\r".encode()
+            return
+        self.received += data
+        if self.answers:
+            self.buffered += len(data)
+            self.fullest = max(self.fullest, self.buffered)
+
+    def read(self, size):
+        data, self.reply = self.reply[:size], self.reply[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self.reply = b""
+
+
+def job_chunks(count=80):
+    text = b"".join(b"PU%d,0;PD%d,500;" % (index, index) for index in range(count * 20))
+    return [text[start:start + plot.SEND_CHUNK_SIZE] for start in range(0, len(text), plot.SEND_CHUNK_SIZE)]
+
+
+def test_buffer_pacing_never_overfills_the_plotter(monkeypatch):
+    monkeypatch.setattr(plot, "BUFFER_POLL", 0.0)
+    ser = BufferedPlotter()
+    pacer = plot.BufferPacer(engine(), ser)
+    chunks = job_chunks()
+    for chunk in chunks:
+        pacer.write(chunk)
+    assert bytes(ser.received) == b"".join(chunks)
+    assert ser.fullest <= ser.size - plot.BUFFER_MARGIN
+    assert pacer.active and pacer.queries > 1
+
+
+def test_buffer_pacing_falls_back_to_flow_control_without_answers(monkeypatch):
+    monkeypatch.setattr(plot, "BUFFER_REPLY_TIMEOUT", 0.0)
+    ser = BufferedPlotter(answers=False)
+    pacer = plot.BufferPacer(engine(), ser)
+    chunks = job_chunks()
+    for chunk in chunks:
+        pacer.write(chunk)
+    assert bytes(ser.received) == b"".join(chunks)
+    assert not pacer.active and pacer.queries == 1
+
+
+def test_buffer_pacing_lets_go_of_a_mapped_job_when_a_write_fails():
+    def unplugged(_data):
+        raise OSError(errno.EIO, "Input/output error")
+
+    ser = BufferedPlotter()
+    ser.write = unplugged
+    pacer = plot.BufferPacer(engine(), ser)
+    pacer.credit = 100
+    data = mmap.mmap(-1, 4096)
+    view = memoryview(data)
+    # The traceback is kept, as it is while a send's error is being handled.
+    with pytest.raises(OSError) as raised:
+        with view[:1000] as chunk:
+            pacer.write(chunk)
+    view.release()
+    data.close()
+    assert raised.value.errno == errno.EIO
+
+
+def test_inkscape_encoder_output_is_sent_untouched(monkeypatch):
+    inkex = pytest.importorskip("inkex")
+    # Far apart, out of travel order, with an inner square after its outline.
+    raw = ";PU0,0;SP1;PU9000,9000;PD9400,9000,9400,9400,9000,9400,9000,9000;PU10,10;PD20,20;PU9100,9100;PD9200,9100,9200,9200,9100,9200,9100,9100;"
+    monkeypatch.setitem(sys.modules, "hpgl_encoder", SimpleNamespace(
+        hpglEncoder=lambda ext: SimpleNamespace(getHpgl=lambda: raw),
+    ))
+    monkeypatch.setenv("KM_PLOT_CACHE_MB", "0")
+    options = SimpleNamespace(encoder="inkscape", toolOffset=0.0, optimizeTravel=True, innerFirst=True)
+    ext = SimpleNamespace(
+        svg=inkex.load_svg(b'<svg xmlns="http://www.w3.org/2000/svg"/>').getroot(),
+        options=options,
+        current_vidpid=None,
+        debug=lambda _message: None,
+    )
+    assert "".join(plot.PlotEngine(ext).iter_hpgl()) == "IN" + raw + plot.JOB_TRAILER
+
+
+def test_estimate_counts_bytes_distances_and_time():
+    job = "IN;SP1;PU0,400;VS20;PD1200,400,1200,2000;PU0,400;SP0;IN; "
+    estimate = plot.PlotEngine(SimpleNamespace(
+        options=SimpleNamespace(**plot.PLOTTER_DEFAULTS), debug=lambda _message: None,
+    )).estimate_job(job)
+    assert estimate["bytes"] == len(job)
+    # 40 units per mm at 1016 dpi.
+    assert estimate["pen_down_mm"] == pytest.approx(30 + 40)
+    assert estimate["pen_up_mm"] == pytest.approx(10 + 50)
+    assert estimate["pen_lifts"] == 1
+    # 8N1 is ten bits a byte.
+    assert estimate["wire_seconds"] == pytest.approx(len(job) * 10 / 9600)
+    # 10 mm at the default speed, then 120 mm at VS20, and one lift.
+    motion = 1.0 / plot.DEFAULT_SPEED_CM_S + 12.0 / 20 + plot.PEN_LIFT_SECONDS
+    assert estimate["motion_seconds"] == pytest.approx(motion)
+    assert estimate["estimated_seconds"] == pytest.approx(max(motion, estimate["wire_seconds"]))
+    assert "roll_length_mm" not in estimate
+
+
+def test_estimate_only_reports_the_roll_length_of_its_own_job():
+    job = "IN;SP1;PU0,0;PD400,0;PU0,0;SP0;IN; "
+    nested = plot.PlotEngine(SimpleNamespace(
+        options=SimpleNamespace(**plot.PLOTTER_DEFAULTS), debug=lambda _message: None,
+    ))
+    # What a dry run of 200 copies leaves behind, before a finished .hpgl file is estimated.
+    nested.last_nesting = {"copies": 200, "roll_length_mm": 1234.0}
+    assert "roll_length_mm" not in nested.estimate_job(job)
+    assert nested.estimate_job(job, nested.last_nesting)["roll_length_mm"] == 1234.0
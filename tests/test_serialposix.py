@@ -0,0 +1,44 @@
+import mmap
+import os
+
+import pytest
+
+serialposix = pytest.importorskip("serial.serialposix")
+
+
+@pytest.fixture
+def port(pty):
+    port = serialposix.Serial(pty.path, write_timeout=5)
+    yield port
+    port.close()
+
+
+def test_write_takes_bytes_buffers_and_maps(pty, port):
+    data = bytes(range(256)) * 1200
+    mapped = mmap.mmap(-1, len(data))
+    mapped.write(data)
+    sent = b""
+    for payload in (data, bytearray(data), memoryview(data)[1000:], mapped, [72, 80, 59]):
+        assert port.write(payload) == len(payload)
+        sent += bytes(payload)
+    pty.wait_for(len(sent))
+    assert bytes(pty.received) == sent
+    mapped.close()
+
+
+def test_partial_writes_continue_where_they_stopped(pty, port, monkeypatch):
+    real_write = os.write
+    calls = []
+
+    def trickle(fd, chunk):
+        calls.append(type(chunk))
+        return real_write(fd, chunk[:7])
+
+    monkeypatch.setattr(serialposix.os, "write", trickle)
+    data = os.urandom(1000)
+    assert port.write(data) == len(data)
+    pty.wait_for(len(data))
+    assert bytes(pty.received) == data
+    assert len(calls) == 143
+    # Each retry is handed a view of the rest, not a copy of it.
+    assert set(calls) == {memoryview}
@@ -0,0 +1,141 @@
+import errno
+import json
+
+import pytest
+
+import hpgl
+import spool
+
+
+def finished_job(queue, index, state="done"):
+    job = queue.submit(f"IN;PU{index},0;PD{index},10;", "/dev/ttyUSB0", name=f"job{index}")
+    job.manifest.update(state=state, updated=1000.0 + index)
+    # Job.update() stamps the wall clock; fixed times keep the order certain.
+    spool.write_atomic(job.manifest_path, json.dumps(job.manifest).encode("utf8"))
+    return job
+
+
+def test_prune_keeps_the_newest_finished_jobs(tmp_path):
+    queue = spool.Spool(tmp_path)
+    states = ("done", "failed", "cancelled")
+    jobs = [finished_job(queue, index, states[index % 3]) for index in range(spool.KEEP_FINISHED + 5)]
+    waiting = queue.submit("IN;", "/dev/ttyUSB0")
+
+    queue.prune()
+
+    kept = {job.id for job in queue.jobs()}
+    assert kept == {job.id for job in jobs[5:]} | {waiting.id}
+    for job in jobs[:5]:
+        assert not job.manifest_path.exists()
+        assert not job.hpgl_path.exists()
+
+
+def test_prune_leaves_source_files(tmp_path):
+    queue = spool.Spool(tmp_path / "spool")
+    source = tmp_path / "sign.hpgl"
+    source.write_bytes(b"IN;PU0,0;PD10,10;")
+    old = queue.create("/dev/ttyUSB0", source=source)
+    old.manifest.update(state="done", updated=0.0)
+    spool.write_atomic(old.manifest_path, json.dumps(old.manifest).encode("utf8"))
+    for index in range(spool.KEEP_FINISHED):
+        finished_job(queue, index)
+
+    queue.prune()
+
+    assert queue.get(old.id) is None
+    assert source.exists()
+
+
+def reconnect(monkeypatch, tmp_path, checkpoint, port_id=None, device="/dev/ttyUSB0"):
+    """wait_for_device() for a job cut on ``device`` once ttyUSB1 and ttyUSB2 are plugged in."""
+    monkeypatch.setattr(spool, "RECONNECT_POLL", 0.0)
+    monkeypatch.setattr(spool, "RECONNECT_TIMEOUT", 0.05)
+    monkeypatch.setattr(spool, "list_usb_ports", lambda: [("/dev/ttyUSB1", "0403:6001"), ("/dev/ttyUSB2", "0403:6001")])
+    monkeypatch.setattr(
+        spool, "usb_port_identities", lambda: {"/dev/ttyUSB1": "0403:6001/A1", "/dev/ttyUSB2": "0403:6001/B2"}
+    )
+    queue = spool.Spool(tmp_path)
+    job = queue.submit("IN;PU0,0;PD10,10;", device, vidpid="0403:6001")
+    job.manifest.update(checkpoint=checkpoint, port_id=port_id)
+    return spool.SpoolRunner(queue, lambda _message: None).wait_for_device(job)
+
+
+def test_unstarted_job_may_move_to_a_plotter_of_the_same_model(monkeypatch, tmp_path):
+    assert reconnect(monkeypatch, tmp_path, 0) == "/dev/ttyUSB1"
+
+
+def test_started_job_only_resumes_on_its_own_plotter(monkeypatch, tmp_path):
+    assert reconnect(monkeypatch, tmp_path, 500, "0403:6001/B2") == "/dev/ttyUSB2"
+    assert reconnect(monkeypatch, tmp_path, 500, "0403:6001/C3") is None
+    assert reconnect(monkeypatch, tmp_path, 500) is None
+
+
+def test_started_job_is_not_resumed_on_another_plotter_at_its_path(monkeypatch, tmp_path):
+    assert reconnect(monkeypatch, tmp_path, 500, "0403:6001/A1", device="/dev/ttyUSB1") == "/dev/ttyUSB1"
+    assert reconnect(monkeypatch, tmp_path, 500, "0403:6001/C3", device="/dev/ttyUSB1") is None
+
+
+def test_resume_checks_the_plotter_before_sending(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, "RECONNECT_POLL", 0.0)
+    monkeypatch.setattr(spool, "RECONNECT_TIMEOUT", 0.0)
+    monkeypatch.setattr(spool, "usb_port_identities", lambda: {"/dev/ttyUSB0": "0403:6001/B2"})
+    opened = []
+    monkeypatch.setattr(spool.PlotEngine, "open_serial", lambda _engine, device: opened.append(device))
+    queue = spool.Spool(tmp_path)
+    job = queue.submit("IN;PU0,0;PD10,10;", "/dev/ttyUSB0", vidpid="0403:6001")
+    job.update(checkpoint=5, port_id="0403:6001/A1")
+
+    with pytest.raises(RuntimeError, match="did not come back"):
+        spool.SpoolRunner(queue, lambda _message: None).send(job)
+    assert opened == []
+    assert queue.get(job.id).state == "interrupted"
+    assert queue.get(job.id).manifest["checkpoint"] == 5
+
+
+def test_write_failing_mid_send_leaves_the_job_resumable(monkeypatch, tmp_path, pty):
+    serialposix = pytest.importorskip("serial.serialposix")
+    monkeypatch.setattr(spool, "RECONNECT_TIMEOUT", 0.0)
+    monkeypatch.setattr(spool, "list_usb_ports", lambda: [])
+    monkeypatch.setattr(spool, "usb_port_identities", lambda: {})
+    text = "IN;" + "".join(f"PU{index},0;PD{index},500;" for index in range(3000)) + "PU0,0;SP0;IN; "
+    queue = spool.Spool(tmp_path)
+    job = queue.submit(text, pty.path)
+    real_write = serialposix.os.write
+    written = [0]
+
+    def unplugged_midway(fd, data):
+        if written[0] > 20000:
+            raise OSError(errno.EIO, "Input/output error")
+        written[0] += len(data)
+        return real_write(fd, data)
+
+    # The real port writes straight from the job's mmap until the plotter goes away.
+    monkeypatch.setattr(serialposix.os, "write", unplugged_midway)
+    with pytest.raises(RuntimeError, match="did not come back"):
+        spool.SpoolRunner(queue, lambda _message: None).send(queue.claim(pty.path))
+    job = queue.get(job.id)
+    assert job.state == "interrupted"
+    assert 0 < job.manifest["checkpoint"] <= written[0] < len(text)
+
+    monkeypatch.setattr(serialposix.os, "write", real_write)
+    queue.requeue(job)
+    start, prefix = hpgl.resume_point(text, job.manifest["checkpoint"])
+    before = len(pty.received)
+    assert spool.SpoolRunner(queue, lambda _message: None).send(queue.claim(pty.path)) == pty.path
+    assert queue.get(job.id).state == "done"
+    pty.wait_for(before + len(prefix) + len(text) - start)
+    assert bytes(pty.received[before:]).decode("latin-1") == prefix + text[start:]
+
+
+def test_recut_only_takes_jobs_the_plotter_understands(tmp_path):
+    queue = spool.Spool(tmp_path)
+    plain = queue.submit("IN;PU0,0;PD10,10;", "/dev/ttyUSB0", vidpid="0403:6001", encoding="absolute")
+    plain.update(state="done")
+    compact = queue.submit("IN;PE<=...;", "/dev/ttyUSB0", vidpid="0403:6001", encoding="pe")
+    compact.update(state="done")
+
+    assert queue.last_done().id == compact.id
+    assert queue.last_done(["0403:6001"]).id == compact.id
+    assert queue.last_done(["1a86:7523"]).id == plain.id
+    assert queue.last_done([None]).id == plain.id
+    assert not queue.recut(compact, ["/dev/ttyUSB1"]).portable_to("1a86:7523")